@@ -0,0 +1,104 @@
+"""
+Benchmark ของการปรับข้อความก่อนอ่านออกเสียง (normalize_for_speech) บนข้อความแชทที่บันทึกไว้
+
+เปรียบเทียบข้อความดิบกับข้อความที่ผ่านการปรับแล้ว:
+- เวลาที่ใช้ต่อข้อความ
+- จำนวนตัวอักษรที่ต้องส่งไป gTTS
+- จำนวนข้อความที่ไม่ซ้ำกัน (ยิ่งน้อย แคชไฟล์เสียงยิ่ง hit บ่อย)
+
+วิธีใช้:
+    python benchmarks/bench_normalize.py [--corpus benchmarks/chat_corpus.jsonl] [--rounds 2000] [--show]
+
+ไฟล์ corpus เป็น JSON lines หนึ่งข้อความต่อหนึ่งบรรทัด
+mention ในไฟล์ตัวอย่างใช้ ID ผู้ใช้ 1001-1010, ยศ 2001-2002 และห้อง 3001-3002
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# ไม่ให้ benchmark เขียนฐานข้อมูลหรือแคชเสียงลงดิสก์
+os.environ.setdefault('GUILD_SETTINGS_DB', ':memory:')
+os.environ.setdefault('TTS_CACHE_MAX_ENTRIES', '0')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_corpus.jsonl')
+
+
+def build_guild():
+    """Guild จำลองที่มีสมาชิก ยศ และห้องตาม ID ที่ใช้ใน corpus"""
+    members = {i: SimpleNamespace(id=i, display_name=f"สมาชิก{i - 1000}") for i in range(1001, 1011)}
+    roles = {2001: SimpleNamespace(id=2001, name="เกมเมอร์"), 2002: SimpleNamespace(id=2002, name="แอดมิน")}
+    channels = {3001: SimpleNamespace(id=3001, name="ห้องเล่นเกม"), 3002: SimpleNamespace(id=3002, name="ห้องนั่งเล่น")}
+    return SimpleNamespace(id=1, get_member=members.get, get_role=roles.get, get_channel=channels.get)
+
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(texts):
+    spoken = [text for text in texts if text.strip()]
+    unique = len(set(spoken))
+    return {
+        'messages': len(spoken),
+        'chars': sum(len(text) for text in spoken),
+        'bytes': sum(len(text.encode('utf-8')) for text in spoken),
+        'unique': unique,
+        'cache_hit_rate': 1 - unique / len(spoken) if spoken else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--rounds', type=int, default=2000, help='จำนวนรอบที่วน corpus เพื่อจับเวลา')
+    parser.add_argument('--show', action='store_true', help='แสดงข้อความก่อน/หลังการปรับ')
+    parser.add_argument('--json', action='store_true', help='แสดงผลเป็น JSON')
+    args = parser.parse_args()
+
+    import mzsiri
+    mzsiri.chat_log.stop()
+
+    corpus = load_corpus(args.corpus)
+    guild = build_guild()
+    normalize = mzsiri.normalize_for_speech
+
+    normalized = [normalize(text, guild) for text in corpus]
+    if args.show:
+        for raw, text in zip(corpus, normalized):
+            print(f"{raw!r}\n  -> {text!r}")
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for text in corpus:
+            normalize(text, guild)
+    elapsed = time.perf_counter() - start
+
+    before = summarize(corpus)
+    after = summarize(normalized)
+    result = {
+        'corpus': os.path.basename(args.corpus),
+        'per_message_us': elapsed / (args.rounds * len(corpus)) * 1e6,
+        'before': before,
+        'after': after,
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    print(f"corpus:              {result['corpus']} ({len(corpus)} messages)")
+    print(f"normalize:           {result['per_message_us']:.2f} us/message")
+    print(f"messages to speak:   {before['messages']} -> {after['messages']}")
+    print(f"chars sent to gTTS:  {before['chars']} -> {after['chars']} "
+          f"({1 - after['chars'] / before['chars']:.0%} less)")
+    print(f"unique texts:        {before['unique']} -> {after['unique']}")
+    print(f"cache hit rate:      {before['cache_hit_rate']:.0%} -> {after['cache_hit_rate']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Microbenchmark ของ on_message: วัดจำนวนข้อความต่อวินาทีที่ผ่าน on_message ได้ด้วย event stream จำลอง
+
+ข้อความจำลองกระจายไปหลาย Guild โดยมีเพียงบาง Guild ที่มี session เสียงอยู่
+และมีเพียงบางช่องที่ถูกอ่านออกเสียง ซึ่งใกล้เคียงกับสัดส่วนจริงของบอทที่อยู่หลายเซิร์ฟเวอร์
+
+คิว log แชทถูกตั้งให้ใหญ่พอสำหรับทุกข้อความ เพื่อไม่ให้ log ถูกทิ้งระหว่างวัด (ใช้ --log-queue-size เพื่อจำลองขนาดจริง)
+และรายงานทั้ง throughput ของ on_message และ throughput รวมเวลาที่ thread เขียน log จนหมดคิว
+
+วิธีใช้:
+    python benchmarks/bench_on_message.py [--messages 200000] [--guilds 500] [--active 20] [--sample-rate 1.0]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# ไม่ให้ benchmark เขียนฐานข้อมูลหรือแคชเสียงลงดิสก์
+os.environ.setdefault('GUILD_SETTINGS_DB', ':memory:')
+os.environ.setdefault('TTS_CACHE_MAX_ENTRIES', '0')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+class FakeVoiceClient:
+    def is_connected(self):
+        return True
+
+
+def build_stream(mzsiri, count, guild_count, active_count, seed=1234):
+    """สร้าง Guild/ช่อง/ข้อความจำลอง และเปิด session เสียงให้ active_count Guild แรก"""
+    rng = random.Random(seed)
+    guilds = []
+    for guild_id in range(1, guild_count + 1):
+        channels = [SimpleNamespace(id=guild_id * 100 + i, name=f"chat-{i}") for i in range(5)]
+        guild = SimpleNamespace(id=guild_id, name=f"guild-{guild_id}", voice_client=None, channels=channels)
+        if guild_id <= active_count:
+            guild.voice_client = FakeVoiceClient()
+            queue = mzsiri.SpeechQueue(maxsize=1_000_000, dedupe_window=0)
+            mzsiri.voice_sessions.attach(mzsiri.VoiceSession(guild, queue=queue))
+            mzsiri.guild_settings.update(guild_id, designated_channel_id=channels[0].id)
+        guilds.append(guild)
+
+    authors = [SimpleNamespace(id=i, display_name=f"user{i}") for i in range(1000)]
+    words = ["สวัสดี", "555", "ไปไหนกัน", "hello", "gg", "ok", "ฮ่าๆ", "กินข้าวยัง", "https://example.com"]
+    messages = []
+    for _ in range(count):
+        guild = rng.choice(guilds)
+        messages.append(SimpleNamespace(
+            author=rng.choice(authors),
+            guild=guild,
+            channel=rng.choice(guild.channels),
+            content=" ".join(rng.choice(words) for _ in range(rng.randint(1, 6))),
+        ))
+    return messages
+
+
+async def run(mzsiri, messages):
+    on_message = mzsiri.on_message
+    start = time.perf_counter()
+    for message in messages:
+        await on_message(message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--active', type=int, default=20, help='จำนวน Guild ที่มี session เสียง')
+    parser.add_argument('--sample-rate', type=float, default=None, help='CHAT_LOG_SAMPLE_RATE ที่จะใช้ทดสอบ')
+    parser.add_argument('--log-queue-size', type=int, default=None,
+                        help='CHAT_LOG_QUEUE_SIZE (ค่าเริ่มต้น: เท่าจำนวนข้อความ เพื่อไม่ให้ log ถูกทิ้ง)')
+    parser.add_argument('--show-log', action='store_true', help='แสดง log แชทออกทาง stderr')
+    args = parser.parse_args()
+
+    if args.sample_rate is not None:
+        os.environ['CHAT_LOG_SAMPLE_RATE'] = str(args.sample_rate)
+    os.environ['CHAT_LOG_QUEUE_SIZE'] = str(args.log_queue_size or args.messages + 1)
+
+    import mzsiri
+
+    if not args.show_log:
+        # ยังจัดรูปแบบและเขียนจริงทุกบรรทัด แต่เขียนทิ้งแทนการพิมพ์ออก stderr
+        mzsiri.chat_log.handler.targets = [logging.StreamHandler(open(os.devnull, 'w'))]
+
+    messages = build_stream(mzsiri, args.messages, args.guilds, args.active)
+    start = time.perf_counter()
+    elapsed = asyncio.run(run(mzsiri, messages))
+    # รอ thread เขียน log ที่ค้างในคิวให้หมด เพื่อให้ตัวเลขรวมงาน log ทั้งหมดจริงๆ
+    mzsiri.chat_log.stop()
+    total = time.perf_counter() - start
+
+    queued = sum(session.queue.qsize() for session in mzsiri.voice_sessions.values())
+    dropped = mzsiri.chat_log.dropped
+    print(f"messages:        {len(messages)}")
+    print(f"elapsed:         {elapsed:.3f} s (on_message), {total:.3f} s (including chat log drain)")
+    print(f"throughput:      {len(messages) / elapsed:,.0f} msg/s (on_message), "
+          f"{len(messages) / total:,.0f} msg/s (including chat log drain)")
+    print(f"per message:     {elapsed / len(messages) * 1e6:.2f} us")
+    print(f"queued for TTS:  {queued}")
+    print(f"chat log drops:  {dropped} ({dropped / len(messages):.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+เปรียบเทียบ CPU ที่ใช้ต่อเสียง 1 วินาที ระหว่างเส้นทางเล่นเสียงแบบ PCM และแบบ Opus
+
+- pcm:        FFmpegPCMAudio + discord.opus.Encoder (สิ่งที่ discord.py ทำทุกเฟรมเมื่อ source ไม่ใช่ Opus)
+- opus:       FFmpegOpusAudio ให้ FFmpeg encode Opus เอง บอทแค่ส่งต่อ packet
+- opus-cached: FFmpegOpusAudio(codec='copy') จากไฟล์ .opus ที่ encode ไว้แล้ว (เหมือนไฟล์ในแคช TTS)
+
+วิธีใช้:
+    python benchmarks/bench_opus_vs_pcm.py [--seconds 30] [--runs 3] [--input clip.mp3] [--json out.json]
+
+ต้องมี ffmpeg ใน PATH และ libopus ที่ discord.py โหลดได้
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+from discord.opus import Encoder
+
+
+def cpu_times():
+    """คืน (CPU ของโปรเซสบอท, CPU ของโปรเซสลูกที่จบไปแล้ว เช่น FFmpeg) หน่วยวินาที"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def make_input(path, seconds):
+    """สร้างไฟล์ MP3 ทดสอบความยาวตามที่กำหนด"""
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+         '-i', f'sine=frequency=440:duration={seconds}', '-ac', '1', '-ar', '24000', path],
+        check=True)
+
+
+def make_opus(input_path, output_path, bitrate):
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path, '-map_metadata', '-1',
+         '-c:a', 'libopus', '-ar', '48000', '-ac', '2', '-b:a', f'{bitrate}k', output_path],
+        check=True)
+
+
+def drain_pcm(path):
+    """อ่านเฟรม PCM ทั้งหมดแล้ว encode เป็น Opus แบบเดียวกับ VoiceClient"""
+    source = discord.FFmpegPCMAudio(path)
+    encoder = Encoder()
+    frames = 0
+    try:
+        while True:
+            data = source.read()
+            if not data:
+                break
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            frames += 1
+    finally:
+        source.cleanup()
+    return frames
+
+
+def drain_opus(path, bitrate, copy):
+    source = discord.FFmpegOpusAudio(path, codec='copy') if copy else discord.FFmpegOpusAudio(path, bitrate=bitrate)
+    frames = 0
+    try:
+        while True:
+            data = source.read()
+            if not data:
+                break
+            frames += 1
+    finally:
+        source.cleanup()
+    return frames
+
+
+def measure(name, fn, runs):
+    results = []
+    for _ in range(runs):
+        own_before, children_before = cpu_times()
+        wall_before = time.perf_counter()
+        frames = fn()
+        wall = time.perf_counter() - wall_before
+        own_after, children_after = cpu_times()
+        audio_seconds = frames * Encoder.FRAME_LENGTH / 1000
+        results.append({
+            'audio_seconds': audio_seconds,
+            'wall_seconds': wall,
+            'bot_cpu_per_audio_second': (own_after - own_before) / audio_seconds,
+            'ffmpeg_cpu_per_audio_second': (children_after - children_before) / audio_seconds,
+        })
+    best = min(results, key=lambda r: r['bot_cpu_per_audio_second'])
+    best['mode'] = name
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=30, help='ความยาวเสียงทดสอบ (เมื่อไม่ระบุ --input)')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--bitrate', type=int, default=int(os.getenv('TTS_OPUS_BITRATE', '64')))
+    parser.add_argument('--input', help='ไฟล์เสียงที่จะใช้ทดสอบ (เช่นไฟล์จาก gTTS)')
+    parser.add_argument('--json', help='บันทึกผลเป็น JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = args.input
+        if not input_path:
+            input_path = os.path.join(workdir, 'input.mp3')
+            make_input(input_path, args.seconds)
+        opus_path = os.path.join(workdir, 'input.opus')
+        make_opus(input_path, opus_path, args.bitrate)
+
+        results = [
+            measure('pcm', lambda: drain_pcm(input_path), args.runs),
+            measure('opus', lambda: drain_opus(input_path, args.bitrate, copy=False), args.runs),
+            measure('opus-cached', lambda: drain_opus(opus_path, args.bitrate, copy=True), args.runs),
+        ]
+
+    print(f"{'mode':<12} {'bot CPU ms/s':>14} {'ffmpeg CPU ms/s':>16} {'audio s':>9}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['bot_cpu_per_audio_second'] * 1000:>14.2f} "
+              f"{r['ffmpeg_cpu_per_audio_second'] * 1000:>16.2f} {r['audio_seconds']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'discord.py': discord.__version__, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
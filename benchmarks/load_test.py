@@ -0,0 +1,736 @@
+"""
+Load test แบบออฟไลน์ของทั้งบอท: Discord Gateway จำลอง + VoiceClient จำลอง + gTTS/Gemini จำลอง
+
+ส่งเหตุการณ์ผ่าน bot.dispatch เหมือนที่ Gateway จริงทำ จึงวิ่งผ่าน on_message, คำสั่ง (!เข้ามา, !ถาม, !ai,
+!ttsstats, !setspeed, !ไปไกลๆ) และ audio_player_task ตัวจริงทั้งหมด ส่วนที่ถูกแทนที่มีเพียงขอบนอกของระบบ:
+- Gateway/REST: ข้อความถูก dispatch ตรงๆ และ ctx.send/edit ถูกบันทึกแทนการเรียก HTTP
+- VoiceClient: thread เดียวอ่านเฟรมเสียงจากทุก Guild ตามเวลาจริง (20 ms ต่อเฟรม) และเรียก callback after
+  จาก thread นั้น เหมือน AudioPlayer ของ discord.py
+- gTTS: ใช้ HTTP backend คุยกับ benchmarks/tts_stub_server.py ที่รันเป็นโปรเซสแยก (ไม่นับ CPU/RSS ของ stub)
+- Gemini: model จำลองที่หน่วงเวลาและ stream คำตอบทีละท่อน
+- FFmpeg: ใช้ source จำลองที่ยาวเท่าเสียงจริง (ใช้ --ffmpeg เพื่อใช้ FFmpeg จริงถ้ามีในเครื่อง)
+
+ผลลัพธ์ (throughput, latency ข้อความ→เสียง, CPU, RSS, event loop lag ฯลฯ) ถูกบันทึกเป็น JSON
+เพื่อเทียบกับผลของเวอร์ชันก่อนหน้าด้วย --compare
+
+วิธีใช้:
+    python benchmarks/load_test.py [--guilds 200] [--rate 0.5] [--duration 60] [--output result.json]
+    python benchmarks/load_test.py --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, ROOT_DIR)
+
+FRAME_SECONDS = 0.02  # discord.py ส่งเสียงทีละ 20 ms
+FRAME_BYTES = 3840  # PCM 48 kHz stereo 16-bit ยาว 20 ms
+
+
+def percentiles(samples):
+    """สรุป latency เป็น percentile (หน่วยวินาที)"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': ordered[-1],
+    }
+
+
+def rss_mb():
+    """RSS ปัจจุบันของโปรเซส (MB) อ่านจาก /proc ถ้ามี"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1_048_576
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime, usage.ru_stime
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# --- เสียงจำลอง ---
+
+def clip_duration(clip):
+    """ความยาวเสียงของคลิป (วินาที) หลังปรับความเร็วแล้ว"""
+    try:
+        if clip.data is not None:
+            with wave.open(io.BytesIO(clip.data)) as wav:
+                seconds = wav.getnframes() / wav.getframerate()
+        elif clip.path.endswith('.wav'):
+            with wave.open(clip.path) as wav:
+                seconds = wav.getnframes() / wav.getframerate()
+        else:
+            # MP3 จาก gTTS ประมาณ 32 kbps
+            seconds = os.path.getsize(clip.path) / 4000
+    except (OSError, EOFError, wave.Error):
+        seconds = 1.0
+    return seconds / (clip.tempo or 1.0)
+
+
+class FakeAudioSource:
+    """AudioSource ที่ให้เฟรมเงียบจำนวนเท่ากับความยาวเสียงจริงของคลิป แทน FFmpegPCMAudio"""
+
+    def __init__(self, clip):
+        self.frames_left = max(1, math.ceil(clip_duration(clip) / FRAME_SECONDS))
+        self.seconds = self.frames_left * FRAME_SECONDS
+
+    def read(self):
+        if self.frames_left <= 0:
+            return b''
+        self.frames_left -= 1
+        return b'\0' * FRAME_BYTES
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        pass
+
+
+class VoicePlaybackThread(threading.Thread):
+    """
+    อ่านเฟรมเสียงของทุก FakeVoiceClient ตามเวลาจริงใน thread เดียว
+    (discord.py จริงใช้ thread ละหนึ่ง Guild แต่ที่หลายร้อย Guild thread เดียวรบกวนผลวัดน้อยกว่า)
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True, name='fake-voice')
+        self._lock = threading.Lock()
+        self._playing = {}
+        self._stopped = threading.Event()
+
+    def add(self, client, source, after):
+        with self._lock:
+            self._playing[client] = [source, after, time.monotonic(), 0]
+
+    def remove(self, client):
+        with self._lock:
+            return self._playing.pop(client, None)
+
+    def is_playing(self, client):
+        return client in self._playing
+
+    def run(self):
+        while not self._stopped.wait(FRAME_SECONDS):
+            now = time.monotonic()
+            finished = []
+            with self._lock:
+                for client, state in self._playing.items():
+                    source, _, started, sent = state
+                    due = int((now - started) / FRAME_SECONDS) + 1
+                    while sent < due:
+                        if not source.read():
+                            finished.append(client)
+                            break
+                        sent += 1
+                    state[3] = sent
+            for client in finished:
+                state = self.remove(client)
+                if state:
+                    client.finish(state[0], state[1])
+
+    def stop(self):
+        self._stopped.set()
+
+
+class FakeVoiceClient:
+    """VoiceClient จำลอง: เชื่อมต่อทันทีและเล่นเสียงผ่าน VoicePlaybackThread"""
+
+    def __init__(self, gateway, channel):
+        self.gateway = gateway
+        self.channel = channel
+        self.guild = channel.guild
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self.gateway.player.is_playing(self)
+
+    def play(self, source, *, after=None):
+        if self.is_playing():
+            raise RuntimeError('Already playing audio.')
+        # ให้เฟรมแรกออกทันทีเหมือน AudioPlayer ที่เริ่มอ่าน source ตอนเริ่ม thread
+        if not source.read():
+            self.finish(source, after)
+            return
+        self.gateway.player.add(self, source, after)
+
+    def finish(self, source, after, error=None):
+        source.cleanup()
+        if after is not None:
+            after(error)
+
+    def stop(self):
+        state = self.gateway.player.remove(self)
+        if state:
+            self.finish(state[0], state[1])
+
+    async def move_to(self, channel):
+        before = self.channel
+        self.channel = channel
+        await self.gateway.voice_state(self.gateway.bot_member(self.guild), before, channel)
+
+    async def disconnect(self, *, force=False):
+        if not self._connected:
+            return
+        self._connected = False
+        self.stop()
+        self.guild.voice_client = None
+        await self.gateway.voice_state(self.gateway.bot_member(self.guild), self.channel, None)
+
+
+# --- Gemini จำลอง ---
+
+class FakeGeminiModel:
+    """แทน genai.GenerativeModel: รอ latency แล้วตอบเป็นประโยคภาษาไทยหลายประโยค (stream ทีละประโยคได้)"""
+
+    def __init__(self, latency, chunk_delay, sentences, rng):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.sentences = sentences
+        self.rng = rng
+        self.requests = 0
+
+    def _answer(self, question):
+        count = self.rng.randint(2, 5)
+        return [f"เรื่อง {question[:20]} นั้น ", *(self.rng.choice(self.sentences) + " " for _ in range(count))]
+
+    async def generate_content_async(self, question, stream=False):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        parts = self._answer(question)
+        if not stream:
+            return SimpleNamespace(text=''.join(parts))
+        return self._stream(parts)
+
+    async def _stream(self, parts):
+        for part in parts:
+            yield SimpleNamespace(text=part)
+            await asyncio.sleep(self.chunk_delay)
+
+
+# --- Gateway จำลอง ---
+
+class FakeGateway:
+    """
+    สร้าง Guild, ช่อง และสมาชิกจำลอง และส่งเหตุการณ์เข้าบอทผ่าน bot.dispatch
+    การตอบกลับของคำสั่ง (ctx.send / message.edit) ถูกบันทึกเวลาไว้เพื่อวัด latency ของคำสั่ง
+    """
+
+    def __init__(self, mzsiri, guild_count, humans_per_channel):
+        self.mzsiri = mzsiri
+        self.bot = mzsiri.bot
+        self.player = VoicePlaybackThread()
+        self.user = SimpleNamespace(id=1, name='mzsiri', display_name='mzsiri', bot=True, mention='<@1>')
+        self.guilds = [self._make_guild(guild_id, humans_per_channel) for guild_id in range(1, guild_count + 1)]
+        self._next_message_id = 1
+        self.dispatched = {}
+        self.command_latency = {}
+        self.responses = 0
+        self.errors = 0
+
+    def _make_guild(self, guild_id, humans):
+        guild = SimpleNamespace(id=guild_id, name=f"guild-{guild_id}", voice_client=None)
+        members = {}
+        voice_channel = SimpleNamespace(id=guild_id * 100, name='voice', guild=guild, members=[])
+        voice_channel.connect = lambda **kwargs: self._connect(voice_channel)
+        for index in range(humans):
+            member_id = guild_id * 10_000 + index
+            member = SimpleNamespace(id=member_id, name=f"user{index}", display_name=f"ผู้ใช้{index}", bot=False,
+                                     guild=guild, roles=[], mention=f"<@{member_id}>",
+                                     voice=SimpleNamespace(channel=voice_channel))
+            members[member_id] = member
+            voice_channel.members.append(member)
+        guild.members = list(members.values())
+        guild.tts_channel = SimpleNamespace(id=guild_id * 100 + 1, name='tts', guild=guild, mention=f"<#{guild_id}01>")
+        guild.chat_channel = SimpleNamespace(id=guild_id * 100 + 2, name='chat', guild=guild, mention=f"<#{guild_id}02>")
+        guild.voice_channel = voice_channel
+        guild.get_member = members.get
+        guild.get_role = lambda role_id: None
+        guild.get_channel = {c.id: c for c in (guild.tts_channel, guild.chat_channel, voice_channel)}.get
+        guild.bot_member = SimpleNamespace(id=self.user.id, name=self.user.name, display_name=self.user.name,
+                                           bot=True, guild=guild)
+        return guild
+
+    def bot_member(self, guild):
+        return guild.bot_member
+
+    async def start(self):
+        """ทำขั้นตอนเดียวกับตอน login: ผูก event loop, ตั้ง bot.user, เรียก setup_hook แล้วส่ง READY"""
+        bot = self.bot
+        await bot._async_setup_hook()
+        bot._connection.user = self.user
+        default_on_error = bot.on_error
+
+        async def on_error(event, *args, **kwargs):
+            self.errors += 1
+            await default_on_error(event, *args, **kwargs)
+
+        bot.on_error = on_error
+        self.player.start()
+        await bot.setup_hook()
+        bot.dispatch('ready')
+
+    def stop(self):
+        self.player.stop()
+
+    async def _connect(self, channel):
+        guild = channel.guild
+        guild.voice_client = FakeVoiceClient(self, channel)
+        await self.voice_state(self.bot_member(guild), None, channel)
+        return guild.voice_client
+
+    async def voice_state(self, member, before, after):
+        if after is not None and member not in after.members:
+            after.members.append(member)
+        if before is not None and member in before.members:
+            before.members.remove(member)
+        self.bot.dispatch('voice_state_update', member,
+                          SimpleNamespace(channel=before), SimpleNamespace(channel=after))
+
+    def message(self, guild, channel, content, kind, author=None):
+        """ส่ง MESSAGE_CREATE เข้าบอท"""
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        author = author or guild.members[message_id % len(guild.members)]
+        message = SimpleNamespace(id=message_id, content=content, guild=guild, channel=channel, author=author,
+                                  mentions=[], attachments=[], _state=self.bot._connection,
+                                  kind=kind, dispatched_at=time.monotonic())
+        self.dispatched[kind] = self.dispatched.get(kind, 0) + 1
+        self.bot.dispatch('message', message)
+        return message
+
+    async def respond(self, origin, content=None, **kwargs):
+        """แทน REST API ส่งข้อความ: บันทึกเวลาตั้งแต่ dispatch จนถึงคำตอบล่าสุดของคำสั่ง"""
+        self.responses += 1
+        self.command_latency[origin.id] = (origin.kind, time.monotonic() - origin.dispatched_at)
+        reply = SimpleNamespace(content=content)
+
+        async def edit(content=None, **kwargs):
+            reply.content = content
+            self.responses += 1
+            self.command_latency[origin.id] = (origin.kind, time.monotonic() - origin.dispatched_at)
+            return reply
+
+        reply.edit = edit
+        return reply
+
+    def command_latency_by_kind(self):
+        by_kind = {}
+        for kind, seconds in self.command_latency.values():
+            by_kind.setdefault(kind, []).append(seconds)
+        return {kind: percentiles(samples) for kind, samples in sorted(by_kind.items())}
+
+
+def install_context_send(gateway):
+    """ให้ ctx.send ของคำสั่งไปที่ FakeGateway แทน HTTP API (Context.send ไม่ได้เรียก channel.send)"""
+    from discord.ext import commands
+
+    async def send(ctx, content=None, **kwargs):
+        return await gateway.respond(ctx.message, content, **kwargs)
+
+    commands.Context.send = send
+
+
+# --- การรันโหลด ---
+
+class LoopLagMonitor:
+    """วัดว่า event loop ตื่นช้ากว่ากำหนดเท่าไร (ถ้ามีงานหนักบน loop ค่านี้จะสูง)"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+
+def load_texts(args):
+    with open(args.corpus, encoding='utf-8') as f:
+        chat = [json.loads(line) for line in f if line.strip()]
+    with open(os.path.join(ROOT_DIR, 'qa_data.json'), encoding='utf-8') as f:
+        questions = list(json.load(f))
+    return chat, questions
+
+
+async def drive(mzsiri, gateway, args, rng):
+    """เข้าห้องเสียงทุก Guild, ส่งข้อความตามอัตราที่กำหนดจนครบเวลา, รอคิวเล่นจบ แล้วออกจากห้อง"""
+    chat, questions = load_texts(args)
+    utterances = []
+
+    original_record = mzsiri.record_utterance
+
+    def record_utterance(guild, item, clip, source, play_started_at, finished_at):
+        original_record(guild, item, clip, source, play_started_at, finished_at)
+        if source.first_frame_at is not None:
+            kind = 'chat' if item.author_id is not None else 'answer'
+            utterances.append((kind, source.first_frame_at - item.created_at, clip.cached,
+                               finished_at - source.first_frame_at))
+
+    mzsiri.record_utterance = record_utterance
+
+    await gateway.start()
+    for guild in gateway.guilds:
+        gateway.message(guild, guild.tts_channel, '!เข้ามา', 'join')
+        if rng.random() < args.speed_variety:
+            gateway.message(guild, guild.tts_channel, f"!setspeed {rng.choice([1.0, 1.5, 1.8])}", 'setspeed')
+    # รอให้ทุก Guild เชื่อมต่อเสร็จก่อนเริ่มจับเวลา
+    deadline = time.monotonic() + 30
+    while len(mzsiri.voice_sessions) < len(gateway.guilds) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    lag = LoopLagMonitor()
+    lag.start()
+    cpu_before = cpu_seconds()
+    started = time.monotonic()
+    total_rate = args.rate * len(gateway.guilds)
+    sent = 0
+    kinds = (('ask', args.ask_ratio), ('ai', args.ai_ratio), ('stats', args.stats_ratio),
+             ('offtopic', args.offtopic_ratio))
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= args.duration:
+            break
+        due = int(elapsed * total_rate) - sent
+        for _ in range(due):
+            guild = rng.choice(gateway.guilds)
+            roll = rng.random()
+            kind = 'chat'
+            for name, ratio in kinds:
+                if roll < ratio:
+                    kind = name
+                    break
+                roll -= ratio
+            if kind == 'ask':
+                gateway.message(guild, guild.tts_channel, f"!ถาม {rng.choice(questions)}", kind)
+            elif kind == 'ai':
+                gateway.message(guild, guild.tts_channel, f"!ai {rng.choice(questions)}", kind)
+            elif kind == 'stats':
+                gateway.message(guild, guild.tts_channel, '!ttsstats', kind)
+            elif kind == 'offtopic':
+                gateway.message(guild, guild.chat_channel, rng.choice(chat), kind)
+            else:
+                gateway.message(guild, guild.tts_channel, rng.choice(chat), kind)
+        sent += due
+        await asyncio.sleep(0.01)
+    sending_seconds = time.monotonic() - started
+
+    # รอให้คิวของทุก Guild เล่นจบ (ไม่เกิน --drain วินาที)
+    sessions = mzsiri.voice_sessions.values()
+    drain_started = time.monotonic()
+    pending = [asyncio.create_task(session.queue.join()) for session in sessions]
+    done, not_done = await asyncio.wait(pending, timeout=args.drain) if pending else ((), ())
+    for task in not_done:
+        task.cancel()
+    drain_seconds = time.monotonic() - drain_started
+    total_seconds = time.monotonic() - started
+    cpu_after = cpu_seconds()
+    lag.stop()
+
+    queue_totals = {}
+    for session in sessions:
+        for name, value in session.queue.stats().items():
+            if name in ('dropped', 'merged', 'deduped', 'depth'):
+                queue_totals[name] = queue_totals.get(name, 0) + value
+    tts_backends = mzsiri.tts_router.stats()
+    synthesis_pool = {k: v for k, v in mzsiri.synthesis_pool.stats().items() if k != 'queue_depth_per_guild'}
+    tts_cache = mzsiri.tts_cache.stats()
+
+    for guild in gateway.guilds:
+        gateway.message(guild, guild.tts_channel, '!ไปไกลๆ', 'leave')
+    deadline = time.monotonic() + 30
+    while len(mzsiri.voice_sessions) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    mzsiri.record_utterance = original_record
+
+    user_cpu = cpu_after[0] - cpu_before[0]
+    system_cpu = cpu_after[1] - cpu_before[1]
+    spoken_seconds = sum(u[3] for u in utterances)
+    return {
+        'messages': {
+            'dispatched': dict(sorted(gateway.dispatched.items())),
+            'sent_during_load': sent,
+            'sending_seconds': sending_seconds,
+            'rate_per_second': sent / sending_seconds if sending_seconds else 0.0,
+        },
+        'speech': {
+            'utterances': len(utterances),
+            'utterances_per_second': len(utterances) / total_seconds,
+            'audio_seconds': spoken_seconds,
+            'cached_ratio': sum(1 for u in utterances if u[2]) / len(utterances) if utterances else 0.0,
+            'drained': not not_done,
+            'drain_seconds': drain_seconds,
+            'queue': queue_totals,
+        },
+        'latency': {
+            'message_to_speech': percentiles([u[1] for u in utterances if u[0] == 'chat']),
+            'answer_to_speech': percentiles([u[1] for u in utterances if u[0] == 'answer']),
+            'command_response': gateway.command_latency_by_kind(),
+            'event_loop_lag': percentiles(lag.samples),
+        },
+        'process': {
+            'cpu_user_seconds': user_cpu,
+            'cpu_system_seconds': system_cpu,
+            'cpu_percent': (user_cpu + system_cpu) / total_seconds * 100,
+            'rss_mb': rss_mb(),
+            'rss_peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'threads': threading.active_count(),
+        },
+        'tts_backends': tts_backends,
+        'synthesis_pool': synthesis_pool,
+        'tts_cache': tts_cache,
+        'gemini_requests': mzsiri._gemini_model.requests,
+        'event_errors': gateway.errors,
+        'sessions_left_open': len(mzsiri.voice_sessions),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(args):
+    """รัน tts_stub_server.py เป็นโปรเซสแยก แล้วรอจนรับการเชื่อมต่อได้"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'tts_stub_server.py'), '--port', str(port),
+         '--latency', str(args.tts_latency), '--jitter', str(args.tts_jitter),
+         '--error-rate', str(args.tts_error_rate), '--ms-per-char', str(args.ms_per_char)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process, f"http://127.0.0.1:{port}/"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('stub TTS server did not start')
+
+
+def print_summary(result):
+    r = result['results']
+    msg, speech, latency, proc = r['messages'], r['speech'], r['latency'], r['process']
+    print(f"guilds:              {result['config']['guilds']}")
+    print(f"messages:            {msg['sent_during_load']} in {msg['sending_seconds']:.1f} s "
+          f"({msg['rate_per_second']:,.1f} msg/s) {msg['dispatched']}")
+    print(f"utterances:          {speech['utterances']} ({speech['utterances_per_second']:.1f}/s, "
+          f"{speech['audio_seconds']:.0f} s of audio, cached {speech['cached_ratio']:.0%}) "
+          f"drained={speech['drained']} queue={speech['queue']}")
+    for name in ('message_to_speech', 'answer_to_speech', 'event_loop_lag'):
+        stats = latency[name]
+        if stats['count']:
+            print(f"{name + ':':<21}p50 {stats['p50'] * 1000:.0f} ms | p95 {stats['p95'] * 1000:.0f} ms | "
+                  f"p99 {stats['p99'] * 1000:.0f} ms | max {stats['max'] * 1000:.0f} ms (n={stats['count']})")
+    for kind, stats in latency['command_response'].items():
+        print(f"{'!' + kind + ':':<21}p50 {stats['p50'] * 1000:.0f} ms | p95 {stats['p95'] * 1000:.0f} ms "
+              f"(n={stats['count']})")
+    print(f"cpu:                 {proc['cpu_percent']:.0f}% of one core "
+          f"(user {proc['cpu_user_seconds']:.1f} s, sys {proc['cpu_system_seconds']:.1f} s)")
+    rss = f"{proc['rss_mb']:.0f} MB" if proc['rss_mb'] is not None else '-'
+    print(f"rss:                 {rss} (peak {proc['rss_peak_mb']:.0f} MB), threads {proc['threads']}")
+    pool = r['synthesis_pool']
+    print(f"synthesis pool:      wait p95 {pool['wait_p95'] * 1000:.0f} ms, run avg {pool['run_avg'] * 1000:.0f} ms, "
+          f"failed {pool['failed']}")
+
+
+COMPARE_METRICS = (
+    ('messages.rate_per_second', 'higher'),
+    ('speech.utterances_per_second', 'higher'),
+    ('latency.message_to_speech.p50', 'lower'),
+    ('latency.message_to_speech.p95', 'lower'),
+    ('latency.message_to_speech.p99', 'lower'),
+    ('latency.answer_to_speech.p95', 'lower'),
+    ('latency.event_loop_lag.p99', 'lower'),
+    ('process.cpu_percent', 'lower'),
+    ('process.rss_peak_mb', 'lower'),
+    ('synthesis_pool.wait_p95', 'lower'),
+)
+
+
+def lookup(result, dotted):
+    value = result['results']
+    for part in dotted.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def print_comparison(baseline, current):
+    """แสดงตัวเลขหลักเทียบกับผลรันก่อนหน้า (เปลี่ยนไปในทางแย่ลงเกิน 10% จะถูกทำเครื่องหมาย)"""
+    print(f"\ncompare with {baseline.get('revision') or '?'} ({baseline.get('timestamp')}):")
+    changed = sorted(k for k in current['config'] if baseline.get('config', {}).get(k) != current['config'][k])
+    if changed:
+        print(f"  (config differs: {', '.join(changed)} - numbers may not be comparable)")
+    for name, better in COMPARE_METRICS:
+        old, new = lookup(baseline, name), lookup(current, name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = change > 0.1 if better == 'lower' else change < -0.1
+        print(f"  {name:<34} {old:>12.4f} -> {new:>12.4f}  {change:+.0%}{'  <-- regression' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=200)
+    parser.add_argument('--humans', type=int, default=3, help='จำนวนสมาชิกในห้องเสียงของแต่ละ Guild')
+    parser.add_argument('--rate', type=float, default=0.5, help='ข้อความต่อวินาทีต่อ Guild')
+    parser.add_argument('--duration', type=float, default=60, help='เวลาที่ส่งข้อความ (วินาที)')
+    parser.add_argument('--drain', type=float, default=60, help='เวลารอให้คิวเล่นจบหลังหยุดส่ง (วินาที)')
+    parser.add_argument('--ask-ratio', type=float, default=0.03, help='สัดส่วนข้อความที่เป็น !ถาม')
+    parser.add_argument('--ai-ratio', type=float, default=0.01, help='สัดส่วนข้อความที่เป็น !ai')
+    parser.add_argument('--stats-ratio', type=float, default=0.002, help='สัดส่วนข้อความที่เป็น !ttsstats')
+    parser.add_argument('--offtopic-ratio', type=float, default=0.3, help='สัดส่วนข้อความในช่องที่ไม่ถูกอ่าน')
+    parser.add_argument('--speed-variety', type=float, default=0.3, help='สัดส่วน Guild ที่สั่ง !setspeed ตอนเริ่ม')
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'chat_corpus.jsonl'))
+    parser.add_argument('--tts-url', help='ใช้เซิร์ฟเวอร์ TTS ที่รันอยู่แล้วแทนการเปิด tts_stub_server.py')
+    parser.add_argument('--tts-latency', type=float, default=0.3)
+    parser.add_argument('--tts-jitter', type=float, default=0.1)
+    parser.add_argument('--tts-error-rate', type=float, default=0.0)
+    parser.add_argument('--ms-per-char', type=float, default=70)
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help='เวลาก่อน Gemini จำลองตอบท่อนแรก')
+    parser.add_argument('--gemini-chunk-delay', type=float, default=0.15)
+    parser.add_argument('--synth-workers', type=int, help='SYNTH_POOL_WORKERS (ค่าเริ่มต้นตามบอท)')
+    parser.add_argument('--cache-entries', type=int, default=500, help='TTS_CACHE_MAX_ENTRIES (0 = ปิดแคช)')
+    parser.add_argument('--ffmpeg', action='store_true', help='ใช้ FFmpeg จริงในการถอดรหัสเสียงแทน source จำลอง')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='ไฟล์ JSON สำหรับบันทึกผล (ค่าเริ่มต้น: benchmarks/results/)')
+    parser.add_argument('--compare', help='ไฟล์ JSON ผลรันก่อนหน้าที่จะใช้เทียบ')
+    parser.add_argument('--log', action='store_true', help='แสดง log ของบอท')
+    args = parser.parse_args()
+
+    stub = None
+    tts_url = args.tts_url
+    if tts_url is None:
+        stub, tts_url = start_stub_server(args)
+    cache_dir = tempfile.mkdtemp(prefix='mzsiri-load-')
+
+    # ตั้งค่าบอทก่อน import เพราะ mzsiri อ่าน environment ตอน import
+    os.environ.update({
+        'TTS_BACKENDS': 'http',
+        'TTS_HTTP_URL': tts_url,
+        'TTS_HTTP_FORMAT': 'wav',
+        'TTS_PLAYBACK_MODE': 'memory',
+        'TTS_CACHE_DIR': cache_dir,
+        'TTS_CACHE_MAX_ENTRIES': str(args.cache_entries),
+        'GUILD_SETTINGS_DB': ':memory:',
+        'GEMINI_API_KEY': 'load-test',
+        'METRICS_PORT': '0',
+    })
+    os.environ.pop('HEALTH_FILE', None)
+    if args.synth_workers:
+        os.environ['SYNTH_POOL_WORKERS'] = str(args.synth_workers)
+
+    import logging
+    import mzsiri
+
+    if not args.log:
+        logging.getLogger().setLevel(logging.WARNING)
+        mzsiri.logger.setLevel(logging.WARNING)
+    # ยังจัดรูปแบบและเขียนจริงทุกบรรทัด แต่เขียนทิ้งแทนการพิมพ์ออก stderr
+    mzsiri.chat_log.handler.targets = [logging.StreamHandler(open(os.devnull, 'w'))]
+    if not args.ffmpeg:
+        mzsiri.make_audio_source = FakeAudioSource
+    rng = random.Random(args.seed)
+    chat_sentences = [text for text in load_texts(args)[0] if len(text) > 10]
+    mzsiri._gemini_model = FakeGeminiModel(args.gemini_latency, args.gemini_chunk_delay, chat_sentences, rng)
+
+    gateway = FakeGateway(mzsiri, args.guilds, args.humans)
+    install_context_send(gateway)
+    try:
+        results = asyncio.run(drive(mzsiri, gateway, args, rng))
+    finally:
+        gateway.stop()
+        mzsiri.chat_log.stop()
+        mzsiri.guild_settings.close()
+        mzsiri.synthesis_pool.close()
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    result = {
+        'benchmark': 'load_test',
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'log')},
+        'results': results,
+    }
+    print_summary(result)
+
+    output = args.output
+    if output is None:
+        results_dir = os.path.join(BENCH_DIR, 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, f"load_test-{result['revision'] or 'unknown'}-"
+                                           f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved:               {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
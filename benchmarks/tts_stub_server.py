@@ -0,0 +1,104 @@
+"""
+เซิร์ฟเวอร์ TTS จำลองสำหรับทดสอบ HTTP backend โดยไม่ต้องเรียก gTTS จริง
+
+รับ POST JSON {"text": ..., "lang": ...} แล้วคืนไฟล์ WAV (16 kHz mono) ที่ยาวตามจำนวนตัวอักษร
+กำหนดเวลาตอบสนองและอัตราการล้มเหลวได้ เพื่อทดสอบ circuit breaker และการเลือก backend ตาม latency
+
+วิธีใช้:
+    python benchmarks/tts_stub_server.py [--port 5002] [--latency 0.3] [--jitter 0.1] [--error-rate 0.0]
+    TTS_BACKENDS=http,gtts TTS_HTTP_URL=http://127.0.0.1:5002/ TTS_HTTP_FORMAT=wav python mzsiri.py
+"""
+import argparse
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RATE = 16000
+
+
+def make_wav(seconds, frequency=440.0):
+    """สร้างเสียง sine แบบ WAV ยาวตามที่กำหนด (เบาๆ เพื่อไม่ให้ดังเกินไปถ้าเผลอเล่นจริง)"""
+    frames = max(1, int(seconds * SAMPLE_RATE))
+    step = 2 * math.pi * frequency / SAMPLE_RATE
+    samples = struct.pack(f'<{frames}h', *(int(3000 * math.sin(step * i)) for i in range(frames)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples)
+    return buffer.getvalue()
+
+
+def make_handler(args, counters):
+    lock = threading.Lock()
+    cache = {}
+
+    class StubTTSHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                text = str(payload['text'])
+            except (ValueError, KeyError):
+                self.send_error(400)
+                return
+
+            delay = max(0.0, random.gauss(args.latency, args.jitter))
+            time.sleep(delay)
+            with lock:
+                counters['requests'] += 1
+                failed = random.random() < args.error_rate
+                counters['errors' if failed else 'ok'] += 1
+            if failed:
+                self.send_error(503, 'stub failure')
+                return
+
+            seconds = min(args.max_seconds, max(0.2, len(text) * args.ms_per_char / 1000))
+            key = round(seconds, 2)
+            body = cache.get(key)
+            if body is None:
+                body = cache[key] = make_wav(key)
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/wav')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubTTSHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--latency', type=float, default=0.3, help='เวลาตอบสนองเฉลี่ย (วินาที)')
+    parser.add_argument('--jitter', type=float, default=0.1, help='ส่วนเบี่ยงเบนมาตรฐานของเวลาตอบสนอง (วินาที)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='สัดส่วนคำขอที่จะตอบ 503 (0-1)')
+    parser.add_argument('--ms-per-char', type=float, default=70, help='ความยาวเสียงต่อหนึ่งตัวอักษร (มิลลิวินาที)')
+    parser.add_argument('--max-seconds', type=float, default=15, help='ความยาวเสียงสูงสุด (วินาที)')
+    args = parser.parse_args()
+
+    counters = {'requests': 0, 'ok': 0, 'errors': 0}
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, counters))
+    print(f"stub TTS server listening on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"requests: {counters['requests']} (ok {counters['ok']}, errors {counters['errors']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+ตัวรันบอทแบบหลายโปรเซส สำหรับบอทที่อยู่ในเซิร์ฟเวอร์จำนวนมาก
+
+แบ่ง shard ทั้งหมดเป็นช่วงต่อเนื่องให้ worker แต่ละตัว แล้วรัน mzsiri.py หนึ่งโปรเซสต่อหนึ่ง worker
+แต่ละโปรเซสจะเห็นเฉพาะ Guild ใน shard ของตัวเอง ดังนั้นคิวข้อความ, worker task และ session เสียง
+จึงถูกแบ่งตาม shard โดยอัตโนมัติ และใช้ได้ทุก core ของเครื่อง
+
+วิธีใช้:
+    DISCORD_BOT_TOKEN=... python launcher.py --workers 4 [--total-shards 16] [--health-port 8080]
+
+- ถ้าไม่ระบุ --total-shards จะถามจำนวน shard ที่แนะนำจาก Discord (GET /gateway/bot)
+- worker ที่ตายจะถูกรันใหม่อัตโนมัติ
+- --metrics-port กำหนดพอร์ต /metrics ของ worker แรก worker ถัดไปจะใช้พอร์ตถัดไปตามลำดับ
+- worker แต่ละตัวใช้แคชเสียง TTS ของตัวเองที่ <TTS_CACHE_DIR>/worker-N และได้งบ TTS_CACHE_MAX_ENTRIES /
+  TTS_CACHE_MAX_MB หารด้วยจำนวน worker เพื่อให้รวมกันแล้วไม่เกินงบที่ตั้งไว้
+- สถานะของทุก worker ถูกรวมไว้ที่ <health-dir>/aggregate.json และที่ http://127.0.0.1:<health-port>/health
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO,
+                    format='[%(asctime)s] %(levelname)s: [launcher] %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mzsiri.py')
+# worker ที่ไม่อัปเดตไฟล์สถานะนานกว่านี้ (วินาที) ถือว่าไม่ตอบสนอง
+STALE_AFTER = 60
+# ค่าเริ่มต้นของแคชเสียง TTS (ต้องตรงกับใน mzsiri.py)
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', 'tts_cache')
+TTS_CACHE_MAX_ENTRIES = int(os.getenv('TTS_CACHE_MAX_ENTRIES', '500'))
+TTS_CACHE_MAX_MB = float(os.getenv('TTS_CACHE_MAX_MB', '200'))
+
+
+def fetch_recommended_shards(token):
+    """ถามจำนวน shard ที่ Discord แนะนำสำหรับบอทนี้"""
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot',
+                                     headers={'Authorization': f'Bot {token}',
+                                              'User-Agent': 'DiscordBot (mzsiri launcher)'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)['shards'])
+
+
+def partition_shards(total_shards, workers):
+    """แบ่ง shard 0..total_shards-1 เป็นช่วงต่อเนื่องให้ worker แต่ละตัว (คืนเป็น list ของ range)"""
+    workers = max(1, min(workers, total_shards))
+    base, extra = divmod(total_shards, workers)
+    ranges = []
+    start = 0
+    for index in range(workers):
+        size = base + (1 if index < extra else 0)
+        ranges.append(range(start, start + size))
+        start += size
+    return ranges
+
+
+def worker_cache_env(index, workers):
+    """
+    ค่าแคชเสียง TTS ของ worker แต่ละตัว: โฟลเดอร์แยกกันและแบ่งงบกันคนละส่วน
+    ถ้าใช้โฟลเดอร์เดียวกัน worker แต่ละตัวจะไล่ไฟล์ที่ worker อื่นกำลังจะเล่นออก และใช้ดิสก์ได้ถึง N เท่าของงบ
+    """
+    if TTS_CACHE_MAX_ENTRIES <= 0 or TTS_CACHE_MAX_MB <= 0:
+        return {}
+    return {
+        'TTS_CACHE_DIR': os.path.join(TTS_CACHE_DIR, f'worker-{index}'),
+        'TTS_CACHE_MAX_ENTRIES': str(max(1, TTS_CACHE_MAX_ENTRIES // workers)),
+        'TTS_CACHE_MAX_MB': str(TTS_CACHE_MAX_MB / workers),
+    }
+
+
+class Worker:
+    """โปรเซสบอทหนึ่งตัวที่ดูแลช่วง shard หนึ่ง"""
+
+    def __init__(self, index, shard_range, total_shards, health_dir, metrics_port=None, cache_env=None):
+        self.index = index
+        self.shard_range = shard_range
+        self.total_shards = total_shards
+        self.health_file = os.path.join(health_dir, f'worker-{index}.json')
+        self.metrics_port = metrics_port
+        self.cache_env = cache_env or {}
+        self.process = None
+        self.restarts = 0
+        self.next_start_at = 0.0
+
+    @property
+    def shard_spec(self):
+        return f'{self.shard_range.start}-{self.shard_range.stop - 1}'
+
+    def start(self):
+        env = dict(os.environ,
+                   BOT_SHARD_IDS=self.shard_spec,
+                   BOT_SHARD_COUNT=str(self.total_shards),
+                   HEALTH_FILE=self.health_file,
+                   **self.cache_env)
+        if self.metrics_port:
+            env['METRICS_PORT'] = str(self.metrics_port)
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+        logger.info(f"เริ่ม worker {self.index} (pid {self.process.pid}) shard {self.shard_spec}/{self.total_shards}")
+
+    def read_health(self):
+        try:
+            with open(self.health_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def aggregate_health(workers):
+    """รวมสถานะของทุก worker เป็นภาพรวมเดียว"""
+    now = time.time()
+    summary = {
+        'workers': [],
+        'guilds': 0,
+        'voice_clients': 0,
+        'worker_tasks': 0,
+        'queued_messages': 0,
+        'dropped_messages': 0,
+        'tts_cache_hits': 0,
+        'tts_cache_misses': 0,
+        'synthesis_queue_depth': 0,
+        'healthy_workers': 0,
+        'updated_at': now,
+    }
+    for worker in workers:
+        health = worker.read_health()
+        alive = worker.process is not None and worker.process.poll() is None
+        fresh = bool(health) and now - health.get('updated_at', 0) < STALE_AFTER
+        healthy = alive and fresh and health.get('ready', False)
+        summary['workers'].append({
+            'index': worker.index,
+            'shards': worker.shard_spec,
+            'pid': worker.process.pid if worker.process else None,
+            'alive': alive,
+            'healthy': healthy,
+            'restarts': worker.restarts,
+            'health': health,
+        })
+        # ไฟล์สถานะของ worker ที่ตายหรือไม่ตอบสนองเป็นตัวเลขเก่า ไม่นับรวมในยอดรวม
+        if not (health and alive and fresh):
+            continue
+        summary['healthy_workers'] += int(healthy)
+        summary['guilds'] += health['guilds']
+        summary['voice_clients'] += health['voice_clients']
+        summary['worker_tasks'] += health['worker_tasks']
+        summary['queued_messages'] += health['queued_messages']
+        summary['dropped_messages'] += health['dropped_messages']
+        summary['tts_cache_hits'] += health['tts_cache']['hits']
+        summary['tts_cache_misses'] += health['tts_cache']['misses']
+        summary['synthesis_queue_depth'] += health['synthesis_pool']['queue_depth']
+    return summary
+
+
+def serve_health(port, state):
+    """เปิด HTTP endpoint /health ที่คืนสถานะรวมล่าสุดเป็น JSON"""
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/health'):
+                self.send_error(404)
+                return
+            body = json.dumps(state.get('summary') or {}).encode('utf-8')
+            healthy = bool(state.get('summary')) and state['summary']['healthy_workers'] == len(state['summary']['workers'])
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name='health-http', daemon=True).start()
+    logger.info(f"เปิด health endpoint ที่ http://127.0.0.1:{port}/health")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='จำนวนโปรเซส (ค่าเริ่มต้น: จำนวน CPU)')
+    parser.add_argument('--total-shards', type=int, help='จำนวน shard ทั้งหมด (ค่าเริ่มต้น: ตามที่ Discord แนะนำ)')
+    parser.add_argument('--health-dir', default='health', help='โฟลเดอร์เก็บไฟล์สถานะของแต่ละ worker')
+    parser.add_argument('--health-port', type=int, help='พอร์ตของ HTTP endpoint /health (ไม่ระบุ = ปิด)')
+    parser.add_argument('--report-interval', type=float, default=30, help='รวมและ log สถานะทุกกี่วินาที')
+    parser.add_argument('--metrics-port', type=int, help='พอร์ต /metrics ของ worker แรก (worker ถัดไปใช้พอร์ตถัดไปตามลำดับ, ไม่ระบุ = ปิด)')
+    parser.add_argument('--stagger', type=float, default=5, help='เว้นระยะการเริ่ม worker แต่ละตัว (วินาที) เพื่อไม่ชน rate limit ของการ identify')
+    args = parser.parse_args()
+
+    token = os.getenv('DISCORD_BOT_TOKEN')
+    if not token:
+        logger.error("ERROR: ไม่พบ Discord Bot Token ใน Environment Variables.")
+        sys.exit(1)
+
+    total_shards = args.total_shards
+    if total_shards is None:
+        try:
+            total_shards = fetch_recommended_shards(token)
+            logger.info(f"Discord แนะนำให้ใช้ {total_shards} shard")
+        except Exception as e:
+            total_shards = args.workers
+            logger.warning(f"ถามจำนวน shard จาก Discord ไม่สำเร็จ ({e}) จะใช้ {total_shards} shard")
+
+    os.makedirs(args.health_dir, exist_ok=True)
+    shard_ranges = partition_shards(total_shards, args.workers)
+    workers = [Worker(index, shard_range, total_shards, args.health_dir,
+                      args.metrics_port + index if args.metrics_port else None,
+                      worker_cache_env(index, len(shard_ranges)))
+               for index, shard_range in enumerate(shard_ranges)]
+
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info("ได้รับสัญญาณหยุดทำงาน กำลังปิด worker ทั้งหมด...")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    state = {'summary': None}
+    if args.health_port:
+        serve_health(args.health_port, state)
+
+    for worker in workers:
+        if stopping.is_set():
+            break
+        worker.start()
+        stopping.wait(args.stagger)
+
+    next_report_at = 0.0
+    while not stopping.is_set():
+        now = time.time()
+        for worker in workers:
+            if worker.process is None or worker.process.poll() is None:
+                continue
+            if worker.next_start_at == 0.0:
+                # หน่วงเวลาการรันใหม่แบบ exponential backoff เพื่อไม่ให้วนรันถี่ๆ ถ้าบอทพังตั้งแต่เริ่ม
+                delay = min(300, 5 * 2 ** min(worker.restarts, 6))
+                worker.next_start_at = now + delay
+                logger.warning(f"worker {worker.index} หยุดทำงาน (exit code {worker.process.returncode}) จะรันใหม่ในอีก {delay} วินาที")
+            elif now >= worker.next_start_at:
+                worker.restarts += 1
+                worker.next_start_at = 0.0
+                worker.start()
+
+        summary = aggregate_health(workers)
+        state['summary'] = summary
+        if now >= next_report_at:
+            next_report_at = now + args.report_interval
+            with open(os.path.join(args.health_dir, 'aggregate.json.tmp'), 'w', encoding='utf-8') as f:
+                json.dump(summary, f)
+            os.replace(os.path.join(args.health_dir, 'aggregate.json.tmp'),
+                       os.path.join(args.health_dir, 'aggregate.json'))
+            logger.info(f"worker พร้อม {summary['healthy_workers']}/{len(workers)} | Guild {summary['guilds']} | "
+                        f"ช่องเสียง {summary['voice_clients']} | ข้อความรอคิว {summary['queued_messages']} | "
+                        f"คิวสังเคราะห์เสียง {summary['synthesis_queue_depth']}")
+        stopping.wait(1)
+
+    # ส่ง SIGINT ให้ bot.run ปิดตัวตามปกติ (flush การตั้งค่าและ log ที่ค้างอยู่) ก่อนจะ kill
+    for worker in workers:
+        if worker.process and worker.process.poll() is None:
+            worker.process.send_signal(signal.SIGINT)
+    for worker in workers:
+        if worker.process:
+            try:
+                worker.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+    logger.info("ปิด worker ทั้งหมดแล้ว")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,61 @@
+import time
+_STARTUP_STARTED = time.perf_counter()  # ใช้จับเวลาแต่ละช่วงของการเริ่มโปรแกรม (ต้องอยู่ก่อน import อื่น)
 import discord
 from discord.ext import commands
-from gtts import gTTS
+from aiohttp import web
 import os
+import io
+import re
 import asyncio
+import bisect
+import subprocess
 import uuid
+import functools
+import concurrent.futures
 import logging
+import logging.handlers
+import queue
+import random
+import sys
+import hashlib
+import json
+import math
+import shutil
+import sqlite3
+import threading
+import unicodedata
+import urllib.request
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from datetime import datetime
-import google.generativeai as genai
-from pydub import AudioSegment
+from typing import Optional
+# gTTS, pydub และ google.generativeai ใช้เวลา import นาน (โดยเฉพาะ protobuf/grpc ของ Gemini)
+# จึง import เมื่อใช้งานครั้งแรก หรือโหลดล่วงหน้าใน thread เบื้องหลังหลังบอทพร้อมใช้งานแล้ว
+
+class StartupTimer:
+    """จับเวลาของแต่ละช่วงตั้งแต่เริ่มโปรแกรมจนบอทพร้อมใช้งาน"""
+
+    def __init__(self, started):
+        self.started = started
+        self._last = started
+        self.phases = {}
+
+    def mark(self, phase):
+        """บันทึกเวลาที่ใช้ตั้งแต่ mark ครั้งก่อนให้เป็นของช่วง phase"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        return " | ".join(f"{phase} {seconds:.2f} s" for phase, seconds in self.phases.items()) + \
+            f" | รวม {self.total:.2f} s"
+
+startup_timer = StartupTimer(_STARTUP_STARTED)
+startup_timer.mark('imports')
 
 # --- ส่วนการตั้งค่า Logging ---
 # ตั้งค่าให้ Logger แสดงผลข้อมูลที่ระดับ INFO ขึ้นไป
@@ -16,13 +64,118 @@ logging.basicConfig(level=logging.INFO,
                     format='[%(asctime)s] %(levelname)s: %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
+
+# การบันทึกข้อความแชทถูกเรียกทุกข้อความในทุกช่อง จึงใช้ logger แยก (mzsiri.chat) ที่มีแค่ QueueHandler
+# ส่ง LogRecord เข้าคิว แล้วให้ QueueListener บน thread เบื้องหลังจัดรูปแบบและเขียนเป็นชุด (batch)
+# ด้วย handler และรูปแบบเดียวกับ root logger ถ้าจะปิด/ปรับ log แชท ให้ตั้งค่าที่ logger 'mzsiri.chat'
+CHAT_LOG_ENABLED = os.getenv('CHAT_LOG_ENABLED', '1') == '1'
+CHAT_LOG_SAMPLE_RATE = float(os.getenv('CHAT_LOG_SAMPLE_RATE', '1.0'))  # สัดส่วนข้อความที่จะบันทึก (0-1)
+CHAT_LOG_BATCH_SIZE = max(1, int(os.getenv('CHAT_LOG_BATCH_SIZE', '64')))
+CHAT_LOG_QUEUE_SIZE = int(os.getenv('CHAT_LOG_QUEUE_SIZE', '10000'))
+
+class ChatLogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler ที่ไม่จัดรูปแบบข้อความบน event loop และนับ log ที่ถูกทิ้งเมื่อคิวเต็มแทนการพิมพ์ error"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # record ใช้แค่ในโปรเซสนี้ จึงส่งต่อไปจัดรูปแบบใน thread ของ QueueListener ได้เลย
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class ChatLogBatchHandler(logging.Handler):
+    """
+    Handler ปลายทางของ QueueListener: เก็บ record ไว้จนครบ batch_size หรือจนคิวว่าง แล้วส่งต่อให้ targets
+    (ค่าเริ่มต้นคือ handler ของ root logger) โดย StreamHandler จะถูกเขียนและ flush ครั้งเดียวต่อชุด
+    """
+
+    def __init__(self, log_queue, batch_size, targets=None):
+        super().__init__()
+        self.queue = log_queue
+        self.batch_size = batch_size
+        self.targets = targets
+        self.buffer = []
+
+    def emit(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size or self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        records, self.buffer = self.buffer, []
+        if not records:
+            return
+        targets = self.targets if self.targets is not None else logging.getLogger().handlers
+        for handler in targets:
+            selected = [r for r in records if r.levelno >= handler.level and handler.filter(r)]
+            if not selected:
+                continue
+            if not isinstance(handler, logging.StreamHandler) or handler.stream is None:
+                for record in selected:
+                    handler.handle(record)
+                continue
+            handler.acquire()
+            try:
+                handler.stream.write(''.join(handler.format(r) + handler.terminator for r in selected))
+                handler.flush()
+            except Exception:
+                handler.handleError(selected[0])
+            finally:
+                handler.release()
+
+class ChatLogWriter:
+    """
+    บันทึกข้อความแชทผ่าน logger แยกที่มี QueueHandler ไปยัง QueueListener บน thread เบื้องหลัง
+    ถ้าคิวเต็ม (เช่นตอนโดนสแปม) จะทิ้ง log แทนการทำให้ event loop ช้าลง
+    """
+
+    def __init__(self, chat_logger, batch_size, queue_size):
+        self.logger = chat_logger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = ChatLogQueueHandler(self.queue)
+        self.handler = ChatLogBatchHandler(self.queue, batch_size)
+        self._listener = None
+        chat_logger.addHandler(self.queue_handler)
+        chat_logger.propagate = False
+
+    @property
+    def dropped(self):
+        return self.queue_handler.dropped
+
+    def log(self, guild_name, channel_name, author_name, content):
+        # สร้าง record เองเพื่อข้าม findCaller ของ Logger.info ซึ่งไล่ stack ทุกครั้ง (ไม่ได้ใช้ในรูปแบบ log นี้)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.handle(self.logger.makeRecord(
+                self.logger.name, logging.INFO, __file__, 0, "[%s > #%s] %s: %s",
+                (guild_name, channel_name, author_name, content), None))
+
+    def start(self):
+        self._listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+        self._listener.start()
+
+    def stop(self):
+        """เขียน log ที่ค้างในคิวให้หมดแล้วหยุด thread"""
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+            self.handler.flush()
+
+chat_log = ChatLogWriter(logging.getLogger(f'{__name__}.chat'), CHAT_LOG_BATCH_SIZE, CHAT_LOG_QUEUE_SIZE)
+chat_log.start()
 # --- สิ้นสุดส่วนการตั้งค่า Logging ---
 
 # --- ตั้งค่า Gemini API ---
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info("Gemini API Key ถูกโหลดและตั้งค่าเรียบร้อยแล้ว")
+    # ไลบรารี Gemini จะถูก import และตั้งค่าตอนสร้าง model ครั้งแรก (ดู get_gemini_model)
+    logger.info("Gemini API Key ถูกโหลดเรียบร้อยแล้ว")
 else:
     logger.warning("ไม่พบ GEMINI_API_KEY ใน Environment Variables, ฟังก์ชัน AI จะไม่ทำงาน")
 # -------------------------
@@ -34,76 +187,774 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 
+# --- โหมด Shard ---
+# BOT_SHARDED=1 ใช้ AutoShardedBot ให้ discord.py เลือกจำนวน shard เอง
+# BOT_SHARD_IDS (เช่น "0-3" หรือ "0,2,4") และ BOT_SHARD_COUNT ใช้กำหนดช่วง shard ของโปรเซสนี้ (launcher.py จะกำหนดให้)
+# กำหนดแค่ BOT_SHARD_COUNT อย่างเดียว = รันทุก shard จากจำนวนนั้นในโปรเซสนี้
+def parse_shard_ids(spec):
+    """แปลงข้อความเช่น "0-3,6" เป็น [0, 1, 2, 3, 6]"""
+    shard_ids = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            shard_ids.extend(range(int(start), int(end) + 1))
+        else:
+            shard_ids.append(int(part))
+    return shard_ids
+
+try:
+    BOT_SHARD_IDS = parse_shard_ids(os.environ['BOT_SHARD_IDS']) if os.getenv('BOT_SHARD_IDS') else None
+    BOT_SHARD_COUNT = int(os.environ['BOT_SHARD_COUNT']) if os.getenv('BOT_SHARD_COUNT') else None
+except ValueError as e:
+    logger.error(f"ERROR: BOT_SHARD_IDS หรือ BOT_SHARD_COUNT ไม่ถูกต้อง: {e}")
+    sys.exit(1)
+# discord.py ต้องรู้จำนวน shard ทั้งหมดเมื่อระบุ shard_ids เอง ถ้าไม่ตรวจตรงนี้จะได้ ClientException ตอน import
+if BOT_SHARD_IDS is not None and (BOT_SHARD_COUNT is None or not BOT_SHARD_IDS
+                                  or not all(0 <= shard_id < BOT_SHARD_COUNT for shard_id in BOT_SHARD_IDS)):
+    logger.error("ERROR: BOT_SHARD_IDS ต้องกำหนดคู่กับ BOT_SHARD_COUNT และทุก shard id ต้องอยู่ในช่วง "
+                 "0 ถึง BOT_SHARD_COUNT-1")
+    sys.exit(1)
+BOT_SHARDED = os.getenv('BOT_SHARDED', '0') == '1' or BOT_SHARD_IDS is not None or BOT_SHARD_COUNT is not None
+
 # กำหนด Prefixes (คำนำหน้า) สำหรับคำสั่งบอท
-bot = commands.Bot(command_prefix='!', intents=intents)
+if BOT_SHARDED:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents,
+                                  shard_ids=BOT_SHARD_IDS, shard_count=BOT_SHARD_COUNT)
+    logger.info(f"เริ่มบอทในโหมด Shard: shard {BOT_SHARD_IDS or 'อัตโนมัติ'} จากทั้งหมด {BOT_SHARD_COUNT or 'อัตโนมัติ'}")
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
+COMMAND_PREFIXES = tuple(bot.command_prefix)
+
+# --- คิวข้อความสำหรับอ่านออกเสียง ---
+SPEECH_QUEUE_MAXSIZE = max(1, int(os.getenv('SPEECH_QUEUE_MAXSIZE', '20')))
+# นโยบายเมื่อคิวเต็ม: 'drop_oldest' (ทิ้งข้อความเก่าสุด), 'drop_newest' (ทิ้งข้อความใหม่)
+# หรือ 'merge' (รวมกับข้อความก่อนหน้าถ้าเป็นคนเดียวกันและรวมแล้วไม่ยาวเกิน TTS_CHUNK_MAX_CHARS ไม่เช่นนั้นทิ้งข้อความเก่าสุด)
+SPEECH_QUEUE_OVERFLOW = os.getenv('SPEECH_QUEUE_OVERFLOW', 'drop_oldest')
+# ข้อความที่ซ้ำกับข้อความก่อนหน้าภายในช่วงเวลานี้ (วินาที) จะไม่ถูกอ่านซ้ำ
+SPEECH_QUEUE_DEDUPE_WINDOW = float(os.getenv('SPEECH_QUEUE_DEDUPE_WINDOW', '10'))
+
+@dataclass
+class SpeechItem:
+    """ข้อความหนึ่งรายการในคิว พร้อมเวลาที่ได้รับเพื่อวัด latency จนถึงตอนเริ่มพูด"""
+    text: str
+    author_id: Optional[int] = None
+    created_at: float = field(default_factory=time.monotonic)
+    dequeued_at: float = 0.0  # เวลาที่ถูกดึงออกจากคิวเพื่อสังเคราะห์เสียง
+
+class SpeechQueue:
+    """
+    คิวแบบจำกัดขนาดสำหรับข้อความที่รออ่านออกเสียง (ใช้แทน asyncio.Queue)
+    เมื่อแชทถูกสแปม คิวจะไม่โตไม่จำกัดและบอทจะไม่อ่านข้อความเก่าค้างเป็นนาที
+    รองรับ get/task_done/join แบบเดียวกับ asyncio.Queue (ไม่ thread-safe: เรียกได้เฉพาะบน event loop)
+    """
+
+    def __init__(self, maxsize=SPEECH_QUEUE_MAXSIZE, overflow=SPEECH_QUEUE_OVERFLOW,
+                 dedupe_window=SPEECH_QUEUE_DEDUPE_WINDOW, merge_max_chars=None):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dedupe_window = dedupe_window
+        # ข้อความที่รวมกันต้องไม่ยาวเกินช่วงที่ split_for_speech แบ่งไว้ (TTS_CHUNK_MAX_CHARS ประกาศไว้ด้านล่าง)
+        self.merge_max_chars = merge_max_chars if merge_max_chars is not None else TTS_CHUNK_MAX_CHARS
+        self._items = deque()
+        self._not_empty = asyncio.Event()
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+        self._unfinished = 0
+        self._last_text = None
+        self._last_put_at = 0.0
+        self.dropped = 0
+        self.merged = 0
+        self.deduped = 0
+        self.spoken = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._recent_latencies = deque(maxlen=256)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def put_nowait(self, item):
+        """ใส่ข้อความเข้าคิวตามนโยบาย overflow คืน False ถ้าข้อความถูกทิ้ง"""
+        now = time.monotonic()
+        if item.text == self._last_text and now - self._last_put_at < self.dedupe_window:
+            self.deduped += 1
+            return False
+
+        if len(self._items) >= self.maxsize:
+            if self.overflow == 'drop_newest':
+                # ข้อความที่ถูกทิ้งไม่นับเป็นข้อความก่อนหน้า ข้อความเดียวกันที่ส่งมาใหม่จึงยังถูกอ่านได้
+                self.dropped += 1
+                return False
+            last = self._items[-1]
+            if (self.overflow == 'merge' and item.author_id is not None and last.author_id == item.author_id
+                    and len(last.text) + 1 + len(item.text) <= self.merge_max_chars):
+                last.text = f"{last.text} {item.text}"
+                self.merged += 1
+                self._remember(item.text, now)
+                return True
+            self._items.popleft()
+            self.dropped += 1
+            self.task_done()
+
+        self._remember(item.text, now)
+        self._items.append(item)
+        self._unfinished += 1
+        self._all_done.clear()
+        self._not_empty.set()
+        return True
+
+    def _remember(self, text, now):
+        # จำข้อความล่าสุดที่รับเข้าคิวไว้ตรวจข้อความซ้ำ
+        self._last_text = text
+        self._last_put_at = now
+
+    async def put(self, item):
+        return self.put_nowait(item)
+
+    async def get(self):
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._items.popleft()
+
+    def task_done(self):
+        if self._unfinished <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.set()
+
+    async def join(self):
+        await self._all_done.wait()
+
+    def record_spoken(self, item):
+        """บันทึก latency ตั้งแต่ได้รับข้อความจนเริ่มพูด"""
+        latency = time.monotonic() - item.created_at
+        self.spoken += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self._recent_latencies.append(latency)
+
+    def stats(self):
+        recent = sorted(self._recent_latencies)
+        return {
+            'depth': len(self._items),
+            'maxsize': self.maxsize,
+            'overflow': self.overflow,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'deduped': self.deduped,
+            'spoken': self.spoken,
+            'latency_avg': self.latency_total / self.spoken if self.spoken else 0.0,
+            'latency_p95': recent[int(len(recent) * 0.95)] if recent else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+# --- การแบ่งข้อความยาวเป็นช่วงสั้นๆ สำหรับอ่านออกเสียง ---
+# ช่วงแรกยิ่งสั้น เสียงแรกยิ่งออกเร็ว แต่ช่วงที่สั้นเกินไปจะทำให้เสียงขาดเป็นห้วงๆ
+TTS_CHUNK_MIN_CHARS = max(1, int(os.getenv('TTS_CHUNK_MIN_CHARS', '20')))
+TTS_CHUNK_MAX_CHARS = max(TTS_CHUNK_MIN_CHARS, int(os.getenv('TTS_CHUNK_MAX_CHARS', '200')))
+# เปิด/ปิดการรับคำตอบจาก Gemini แบบ stream แล้วอ่านทีละประโยค
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', '1') == '1'
+
+# ภาษาไทยไม่มีเครื่องหมายจบประโยค ใช้ช่องว่างหลังอักษรไทยเป็นจุดแบ่งประโยค/วลีแทน
+_CHUNK_BOUNDARY_RE = re.compile(
+    r'(?P<strong>[.!?…]+(?=\s|$)\s*|\n+|(?<=[฀-๿])\s+)'
+    r'|(?P<weak>[,;:]\s+|\s+)'
+)
+
+class SpeechChunker:
+    """
+    ตัดข้อความที่ทยอยเข้ามา (เช่นคำตอบแบบ stream จาก Gemini) เป็นช่วงประโยคสำหรับ TTS
+    จะตัดที่จุดจบประโยคแรกที่ยาวอย่างน้อย min_chars และไม่ให้ช่วงใดยาวเกิน max_chars
+    """
+
+    def __init__(self, min_chars=TTS_CHUNK_MIN_CHARS, max_chars=TTS_CHUNK_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ''
+
+    def feed(self, text):
+        """เพิ่มข้อความเข้า buffer แล้วคืนรายการช่วงที่ตัดได้แล้ว"""
+        self._buffer += text
+        return self._drain()
+
+    def flush(self):
+        """คืนช่วงที่เหลือทั้งหมดเมื่อข้อความมาครบแล้ว"""
+        chunks = self._drain()
+        rest = self._buffer.strip()
+        self._buffer = ''
+        if rest:
+            chunks.append(rest)
+        return chunks
+
+    def _drain(self):
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                return chunks
+            chunk = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+
+    def _find_cut(self):
+        buffer = self._buffer
+        last_weak = None
+        for match in _CHUNK_BOUNDARY_RE.finditer(buffer):
+            end = match.end()
+            # จุดแบ่งที่อยู่ท้าย buffer พอดียังไม่แน่นอน เพราะข้อความถัดไปอาจต่อกันอยู่
+            if end >= len(buffer) or end > self.max_chars:
+                break
+            if match.group('strong') and end >= self.min_chars:
+                return end
+            last_weak = end
+        if len(buffer) > self.max_chars:
+            return last_weak or self.max_chars
+        return None
+
+def split_for_speech(text):
+    """แบ่งข้อความที่ยาวเกิน TTS_CHUNK_MAX_CHARS เป็นช่วงๆ (ข้อความสั้นคืนเป็นช่วงเดียว)"""
+    if len(text) <= TTS_CHUNK_MAX_CHARS:
+        return [text]
+    chunker = SpeechChunker()
+    return chunker.feed(text) + chunker.flush()
+
+# --- การปรับข้อความแชทก่อนส่งไปอ่านออกเสียง ---
+# ลิงก์, อีโมจิ, mention, โค้ด และ "55555555" ทำให้ gTTS ต้องสังเคราะห์เสียงยาวๆ ที่ฟังไม่รู้เรื่อง
+# จึงแทนที่ด้วยคำสั้นๆ ก่อนเข้าคิว ซึ่งยังช่วยให้ข้อความที่ต่างกันเล็กน้อยใช้ไฟล์เสียงในแคชร่วมกันได้
+TTS_MAX_SPOKEN_CHARS = int(os.getenv('TTS_MAX_SPOKEN_CHARS', '300'))  # ความยาวสูงสุดที่จะอ่าน (0 = ไม่จำกัด)
+TTS_REPEAT_MAX = max(1, int(os.getenv('TTS_REPEAT_MAX', '3')))  # ตัวอักษรซ้ำติดกันเกินนี้จะถูกตัดเหลือเท่านี้
+TTS_URL_TOKEN = os.getenv('TTS_URL_TOKEN', 'ลิงก์')
+TTS_CODE_TOKEN = os.getenv('TTS_CODE_TOKEN', 'โค้ด')
+TTS_SPOILER_TOKEN = os.getenv('TTS_SPOILER_TOKEN', 'สปอยล์')
+
+# ทุกรูปแบบรวมอยู่ใน regex เดียว เพื่อให้ re.sub ไล่ข้อความเพียงรอบเดียว
+# ลำดับของแต่ละทางเลือกมีผล: โค้ดและลิงก์ต้องมาก่อน เพื่อไม่ให้เนื้อหาข้างในถูกแปลงต่อ
+_SPEECH_NORMALIZE_RE = re.compile(
+    r'(?P<code>```.*?(?:```|$)|`[^`\n]+`)'
+    r'|(?P<spoiler>\|\|.+?\|\|)'
+    r'|(?P<url><?(?:https?://|www\.)[^\s>]+>?)'
+    r'|(?P<emoji><a?:(?P<emoji_name>\w+):\d+>)'
+    r'|(?P<mention><(?P<mention_kind>@[!&]?|#)(?P<mention_id>\d+)>)'
+    r'|(?P<timestamp><t:\d+(?::[tTdDfFR])?>\s*)'
+    r'|(?P<space>\s{2,})'
+    # ตัวเลขซ้ำจะถูกลดเฉพาะ "5555" ที่ไม่ได้เป็นส่วนหนึ่งของจำนวน เพื่อไม่ให้ 1000000 กลายเป็น 1000
+    r'|(?P<laugh>(?<!\d)5{%d,}(?!\d))'
+    r'|(?P<repeat>(?P<repeat_char>[^\s\d])(?P=repeat_char){%d,})' % (TTS_REPEAT_MAX + 1, TTS_REPEAT_MAX),
+    re.DOTALL,
+)
+
+def _mention_name(guild, kind, object_id):
+    """หาชื่อของ mention จากแคชของ discord.py (ไม่เรียก API)"""
+    if kind == '@&':
+        target = guild.get_role(object_id) if guild is not None else None
+        return target.name if target else 'ยศ'
+    if kind == '#':
+        target = guild.get_channel(object_id) if guild is not None else None
+        return target.name if target else 'ห้อง'
+    target = guild.get_member(object_id) if guild is not None else None
+    if target is None:
+        target = bot.get_user(object_id)
+    return target.display_name if target else 'ใครบางคน'
+
+def normalize_for_speech(text, guild=None):
+    """
+    ปรับข้อความแชทให้เหมาะกับการอ่านออกเสียง: แทนที่ลิงก์/โค้ด/สปอยล์ด้วยคำสั้นๆ, อีโมจิและ mention เป็นชื่อ,
+    ลดตัวอักษรที่ซ้ำกันยาวๆ และตัดข้อความที่ยาวเกิน TTS_MAX_SPOKEN_CHARS (คืนค่าว่างถ้าไม่มีอะไรให้อ่าน)
+    """
+    def replace(match):
+        kind = match.lastgroup
+        if kind == 'repeat':
+            return match.group('repeat_char') * TTS_REPEAT_MAX
+        if kind == 'laugh':
+            return '5' * TTS_REPEAT_MAX
+        if kind == 'space':
+            return '\n' if '\n' in match.group() else ' '
+        if kind == 'timestamp':
+            # เวลาถูกตัดทิ้งพร้อมช่องว่างด้านหลัง เหลือช่องว่างเดียวถ้ามีข้อความติดอยู่ทั้งสองฝั่ง
+            start, end = match.span()
+            return ' ' if start > 0 and not text[start - 1].isspace() and end < len(text) else ''
+        if kind == 'url':
+            word = TTS_URL_TOKEN
+        elif kind == 'emoji':
+            word = match.group('emoji_name')
+        elif kind == 'mention':
+            word = _mention_name(guild, match.group('mention_kind'), int(match.group('mention_id')))
+        elif kind == 'code':
+            word = TTS_CODE_TOKEN
+        elif kind == 'spoiler':
+            word = TTS_SPOILER_TOKEN
+        else:
+            word = ''
+        # เว้นวรรครอบคำที่แทนที่เฉพาะเมื่อติดกับข้อความอื่น เพื่อไม่ให้เกิดช่องว่างซ้อน
+        start, end = match.span()
+        if start > 0 and not text[start - 1].isspace():
+            word = ' ' + word
+        if end < len(text) and not (text[end].isspace() or text[end] == '<'):
+            word += ' '
+        return word
+
+    text = _SPEECH_NORMALIZE_RE.sub(replace, text).strip()
+    if 0 < TTS_MAX_SPOKEN_CHARS < len(text):
+        # ตัดที่ช่องว่างสุดท้ายก่อนถึงความยาวสูงสุด เพื่อไม่ให้คำถูกตัดครึ่ง
+        cut = text.rfind(' ', TTS_MAX_SPOKEN_CHARS // 2, TTS_MAX_SPOKEN_CHARS + 1)
+        text = text[:cut if cut > 0 else TTS_MAX_SPOKEN_CHARS].rstrip()
+    return text
 
 # --- Task สำหรับจัดการการเล่นเสียงในแต่ละ Server (Guild) ---
-async def audio_player_task(guild_id):
+# จำนวนข้อความที่สังเคราะห์เสียงล่วงหน้าไว้ระหว่างที่คลิปปัจจุบันกำลังเล่น
+TTS_PREFETCH_DEPTH = max(1, int(os.getenv('TTS_PREFETCH_DEPTH', '2')))
+# 'file': เขียนไฟล์ชั่วคราวและปรับความเร็วด้วย pydub (ค่าเริ่มต้น)
+# 'memory': ส่งเสียงจาก gTTS เข้า FFmpeg ผ่าน pipe โดยตรง และปรับความเร็วด้วย filter atempo ของ FFmpeg
+TTS_PLAYBACK_MODE = os.getenv('TTS_PLAYBACK_MODE', 'file')
+# 'pcm': ให้ discord.py encode Opus เองทุกเฟรม (ค่าเริ่มต้น)
+# 'opus': ให้ FFmpeg ส่ง Opus ออกมาโดยตรง และเก็บไฟล์ .opus ในแคชเพื่อส่งต่อได้โดยไม่ต้อง encode ใหม่
+TTS_OUTPUT_FORMAT = os.getenv('TTS_OUTPUT_FORMAT', 'pcm')
+TTS_OPUS_BITRATE = int(os.getenv('TTS_OPUS_BITRATE', '64'))
+
+@dataclass
+class PreparedClip:
+    """คลิปเสียงที่สังเคราะห์เสร็จแล้วและพร้อมเล่น (มาจากไฟล์ หรือจากข้อมูลในหน่วยความจำ)"""
+    text: str
+    path: Optional[str] = None
+    temp_files: tuple = ()  # ไฟล์ชั่วคราวที่ต้องลบหลังเล่นจบ
+    data: Optional[bytes] = None
+    tempo: float = 1.0  # ความเร็วที่ให้ FFmpeg ปรับตอนเล่น (ใช้ในโหมด memory)
+    cached: bool = False
+    cache_pin: Optional[str] = None  # ไฟล์ในแคชที่ถูก pin ไว้ ต้องเรียก tts_cache.release() หลังเล่นจบหรือทิ้งคลิป
+    timings: dict = field(default_factory=dict)  # เวลาของแต่ละขั้นตอนการสังเคราะห์ (วินาที) สำหรับ trace
+
+def make_audio_source(clip):
+    """สร้าง AudioSource ของ FFmpeg จากคลิป"""
+    options = f'-filter:a atempo={clip.tempo}' if clip.tempo != 1.0 else None
+    source, pipe = (io.BytesIO(clip.data), True) if clip.data is not None else (clip.path, False)
+    if TTS_OUTPUT_FORMAT == 'opus':
+        if not pipe and options is None and clip.path.endswith('.opus'):
+            # ไฟล์ .opus ที่ encode ไว้แล้ว ส่งต่อ packet ได้เลยโดยไม่ต้อง encode ใหม่
+            return discord.FFmpegOpusAudio(source, codec='copy')
+        return discord.FFmpegOpusAudio(source, pipe=pipe, options=options, bitrate=TTS_OPUS_BITRATE)
+    return discord.FFmpegPCMAudio(source, pipe=pipe, options=options)
+
+async def prepare_clip(guild, text_to_play):
+    """สังเคราะห์เสียงสำหรับข้อความหนึ่งข้อความ (ใช้แคชถ้ามี) แล้วคืน PreparedClip"""
+    settings = await guild_settings.load(guild.id)
+    return await synthesize_clip(guild.id, guild.name, text_to_play, settings.speed, settings.lang)
+
+async def synthesize_clip(pool_key, label, text_to_play, speed, lang, count_stats=True):
     """
-    Task ที่ทำงานเบื้องหลังเพื่อดึงข้อความจากคิวมาเล่นเสียง
-    Task นี้จะทำงานตลอดเวลาสำหรับแต่ละ Guild ที่บอทอยู่ในช่องเสียง
+    สังเคราะห์เสียงด้วยความเร็วและภาษาที่กำหนด (ใช้แคชถ้ามี) แล้วคืน PreparedClip
+    pool_key ใช้แบ่งคิวใน Synthesis pool (ปกติคือ guild.id) ส่วน label ใช้ใน log
+    count_stats=False จะไม่นับการค้นแคชครั้งนี้ในสถิติ hit/miss (ใช้ตอนอุ่นแคช)
     """
-    guild = bot.get_guild(guild_id)
-    if not guild:
-        logger.error(f"Audio Task: ไม่พบ Guild ID {guild_id}")
-        return
+    if TTS_PLAYBACK_MODE == 'memory':
+        return await prepare_clip_in_memory(pool_key, label, text_to_play, speed, lang, count_stats)
 
-    message_queue = bot.message_queues.get(guild_id)
-    if not message_queue:
-        logger.error(f"Audio Task: ไม่พบคิวสำหรับ Guild ID {guild_id}")
-        return
+    file_format = 'opus' if TTS_OUTPUT_FORMAT == 'opus' else 'mp3'
 
-    logger.info(f"Audio player task เริ่มทำงานสำหรับ Guild: {guild.name}")
+    # ลองหาไฟล์เสียงที่ปรับความเร็วแล้วจากแคชก่อน
+    primary = tts_router.primary
+    cached_file = tts_cache.get(text_to_play, lang, speed, file_format, primary, count_stats=count_stats)
+    if cached_file:
+        logger.info(f"[{label}] ใช้ไฟล์เสียงจากแคช TTS")
+        return PreparedClip(text_to_play, cached_file, cached=True, cache_pin=cached_file)
+
+    # สร้างไฟล์เสียงและปรับความเร็วบน Synthesis pool เพื่อไม่ให้ event loop ค้าง
+    backend, (final_audio_to_play, speed_applied, timings) = await tts_router.run(
+        pool_key, synthesize_to_file, text_to_play, lang, speed, file_format,
+        discard=lambda result: cleanup_files_after_play(None, result[0]))
+    synthesis_seconds.observe(timings['synthesis'], pool_key)
+    if 'speed_adjust' in timings or 'encode' in timings:
+        speed_adjust_seconds.observe(timings.get('speed_adjust', 0.0) + timings.get('encode', 0.0), pool_key)
+    if not speed_applied:
+        logger.warning(f"[{label}] ปรับความเร็วเสียงไม่สำเร็จ จะเล่นด้วยความเร็วปกติ")
+    elif backend == primary and final_audio_to_play.endswith(f'.{file_format}'):
+        # เก็บเฉพาะไฟล์จาก backend หลักที่ได้ความเร็วและรูปแบบตรงกับคีย์ลงแคช
+        # (เสียงจาก backend สำรองใช้แค่ชั่วคราว ไม่ควรค้างในแคชหลังจาก backend หลักกลับมา)
+        final_audio_to_play = tts_cache.put(text_to_play, lang, speed, final_audio_to_play, file_format, primary,
+                                            pin=True)
+        if tts_cache.owns(final_audio_to_play):
+            return PreparedClip(text_to_play, final_audio_to_play, cache_pin=final_audio_to_play, timings=timings)
 
+    return PreparedClip(text_to_play, final_audio_to_play, temp_files=(final_audio_to_play,), timings=timings)
+
+async def prepare_clip_in_memory(pool_key, label, text_to_play, speed, lang, count_stats=True):
+    """
+    สังเคราะห์เสียงโดยไม่เขียนไฟล์ชั่วคราว
+    แคชในโหมดนี้เก็บเสียงต้นฉบับ (ความเร็ว 1.0) และให้ FFmpeg ปรับความเร็วตอนเล่น
+    """
+    primary = tts_router.primary
+    primary_format = tts_backends[primary].audio_format
+    cached_file = tts_cache.get(text_to_play, lang, 1.0, primary_format, primary, count_stats=count_stats)
+    if cached_file:
+        logger.info(f"[{label}] ใช้ไฟล์เสียงจากแคช TTS")
+        return PreparedClip(text_to_play, path=cached_file, tempo=speed, cached=True, cache_pin=cached_file)
+
+    backend, (data, audio_format, timings) = await tts_router.run(pool_key, synthesize_bytes, text_to_play, lang)
+    synthesis_seconds.observe(timings['synthesis'], pool_key)
+    if backend == primary:
+        tts_cache.put_bytes(text_to_play, lang, 1.0, data, audio_format, primary)
+    return PreparedClip(text_to_play, data=data, tempo=speed, timings=timings)
+
+async def prefetch_clips(session, prepared_clips, lookahead_slots):
+    """
+    ดึงข้อความจากคิวตามลำดับและเริ่มสังเคราะห์เสียงล่วงหน้า
+    จำนวนคลิปที่ทำล่วงหน้าถูกจำกัดด้วย lookahead_slots (TTS_PREFETCH_DEPTH)
+    """
+    guild = session.guild
     while True:
-        try:
-            # รอจนกว่าจะมีข้อความใหม่ในคิว
-            text_to_play = await message_queue.get()
-            logger.info(f"[{guild.name}] ดึงข้อความจากคิว TTS: '{text_to_play}'")
-
-            voice_client = guild.voice_client
-            if not voice_client or not voice_client.is_connected():
-                logger.warning(f"[{guild.name}] Voice client ไม่พร้อมใช้งาน, หยุดการเล่นเสียง")
-                message_queue.task_done()
-                continue
+        await lookahead_slots.acquire()
+        # รอจนกว่าจะมีข้อความใหม่ในคิว
+        item = await session.queue.get()
+        item.dequeued_at = time.monotonic()
+        queue_wait_seconds.observe(item.dequeued_at - item.created_at, guild.id)
+        logger.info(f"[{guild.name}] ดึงข้อความจากคิว TTS: '{item.text}'")
+        synth_task = asyncio.create_task(prepare_clip(guild, item.text))
+        synth_task.add_done_callback(session.track_clip)
+        prepared_clips.put_nowait((item, synth_task))
+
+async def audio_player_task(session):
+    """
+    Task ที่ทำงานเบื้องหลังเพื่อดึงข้อความจากคิวของ session มาเล่นเสียง
+    Task นี้จะทำงานตลอดเวลาสำหรับแต่ละ Guild ที่บอทอยู่ในช่องเสียง
+    การสังเคราะห์เสียงของข้อความถัดไปจะทำล่วงหน้าระหว่างที่คลิปปัจจุบันกำลังเล่น
+    และจะเล่นคลิปถัดไปทันทีเมื่อ callback `after` แจ้งว่าเล่นจบ (ไม่ต้องวนเช็ค is_playing)
+    """
+    guild = session.guild
+    message_queue = session.queue
+    logger.info(f"Audio player task เริ่มทำงานสำหรับ Guild: {guild.name}")
+
+    loop = asyncio.get_running_loop()
+    prepared_clips = asyncio.Queue()
+    lookahead_slots = asyncio.Semaphore(TTS_PREFETCH_DEPTH)
+    playback_done = asyncio.Event()
+    prefetcher = asyncio.create_task(prefetch_clips(session, prepared_clips, lookahead_slots))
+    synth_task = None
+
+    try:
+        while True:
+            try:
+                item, synth_task = await prepared_clips.get()
+                lookahead_slots.release()
+                try:
+                    clip = await synth_task
+                    synth_task = None
+                except Exception as e:
+                    synth_task = None
+                    logger.error(f"[{guild.name}] สังเคราะห์เสียงไม่สำเร็จ: {e}", exc_info=True)
+                    message_queue.task_done()
+                    continue
+
+                voice_client = session.voice_client
+                if not voice_client or not voice_client.is_connected():
+                    logger.warning(f"[{guild.name}] Voice client ไม่พร้อมใช้งาน, หยุดการเล่นเสียง")
+                    session.release_clip(clip)
+                    message_queue.task_done()
+                    continue
+
+                # Callback เพื่อลบไฟล์, ทำเครื่องหมายว่า task เสร็จสิ้น และปลุก loop ให้เล่นคลิปถัดไป
+                # callback นี้ถูกเรียกจาก thread ของ player ส่วน SpeechQueue ใช้ได้เฉพาะบน event loop
+                def after_playing(error, clip=clip):
+                    session.release_clip(clip, error)
+                    loop.call_soon_threadsafe(message_queue.task_done)
+                    logger.info(f"[{guild.name}] เล่นเสียงจบและลบไฟล์เรียบร้อย")
+                    loop.call_soon_threadsafe(playback_done.set)
 
-            # รอจนกว่าเสียงก่อนหน้าจะเล่นจบ
-            while voice_client.is_playing():
-                await asyncio.sleep(0.5)
-            
-            # สร้างไฟล์เสียงและปรับความเร็ว
-            original_audio_file = text_to_speech_gtts(text_to_play, lang='th')
-            final_audio_to_play = original_audio_file
-            adjusted_file = None
-
-            if bot.tts_speed != 1.0:
-                logger.info(f"[{guild.name}] กำลังปรับความเร็วเสียงเป็น {bot.tts_speed}x...")
-                adjusted_file = change_audio_speed(original_audio_file, bot.tts_speed)
-                if adjusted_file:
-                    final_audio_to_play = adjusted_file
-                else:
-                    logger.warning(f"[{guild.name}] ปรับความเร็วเสียงไม่สำเร็จ จะเล่นด้วยความเร็วปกติ")
-            
-            source = discord.FFmpegPCMAudio(source=final_audio_to_play)
-            
-            # Callback เพื่อลบไฟล์และทำเครื่องหมายว่า task เสร็จสิ้น
-            def after_playing(error):
-                cleanup_files_after_play(error, original_audio_file, adjusted_file)
-                message_queue.task_done()
-                logger.info(f"[{guild.name}] เล่นเสียงจบและลบไฟล์เรียบร้อย")
-
-            voice_client.play(source, after=after_playing)
-
-        except asyncio.CancelledError:
-            logger.info(f"Audio player task สำหรับ Guild {guild.name} ถูกยกเลิกแล้ว")
-            break
+                playback_done.clear()
+                source = None
+                try:
+                    source = TimedAudioSource(make_audio_source(clip))
+                    play_started_at = time.monotonic()
+                    voice_client.play(source, after=after_playing)
+                except Exception:
+                    # ถ้าเริ่มเล่นไม่ได้ callback after จะไม่ถูกเรียก ต้องเก็บกวาดเอง
+                    if source:
+                        source.cleanup()
+                    session.release_clip(clip)
+                    message_queue.task_done()
+                    raise
+                message_queue.record_spoken(item)
+                await playback_done.wait()
+                record_utterance(guild, item, clip, source, play_started_at, time.monotonic())
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"ERROR ใน audio_player_task ของ Guild {guild.name}: {e}", exc_info=True)
+
+    except asyncio.CancelledError:
+        logger.info(f"Audio player task สำหรับ Guild {guild.name} ถูกยกเลิกแล้ว")
+    finally:
+        prefetcher.cancel()
+        # ทิ้งคลิปที่สังเคราะห์ล่วงหน้าไว้แต่ยังไม่ได้เล่น
+        pending_tasks = [synth_task] if synth_task else []
+        while not prepared_clips.empty():
+            pending_tasks.append(prepared_clips.get_nowait()[1])
+        for pending in pending_tasks:
+            pending.add_done_callback(session.release_finished_clip)
+            pending.cancel()
+
+# --- Session เสียงราย Guild ---
+# เมื่อในห้องไม่เหลือคนแล้ว บอทจะรออีกกี่วินาทีก่อนออก (0 = ออกทันที)
+# ถ้ามีคนกลับเข้ามาในช่วงนี้ บอทจะใช้การเชื่อมต่อเดิมต่อได้เลยโดยไม่ต้องเชื่อมต่อและ handshake ใหม่
+VOICE_IDLE_GRACE = float(os.getenv('VOICE_IDLE_GRACE', '60'))
+
+class VoiceSession:
+    """
+    สถานะทั้งหมดของบอทในช่องเสียงของ Guild หนึ่ง: voice client, คิวข้อความ, audio player task,
+    ไฟล์เสียงชั่วคราวที่ยังไม่ถูกลบ และจำนวนสมาชิก (ที่ไม่ใช่บอท) ในช่องเสียงเดียวกับบอท
+    """
+
+    def __init__(self, guild, queue=None):
+        self.guild_id = guild.id
+        self._guild = guild
+        self.queue = queue if queue is not None else SpeechQueue()
+        self.worker = None
+        self.idle_task = None
+        self.human_count = 0
+        self.temp_files = set()  # ถูกแก้จาก thread ของ player ด้วย จึงใช้เฉพาะ operation ที่ทำเสร็จในครั้งเดียว
+        self.pinned_clips = {}  # id(clip) -> คลิปที่ยัง pin ไฟล์ในแคชไว้ (ใช้กฎเดียวกับ temp_files)
+
+    @property
+    def guild(self):
+        # discord.py อาจสร้างอ็อบเจกต์ Guild ใหม่หลัง reconnect จึงดึงตัวล่าสุดจากแคชก่อน
+        return bot.get_guild(self.guild_id) or self._guild
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    @property
+    def channel(self):
+        voice_client = self.voice_client
+        return voice_client.channel if voice_client else None
+
+    def is_connected(self):
+        voice_client = self.voice_client
+        return voice_client is not None and voice_client.is_connected()
+
+    def start(self):
+        """เริ่ม audio player task (ถ้ายังไม่ได้ทำงานอยู่)"""
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(audio_player_task(self))
+
+    def recount_humans(self):
+        """นับสมาชิกในช่องเสียงใหม่ทั้งหมด (ใช้เฉพาะตอนเข้าห้อง/ย้ายห้อง ส่วนเหตุการณ์อื่นปรับค่าทีละหนึ่ง)"""
+        channel = self.channel
+        self.human_count = sum(1 for m in channel.members if not m.bot) if channel else 0
+        return self.human_count
+
+    def track_clip(self, task):
+        # done callback ของ task สังเคราะห์เสียง: จำไฟล์ชั่วคราวไว้จนกว่าจะเล่นจบหรือถูกทิ้ง
+        if not task.cancelled() and task.exception() is None:
+            clip = task.result()
+            self.temp_files.update(clip.temp_files)
+            if clip.cache_pin:
+                self.pinned_clips[id(clip)] = clip
+
+    def release_clip(self, clip, error=None):
+        """ลบไฟล์ชั่วคราวและปลด pin แคชของคลิปที่เล่นจบแล้วหรือจะไม่ได้เล่น (เรียกจาก thread ของ player ได้)"""
+        self.temp_files.difference_update(clip.temp_files)
+        cleanup_files_after_play(error, *clip.temp_files)
+        # pop ทีละรายการเพื่อให้ปลด pin ครั้งเดียวแม้ discard_temp_files จะทำงานพร้อมกัน
+        if self.pinned_clips.pop(id(clip), None) is not None:
+            tts_cache.release(clip.cache_pin)
+
+    def release_finished_clip(self, task):
+        # done callback ของ task สังเคราะห์เสียงที่ถูกทิ้ง เพื่อไม่ให้ไฟล์ชั่วคราวค้าง
+        if not task.cancelled() and task.exception() is None:
+            self.release_clip(task.result())
+
+    def discard_temp_files(self):
+        """ลบไฟล์ชั่วคราวทั้งหมดที่ยังค้างอยู่ (เช่นคลิปที่ callback after ไม่เคยถูกเรียก)"""
+        files = list(self.temp_files)
+        self.temp_files.clear()
+        cleanup_files_after_play(None, *files)
+        while self.pinned_clips:
+            try:
+                _, clip = self.pinned_clips.popitem()
+            except KeyError:
+                break
+            tts_cache.release(clip.cache_pin)
+
+    def cancel_idle_disconnect(self):
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+            self.idle_task = None
+
+    async def close(self, disconnect=True):
+        """หยุด task ทั้งหมด ลบไฟล์ชั่วคราว และออกจากช่องเสียง"""
+        self.cancel_idle_disconnect()
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                # รอให้ finally ของ audio player task ทิ้งคลิปที่เตรียมไว้ให้เสร็จก่อน
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        voice_client = self.voice_client
+        if disconnect and voice_client:
+            await voice_client.disconnect()
+        self.discard_temp_files()
+
+class VoiceSessionManager:
+    """ที่เก็บ VoiceSession ของทุก Guild และจุดเดียวที่สร้าง/ปิด session"""
+
+    def __init__(self, idle_grace=VOICE_IDLE_GRACE):
+        self.idle_grace = idle_grace
+        self._sessions = {}
+
+    def get(self, guild_id):
+        return self._sessions.get(guild_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def values(self):
+        return list(self._sessions.values())
+
+    def attach(self, session):
+        """เพิ่ม session ที่สร้างไว้แล้ว (ใช้ภายใน และใน benchmark ที่ไม่มีการเชื่อมต่อจริง)"""
+        self._sessions[session.guild_id] = session
+        return session
+
+    async def connect(self, guild, channel):
+        """
+        เข้าช่องเสียงหรือย้ายไปช่องที่กำหนด แล้วคืน session ของ Guild
+        ถ้ายังเชื่อมต่ออยู่ (เช่นอยู่ในช่วงรอออกตอนห้องว่าง) จะใช้การเชื่อมต่อเดิมต่อ
+        """
+        voice_client = guild.voice_client
+        if voice_client and voice_client.is_connected():
+            if voice_client.channel != channel:
+                await voice_client.move_to(channel)
+        else:
+            if voice_client:
+                await voice_client.disconnect(force=True)
+            await channel.connect()
+
+        session = self._sessions.get(guild.id) or self.attach(VoiceSession(guild))
+        session.cancel_idle_disconnect()
+        session.recount_humans()
+        session.start()
+        return session
+
+    async def close(self, guild_id, disconnect=True):
+        """ปิด session ของ Guild (คืน False ถ้าไม่มี session อยู่)"""
+        session = self._sessions.pop(guild_id, None)
+        if session is None:
+            return False
+        await session.close(disconnect)
+        return True
+
+    def schedule_idle_disconnect(self, session):
+        if session.idle_task is None:
+            session.idle_task = asyncio.create_task(self._disconnect_when_idle(session))
+
+    async def _disconnect_when_idle(self, session):
+        await asyncio.sleep(self.idle_grace)
+        session.idle_task = None
+        if session.human_count > 0 or self._sessions.get(session.guild_id) is not session:
+            return
+        channel = session.channel
+        logger.info(f"ไม่มีสมาชิกเหลือในช่องเสียง {channel.name if channel else '-'} แล้ว บอทกำลังจะออกจากช่องเสียง...")
+        try:
+            await self.close(session.guild_id)
+            logger.info("บอทออกจากช่องเสียงแล้ว!")
         except Exception as e:
-            logger.error(f"ERROR ใน audio_player_task ของ Guild {guild.name}: {e}", exc_info=True)
-            if 'message_queue' in locals() and not message_queue.empty():
-                 message_queue.task_done()
+            logger.error(f"ERROR: เกิดข้อผิดพลาดขณะออกจากช่องเสียง: {e}")
+
+    async def on_voice_state_update(self, member, before, after):
+        """ปรับจำนวนสมาชิกในห้องตามเหตุการณ์เสียง โดยไม่ต้องไล่รายชื่อสมาชิกทุกครั้ง"""
+        session = self._sessions.get(member.guild.id)
+        if session is None:
+            return
+
+        if member.id == bot.user.id:
+            if after.channel is None:
+                # บอทถูกตัดการเชื่อมต่อหรือถูกเตะออกจากช่องเสียง
+                await self.close(member.guild.id, disconnect=False)
+                logger.info(f"บอทถูกตัดการเชื่อมต่อจากช่องเสียงใน Guild {member.guild.name}, หยุด worker task แล้ว")
+            elif before.channel != after.channel:
+                session.recount_humans()
+            return
+
+        if member.bot or before.channel == after.channel:
+            return  # บอทตัวอื่น หรือแค่เปิด/ปิดไมค์
+        channel = session.channel
+        if channel is None:
+            return
+        if before.channel is not None and before.channel.id == channel.id:
+            session.human_count -= 1
+            if session.human_count < 0:
+                session.recount_humans()
+        elif after.channel is not None and after.channel.id == channel.id:
+            session.human_count += 1
+        else:
+            return
+
+        if session.human_count > 0:
+            session.cancel_idle_disconnect()
+        elif self.idle_grace > 0:
+            logger.info(f"ช่องเสียง {channel.name} ว่างแล้ว จะออกจากช่องเสียงถ้าไม่มีใครกลับมาใน {self.idle_grace:.0f} วินาที")
+            self.schedule_idle_disconnect(session)
+        else:
+            await self._disconnect_when_idle(session)
+
+    def discard_all_temp_files(self):
+        """ลบไฟล์ชั่วคราวที่ค้างอยู่ของทุก session (ใช้ตอนปิดโปรแกรม)"""
+        for session in self.values():
+            session.discard_temp_files()
+
+voice_sessions = VoiceSessionManager()
 
 # --- เหตุการณ์ของบอท (Events) ---
 
+@bot.event
+async def setup_hook():
+    """
+    ทำงานครั้งเดียวก่อนเชื่อมต่อ Gateway (ไม่ทำซ้ำเมื่อ reconnect)
+    การตั้งค่าราย Guild จะโหลดแบบ lazy เมื่อ Guild ถูกใช้งานครั้งแรก จึงไม่ต้องวนทุก Guild ตอนเริ่มต้น
+    """
+    startup_timer.mark('login')
+    guild_settings.start()
+
+    # โหลดข้อมูลถามตอบจากไฟล์และเฝ้าดูการแก้ไขไฟล์เพื่อโหลดใหม่โดยไม่ต้องรีสตาร์ทบอท
+    qa_index.reload()
+    startup_timer.mark('qa_index_load')
+    if QA_RELOAD_INTERVAL > 0:
+        bot.loop.create_task(qa_index.watch(QA_RELOAD_INTERVAL))
+
+    if HEALTH_FILE:
+        bot.loop.create_task(health_report_loop(HEALTH_FILE, HEALTH_INTERVAL))
+    if METRICS_PORT:
+        try:
+            await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"ERROR: เปิด metrics endpoint ที่พอร์ต {METRICS_PORT} ไม่สำเร็จ: {e}")
+    logger.info(f"ตั้งค่าเริ่มต้นของ Guild ใหม่: โหมด 'ปิดโหมดสายลับ' (อ่านเฉพาะช่องที่กำหนด), ความเร็ว {DEFAULT_TTS_SPEED}x")
+    startup_timer.mark('setup_hook')
+
+def preload_lazy_modules():
+    """import ไลบรารีที่โหลดแบบ lazy ล่วงหน้า (รันใน thread) เพื่อไม่ให้คำขอแรกต้องรอ import บน event loop"""
+    started = time.perf_counter()
+    try:
+        import gtts.lang  # noqa: F401
+        import pydub  # noqa: F401
+        if GEMINI_API_KEY:
+            get_gemini_model()
+    except Exception as e:
+        logger.warning(f"โหลดไลบรารีล่วงหน้าไม่สำเร็จ จะลองโหลดอีกครั้งตอนใช้งานจริง: {e}")
+        return
+    logger.info(f"โหลดไลบรารี TTS/AI ล่วงหน้าเสร็จแล้ว ({time.perf_counter() - started:.2f} s)")
+
 @bot.event
 async def on_ready():
     """
@@ -111,162 +962,1359 @@ async def on_ready():
     """
     logger.info(f'บอท {bot.user.name} พร้อมใช้งานแล้ว!')
     logger.info('--------------------')
-    
-    # ตั้งค่าเริ่มต้นสำหรับโหมดการอ่านข้อความ
-    bot.restricted_mode_guilds = set(guild.id for guild in bot.guilds) 
-    bot.designated_text_channel_id = {}
-    logger.info("ตั้งค่าโหมดการอ่านข้อความเป็นเริ่มต้น: 'ปิดโหมดสายลับ' (อ่านเฉพาะช่องที่กำหนด)")
-    
-    # สร้างคิวสำหรับเก็บข้อความและ Task สำหรับเล่นเสียง
-    bot.message_queues = {}
-    bot.worker_tasks = {}
-
-    # ข้อมูลถามตอบ
-    bot.qa_data = {
-        "สวัสดี": "สวัสดีครับ มีอะไรให้ผมรับใช้ครับ",
-        "เจ็บไหม": "เจ็บไหม? : มาย ไม่เจ็บหรอก... แค่ชินกับการไม่ได้เป็นคนสำคัญ",
-        "ใครกลัวยาย": "ใครกล้ายาย : กอก้า กล้า กลัวยายไง",
-        "เป็นอะไร": "เป็นอะไร ทำไมไม่เหมือนเดิม? : เขา เปลี่ยนไปนานแล้ว แต่ไม่มีใครสังเกต",
-        "ใครไม่ชอบออกตัดเลือด": "ใครไม่ชอบออกตัดเลือด : โอ้ คำถามนี้ ถือว่าถามได้ดีเลย จากการประมวลผลใน Server Family Game 24 Hrs. แล้ว สรุปได้ว่า คนที่ไม่ชอบออกตัดเลือดคือ ตระกูล ม.ม้า นะคะ",
-        "ใครผัวเยอะที่สุด": "ใครผัวเยอะที่สุด : โมเดลเมจขาตายไม่ออกตัดเลือด",
-        "ใครขี้เมาที่สุด": "ใครขี้เมาที่สุด : เมษาเมจไงคะ ขี้เมาที่สุดแล้ว",
-        "จนมาเห็นกับตา": "จนมาเห็นกับตาจนพาใจมาเจ็บ  ฉีกบ่มีหม่องเย็บ หัวใจที่ให้เจ้า",
-        "มายรอเขาอยู่เหรอ": "มาย รอมาตลอด แต่เขาไม่เคยหันกลับมาเลย",
-        "ใครจกที่สุด": "ใครจกที่สุด : ไก่มายไงคะ จกที่สุดแล้ว",
-        "เจ้ตามเป็นอะไร": "เจ้ตามเป็นอะไร : เจ้ตามเป็นของทุกคนเลยนะจ๊ะ",
-        "ใครหล่อที่สุด": "ใครหล่อที่สุด : พี่คิวสุดหล่อเจ้าของดิสไงคะ"
-    }
-    logger.info("ตั้งค่าข้อมูลถามตอบแบบกำหนดเองเรียบร้อยแล้ว.")
+    # on_ready ถูกเรียกซ้ำได้เมื่อ reconnect จึงไม่ล้าง session เสียงที่มีอยู่ที่นี่
+    if 'gateway' in startup_timer.phases:
+        return
+    startup_timer.mark('gateway')
+    logger.info(f"เวลาเริ่มต้นระบบ: {startup_timer.report()}")
+    bot.loop.run_in_executor(None, preload_lazy_modules)
+    if TTS_WARMUP:
+        bot.loop.create_task(run_tts_warmup())
 
-    # ตั้งค่าความเร็วการพูดเริ่มต้น
-    bot.tts_speed = 1.2 
-    logger.info(f"ตั้งค่าความเร็วการพูดเริ่มต้นเป็น {bot.tts_speed}x")
-    
 @bot.event
 async def on_guild_join(guild):
     """เมื่อบอทเข้าเซิร์ฟเวอร์ใหม่ ให้ตั้งค่าเริ่มต้นเป็นโหมดจำกัด"""
     logger.info(f"บอทถูกเชิญเข้าเซิร์ฟเวอร์ใหม่: {guild.name} (ID: {guild.id})")
-    bot.restricted_mode_guilds.add(guild.id)
+    await guild_settings.load(guild.id)
+    guild_settings.update(guild.id, restricted=True)
     logger.info(f"ตั้งค่าเริ่มต้นสำหรับ {guild.name} เป็น 'ปิดโหมดสายลับ' เรียบร้อยแล้ว")
 
 @bot.event
-async def on_voice_state_update(member, before, after):
-    """จัดการเมื่อสถานะเสียงของสมาชิกมีการเปลี่ยนแปลง"""
-    if member == bot.user:
-        return
-    
-    if before.channel and before.channel.guild.voice_client:
-        if not member.guild.voice_client:
-            guild_id = member.guild.id
-            if guild_id in bot.worker_tasks:
-                task = bot.worker_tasks.pop(guild_id)
-                task.cancel()
-                bot.message_queues.pop(guild_id, None)
-                logger.info(f"บอทถูกตัดการเชื่อมต่อจากช่องเสียงใน Guild {member.guild.name}, หยุด worker task แล้ว")
+async def on_guild_remove(guild):
+    """เมื่อบอทถูกเตะออกจากเซิร์ฟเวอร์ ให้ปิด session เสียงที่ค้างอยู่"""
+    await voice_sessions.close(guild.id, disconnect=False)
 
-    if member.guild.voice_client:
-        voice_channel = member.guild.voice_client.channel
-        if voice_channel:
-            members_in_channel = [m for m in voice_channel.members if not m.bot]
-            if len(members_in_channel) == 0:
-                logger.info(f"ไม่มีสมาชิกเหลือในช่องเสียง {voice_channel.name} แล้ว บอทกำลังจะออกจากช่องเสียง...")
-                try:
-                    guild_id = member.guild.id
-                    if guild_id in bot.worker_tasks:
-                        task = bot.worker_tasks.pop(guild_id)
-                        task.cancel()
-                        bot.message_queues.pop(guild_id, None)
-                        logger.info(f"หยุด worker task สำหรับ Guild {member.guild.name} ก่อนออกจากห้อง")
-
-                    await member.guild.voice_client.disconnect()
-                    logger.info("บอทออกจากช่องเสียงแล้ว!")
-                except Exception as e:
-                    logger.error(f"ERROR: เกิดข้อผิดพลาดขณะออกจากช่องเสียง: {e}")
+@bot.event
+async def on_voice_state_update(member, before, after):
+    """จัดการเมื่อสถานะเสียงของสมาชิกมีการเปลี่ยนแปลง (ส่งต่อให้ session ของ Guild นั้น)"""
+    await voice_sessions.on_voice_state_update(member, before, after)
 
 # --- ส่วนของการบันทึกข้อความอัตโนมัติ ---
 @bot.event
 async def on_message(message):
     """
     ฟังก์ชันที่ทำงานทุกครั้งเมื่อมีข้อความใหม่
+    ข้อความส่วนใหญ่จะไม่ถูกอ่านออกเสียง จึงตัดทิ้งให้เร็วที่สุดก่อนทำงานอื่น
     """
     # 1. ไม่สนใจข้อความจากบอทตัวเอง
     if message.author == bot.user:
         return
 
-    # 2. [ส่วนที่เพิ่มใหม่] บันทึกข้อความจากทุกแชนเนลที่บอทเห็น
-    if message.guild:
-        log_text = (f"[{message.guild.name} > #{message.channel.name}] "
-                    f"{message.author.display_name}: {message.content}")
-        logger.info(log_text)
+    content = message.content
+    guild = message.guild
+
+    # 2. บันทึกข้อความจากทุกแชนเนลที่บอทเห็น (จัดรูปแบบและเขียนบน thread เบื้องหลัง)
+    if guild is not None and CHAT_LOG_ENABLED and (CHAT_LOG_SAMPLE_RATE >= 1.0 or random.random() < CHAT_LOG_SAMPLE_RATE):
+        chat_log.log(guild.name, message.channel.name, message.author.display_name, content)
 
     # 3. ตรวจสอบและประมวลผลคำสั่ง (เหมือนเดิม)
-    if message.content.startswith(tuple(bot.command_prefix)):
+    if content.startswith(COMMAND_PREFIXES):
         await bot.process_commands(message)
         return
 
     # 4. ตรรกะสำหรับส่งข้อความไปอ่านออกเสียง (TTS)
-    if not message.guild:
+    # Guild ที่ไม่มี session เสียงอยู่ ตัดทิ้งได้ทันที
+    if guild is None:
         return
-    
-    guild_id = message.guild.id
-    if not message.guild.voice_client or not message.guild.voice_client.is_connected() or guild_id not in bot.message_queues:
+    session = voice_sessions.get(guild.id)
+    if session is None:
         return
 
     # ตรวจสอบว่าต้องอ่านข้อความจากช่องนี้หรือไม่
-    if guild_id in bot.restricted_mode_guilds:
-        designated_channel_id = bot.designated_text_channel_id.get(guild_id)
-        if not designated_channel_id or message.channel.id != designated_channel_id:
-            return 
-
-    # ส่งข้อความเข้าคิวสำหรับ TTS
-    text_to_read = message.content
-    queue = bot.message_queues.get(guild_id)
-    if queue:
-        await queue.put(text_to_read)
-        # ไม่ต้อง log ซ้ำ เพราะ log ไปแล้วข้างบน
+    settings = await guild_settings.load(guild.id)
+    if settings.restricted and message.channel.id != settings.designated_channel_id:
+        return
+
+    if not session.is_connected():
+        return
+
+    # ปรับข้อความให้เหมาะกับการอ่าน (ข้อความที่มีแต่สิ่งที่อ่านไม่ได้ เช่นไฟล์แนบ จะไม่ถูกส่งเข้าคิว)
+    text = normalize_for_speech(content, guild)
+    if not text:
+        return
+
+    # ส่งข้อความเข้าคิวสำหรับ TTS (ข้อความยาวจะถูกแบ่งเป็นช่วงเพื่อให้เริ่มพูดได้เร็วขึ้น)
+    author_id = message.author.id
+    queue = session.queue
+    for chunk in split_for_speech(text):
+        queue.put_nowait(SpeechItem(chunk, author_id))
+
+
+# --- TTS backend และการเลือก backend อัตโนมัติ ---
+# ลำดับ backend ที่จะใช้ (ตัวแรกคือตัวหลัก ตัวถัดไปเป็นตัวสำรองเมื่อตัวก่อนหน้าช้าหรือล่ม)
+# 'gtts': Google Translate TTS, 'espeak': espeak-ng บนเครื่อง (ไม่ต้องใช้เน็ต), 'http': เซิร์ฟเวอร์ TTS ตาม TTS_HTTP_URL
+TTS_BACKENDS = [name.strip() for name in os.getenv('TTS_BACKENDS', 'gtts,espeak').split(',') if name.strip()]
+TTS_REQUEST_TIMEOUT = float(os.getenv('TTS_REQUEST_TIMEOUT', '10'))
+TTS_ESPEAK_COMMAND = os.getenv('TTS_ESPEAK_COMMAND', 'espeak-ng')
+TTS_HTTP_URL = os.getenv('TTS_HTTP_URL')
+TTS_HTTP_FORMAT = os.getenv('TTS_HTTP_FORMAT', 'wav')  # รูปแบบไฟล์เสียงที่เซิร์ฟเวอร์ HTTP ส่งกลับมา
+# ล้มเหลวติดกันกี่ครั้งจึงตัดวงจร (หยุดใช้ backend นั้นชั่วคราว) และหยุดนานกี่วินาทีก่อนลองใหม่
+TTS_BREAKER_FAILURES = max(1, int(os.getenv('TTS_BREAKER_FAILURES', '3')))
+TTS_BREAKER_COOLDOWN = float(os.getenv('TTS_BREAKER_COOLDOWN', '30'))
+# ถ้า p95 ของเวลาสังเคราะห์เสียงในช่วง TTS_LATENCY_WINDOW วินาทีล่าสุดเกินค่านี้ จะย้ายไปใช้ backend ถัดไปก่อน
+# เมื่อไม่มีข้อมูลใหม่ ข้อมูลเก่าจะหมดอายุไปเอง แล้ว backend หลักจะถูกลองใช้อีกครั้ง
+TTS_LATENCY_THRESHOLD = float(os.getenv('TTS_LATENCY_THRESHOLD', '4'))
+TTS_LATENCY_WINDOW = float(os.getenv('TTS_LATENCY_WINDOW', '60'))
+
+class TTSBackend:
+    """
+    ตัวสังเคราะห์เสียงหนึ่งแบบ synthesize() เป็นงาน blocking และถูกเรียกบน Synthesis pool
+    backend ต้องสร้างจากค่าใน Environment เท่านั้น เพื่อให้โปรเซสลูกของ pool สร้างตัวเดียวกันได้
+    """
+    name = ''
+    audio_format = 'mp3'  # นามสกุลของข้อมูลเสียงที่ synthesize() คืนมา
+
+    @property
+    def available(self):
+        return True
+
+    def synthesize(self, text, lang):
+        """คืนข้อมูลเสียง (bytes) ของข้อความ"""
+        raise NotImplementedError
 
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS ผ่าน gTTS (ต้องต่อเน็ต และโดนจำกัดอัตราได้)"""
+    name = 'gtts'
+    audio_format = 'mp3'
+
+    def synthesize(self, text, lang):
+        from gtts import gTTS
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, timeout=TTS_REQUEST_TIMEOUT).write_to_fp(buffer)
+        return buffer.getvalue()
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng บนเครื่อง: เสียงไม่เป็นธรรมชาติเท่า gTTS แต่เร็วและไม่ต้องใช้เน็ต"""
+    name = 'espeak'
+    audio_format = 'wav'
+
+    def __init__(self, command=TTS_ESPEAK_COMMAND):
+        self.command = command
+
+    @property
+    def available(self):
+        return shutil.which(self.command) is not None
+
+    def synthesize(self, text, lang):
+        # ส่งข้อความทาง stdin เพื่อไม่ให้ข้อความที่ขึ้นต้นด้วย '-' ถูกตีความเป็น option
+        result = subprocess.run([self.command, '--stdout', '-v', lang, '--stdin'],
+                                input=text.encode('utf-8'), capture_output=True, check=True,
+                                timeout=TTS_REQUEST_TIMEOUT)
+        return result.stdout
+
+class HTTPBackend(TTSBackend):
+    """เซิร์ฟเวอร์ TTS ภายนอก (เช่น piper ที่ห่อด้วย HTTP): POST JSON {"text", "lang"} แล้วได้ไฟล์เสียงกลับมา"""
+    name = 'http'
+
+    def __init__(self, url=TTS_HTTP_URL, audio_format=TTS_HTTP_FORMAT):
+        self.url = url
+        self.audio_format = audio_format
+
+    @property
+    def available(self):
+        return bool(self.url)
+
+    def synthesize(self, text, lang):
+        request = urllib.request.Request(self.url, data=json.dumps({'text': text, 'lang': lang}).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=TTS_REQUEST_TIMEOUT) as response:
+            return response.read()
+
+tts_backends = {backend.name: backend for backend in (GTTSBackend(), EspeakBackend(), HTTPBackend())}
+
+class BackendHealth:
+    """สถานะของ backend หนึ่งตัว: circuit breaker และเวลาสังเคราะห์เสียงล่าสุด (ใช้บน event loop เท่านั้น)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # มากกว่า 0 = วงจรถูกตัดอยู่ (open) ถึงเวลานี้
+        self.trial_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self._latencies = deque(maxlen=200)  # (เวลาที่บันทึก, วินาที)
+
+    def state(self, now):
+        if self.open_until == 0.0:
+            return 'closed'
+        return 'open' if now < self.open_until or self.trial_in_flight else 'half_open'
+
+    def latency_p95(self, now):
+        """p95 ของเวลาสังเคราะห์เสียงใน TTS_LATENCY_WINDOW วินาทีล่าสุด (None ถ้าข้อมูลน้อยเกินไป)"""
+        latencies = self._latencies
+        while latencies and now - latencies[0][0] > TTS_LATENCY_WINDOW:
+            latencies.popleft()
+        if len(latencies) < 5:
+            return None
+        recent = sorted(seconds for _, seconds in latencies)
+        return recent[int(len(recent) * 0.95)]
+
+    def record_success(self, seconds, now):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self._latencies.append((now, seconds))
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.open_until or self.consecutive_failures >= TTS_BREAKER_FAILURES:
+            self.open_until = now + TTS_BREAKER_COOLDOWN
+
+class TTSRouter:
+    """
+    เลือก backend สำหรับแต่ละข้อความ และลองตัวถัดไปทันทีถ้าตัวที่เลือกล้มเหลว
+    - backend ที่ล้มเหลวติดกัน TTS_BREAKER_FAILURES ครั้งจะถูกข้ามไป TTS_BREAKER_COOLDOWN วินาที
+      แล้วปล่อยให้ลองหนึ่งงาน (half-open) ถ้าสำเร็จจึงกลับมาใช้ตามปกติ
+    - backend ที่ p95 ช้ากว่า TTS_LATENCY_THRESHOLD จะถูกเลื่อนไปไว้หลัง backend ที่ยังเร็วอยู่
+    """
+
+    def __init__(self, names, backends):
+        self.health = []
+        for name in names:
+            backend = backends.get(name)
+            if backend is None:
+                logger.warning(f"ไม่รู้จัก TTS backend '{name}' จะข้ามไป")
+            elif not backend.available:
+                logger.warning(f"TTS backend '{name}' ใช้งานไม่ได้บนเครื่องนี้ จะข้ามไป")
+            else:
+                self.health.append(BackendHealth(backend))
+        if not self.health:
+            raise RuntimeError("ไม่มี TTS backend ที่ใช้งานได้ (ตรวจสอบ TTS_BACKENDS)")
+
+    @property
+    def primary(self):
+        """backend หลัก: ไฟล์เสียงจาก backend นี้เท่านั้นที่ถูกเก็บในแคช"""
+        return self.health[0].backend.name
+
+    def candidates(self):
+        """คืนลำดับ backend ที่จะลองสำหรับงานถัดไป"""
+        now = time.monotonic()
+        fast, slow = [], []
+        for health in self.health:
+            if health.state(now) == 'open':
+                continue
+            p95 = health.latency_p95(now)
+            (slow if p95 is not None and p95 > TTS_LATENCY_THRESHOLD else fast).append(health)
+        # ถ้าทุกตัวถูกตัดวงจรอยู่ ยังต้องลองสักตัวดีกว่าทิ้งข้อความ
+        return fast + slow or list(self.health)
+
+    async def run(self, guild_id, fn, *args, discard=None):
+        """
+        เรียก fn(ชื่อ backend, *args) บน Synthesis pool โดยลองทีละ backend จนกว่าจะสำเร็จ
+        fn ต้องคืน tuple ที่มี dict เวลาของแต่ละขั้นตอน (มีคีย์ 'synthesis') เป็นค่าสุดท้าย
+        คืนค่า (ชื่อ backend ที่ใช้, ผลลัพธ์ของ fn)
+        """
+        last_error = None
+        for health in self.candidates():
+            name = health.backend.name
+            # backend ที่อยู่ในสถานะ half-open ปล่อยงานเดียวผ่านไปทดสอบว่ากลับมาใช้ได้หรือยัง
+            # ต้องตั้ง flag ตอนส่งงานจริงเท่านั้น และล้างเสมอ (รวมถึงตอนถูกยกเลิก) ไม่อย่างนั้นวงจรจะค้างเป็น open
+            trial = health.state(time.monotonic()) == 'half_open'
+            if trial:
+                health.trial_in_flight = True
+            try:
+                result = await synthesis_pool.submit(guild_id, fn, name, *args, discard=discard)
+            except Exception as e:
+                health.record_failure(time.monotonic())
+                last_error = e
+                logger.warning(f"TTS backend '{name}' ล้มเหลว: {e}")
+                continue
+            finally:
+                if trial:
+                    health.trial_in_flight = False
+            health.record_success(result[-1]['synthesis'], time.monotonic())
+            return name, result
+        raise last_error
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            health.backend.name: {
+                'state': health.state(now),
+                'latency_p95': health.latency_p95(now),
+                'successes': health.successes,
+                'failures': health.failures,
+            }
+            for health in self.health
+        }
+
+tts_router = TTSRouter(TTS_BACKENDS, tts_backends)
 
 # --- ฟังก์ชันเสริม (Helper Functions) ---
-def text_to_speech_gtts(text, lang='th'):
-    """แปลงข้อความเป็นไฟล์เสียง MP3 ด้วย gTTS"""
-    unique_filename = f"temp_audio_{uuid.uuid4().hex}.mp3"
-    tts = gTTS(text=text, lang=lang)
-    tts.save(unique_filename)
+def text_to_speech_file(backend_name, text, lang='th'):
+    """แปลงข้อความเป็นไฟล์เสียงชั่วคราวด้วย backend ที่กำหนด"""
+    backend = tts_backends[backend_name]
+    data = backend.synthesize(text, lang)
+    unique_filename = f"temp_audio_{uuid.uuid4().hex}.{backend.audio_format}"
+    with open(unique_filename, 'wb') as f:
+        f.write(data)
     return unique_filename
 
+def synthesize_bytes(backend_name, text, lang):
+    """
+    แปลงข้อความเป็นเสียงในหน่วยความจำ (ไม่เขียนไฟล์) บน Synthesis pool
+    คืนค่า (ข้อมูลเสียง, นามสกุลไฟล์, เวลาของแต่ละขั้นตอน)
+    """
+    backend = tts_backends[backend_name]
+    started = time.perf_counter()
+    data = backend.synthesize(text, lang)
+    return data, backend.audio_format, {'synthesis': time.perf_counter() - started}
+
+def synthesize_to_file(backend_name, text, lang, speed, file_format='mp3'):
+    """
+    สร้างไฟล์เสียง ปรับความเร็ว และแปลงเป็น Opus ถ้าต้องการ ในขั้นตอนเดียว (รันบน Synthesis pool)
+    ไฟล์ระหว่างทางจะถูกลบทันที คืนค่า (ไฟล์ที่จะเล่น, ปรับความเร็วสำเร็จหรือไม่, เวลาของแต่ละขั้นตอน)
+    """
+    timings = {}
+    started = time.perf_counter()
+    final_file = text_to_speech_file(backend_name, text, lang=lang)
+    timings['synthesis'] = time.perf_counter() - started
+    speed_applied = speed == 1.0
+    if not speed_applied:
+        started = time.perf_counter()
+        adjusted_file = change_audio_speed(final_file, speed)
+        timings['speed_adjust'] = time.perf_counter() - started
+        if adjusted_file:
+            cleanup_files_after_play(None, final_file)
+            final_file = adjusted_file
+            speed_applied = True
+    if file_format == 'opus':
+        started = time.perf_counter()
+        opus_file = encode_opus_file(final_file)
+        timings['encode'] = time.perf_counter() - started
+        if opus_file:
+            cleanup_files_after_play(None, final_file)
+            final_file = opus_file
+    return final_file, speed_applied, timings
+
+def encode_opus_file(input_path):
+    """แปลงไฟล์เสียงเป็น Ogg Opus (48 kHz stereo) ด้วย FFmpeg เพื่อให้ FFmpegOpusAudio ส่งต่อได้ทันที"""
+    output_path = os.path.splitext(input_path)[0] + ".opus"
+    try:
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path, '-map_metadata', '-1',
+             '-c:a', 'libopus', '-ar', '48000', '-ac', '2', '-b:a', f'{TTS_OPUS_BITRATE}k', output_path],
+            check=True, stdin=subprocess.DEVNULL, capture_output=True)
+        return output_path
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"Failed to encode Opus: {e}")
+        return None
+
 def change_audio_speed(input_path, speed_factor):
     """ปรับความเร็วของไฟล์เสียงด้วย pydub"""
     try:
-        audio = AudioSegment.from_mp3(input_path)
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(input_path)
         speed_adjusted_audio = audio.speedup(playback_speed=speed_factor)
-        output_path = input_path.replace(".mp3", "_speed_adjusted.mp3")
+        output_path = os.path.splitext(input_path)[0] + "_speed_adjusted.mp3"
         speed_adjusted_audio.export(output_path, format="mp3")
         return output_path
     except Exception as e:
         logger.error(f"Failed to adjust audio speed: {e}")
         return None
 
-def cleanup_files_after_play(error, original_file, adjusted_file):
-    """ลบไฟล์เสียงชั่วคราวหลังเล่นจบ"""
+def cleanup_files_after_play(error, *files):
+    """ลบไฟล์เสียงชั่วคราวหลังเล่นจบ (ไม่ลบไฟล์ที่อยู่ในแคช TTS)"""
     if error:
         logger.error(f'Player error: {error}')
     try:
-        if os.path.exists(original_file):
-            os.remove(original_file)
-        if adjusted_file and os.path.exists(adjusted_file):
-            os.remove(adjusted_file)
+        for path in files:
+            if path and not tts_cache.owns(path) and os.path.exists(path):
+                os.remove(path)
     except OSError as e:
         logger.error(f"Error during file cleanup: {e}")
 
+# --- ระบบแคชไฟล์เสียง TTS ---
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', 'tts_cache')
+TTS_CACHE_MAX_ENTRIES = int(os.getenv('TTS_CACHE_MAX_ENTRIES', '500'))
+TTS_CACHE_MAX_MB = float(os.getenv('TTS_CACHE_MAX_MB', '200'))
+
+class TTSAudioCache:
+    """
+    แคชไฟล์เสียง TTS แบบ content-addressed พร้อมไล่ไฟล์ออกแบบ LRU
+    คีย์คือ (ข้อความที่ normalize แล้ว, ภาษา, ความเร็ว) และเก็บไฟล์ที่ปรับความเร็วแล้ว
+    เมื่อ cache hit จึงไม่ต้องเรียก gTTS, ไม่ต้อง encode ด้วย pydub และไม่ต้องเขียนไฟล์ใหม่
+    """
+
+    def __init__(self, directory, max_entries, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = max_entries > 0 and max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (path, size) เรียงจากใช้ล่าสุดน้อยที่สุดไปมากที่สุด
+        self._pins = {}  # key -> จำนวนคลิปที่ยังรอเล่นหรือกำลังเล่นไฟล์นี้อยู่ (ห้ามลบ)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_existing()
+
+    @staticmethod
+    def make_key(text, lang, speed, file_format='mp3', backend='gtts'):
+        """สร้างคีย์จากข้อความ (ตัดช่องว่างซ้ำ/Unicode NFC), ภาษา, ความเร็ว, รูปแบบไฟล์ และ TTS backend"""
+        normalized = " ".join(unicodedata.normalize('NFC', text).split())
+        raw = f"{lang}\x00{float(speed):.2f}\x00{file_format}\x00{normalized}"
+        if backend != 'gtts':
+            # คีย์ของ gTTS ไม่มีชื่อ backend เพื่อให้ไฟล์ในแคชเดิมยังใช้ได้
+            raw = f"{backend}\x00{raw}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _load_existing(self):
+        """โหลดไฟล์ที่มีอยู่แล้วในโฟลเดอร์แคช โดยใช้ mtime เป็นลำดับการใช้งาน"""
+        found = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in ('.mp3', '.opus', '.wav'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, key, path, stat.st_size))
+        found.sort()
+        with self._lock:
+            for _, key, path, size in found:
+                self._entries[key] = (path, size)
+                self._total_bytes += size
+            self._evict_locked()
+        logger.info(f"โหลดแคช TTS แล้ว {len(self._entries)} ไฟล์ ({self._total_bytes / 1_048_576:.1f} MB)")
+
+    def _evict_locked(self):
+        # ข้ามไฟล์ที่ถูก pin ไว้ (คลิปที่รอเล่นอยู่ใน prefetch หรือกำลังเล่น) ถ้าเหลือแต่ไฟล์ที่ถูก pin
+        # จะยอมให้แคชเกินงบชั่วคราว แล้วไล่ออกต่อเมื่อ release()
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            key = next((k for k in self._entries if k not in self._pins), None)
+            if key is None:
+                break
+            path, size = self._entries.pop(key)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"ลบไฟล์แคช TTS ไม่สำเร็จ: {e}")
+
+    def get(self, text, lang, speed, file_format='mp3', backend='gtts', count_stats=True):
+        """
+        คืน path ของไฟล์ในแคช หรือ None ถ้าไม่มี (count_stats=False จะไม่นับครั้งนี้ในสถิติ hit/miss)
+        ไฟล์ที่คืนไปจะถูก pin ไว้ไม่ให้ถูกไล่ออก ผู้เรียกต้องเรียก release(path) เมื่อเลิกใช้ไฟล์แล้ว
+        """
+        if not self.enabled:
+            return None
+        key = self.make_key(text, lang, speed, file_format, backend)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                try:
+                    # อัปเดต mtime เพื่อให้ลำดับ LRU คงอยู่หลังรีสตาร์ท
+                    os.utime(entry[0])
+                except FileNotFoundError:
+                    # ไฟล์ถูกลบไปแล้ว (เช่นโปรเซสอื่นที่ใช้โฟลเดอร์แคชเดียวกันไล่ออก)
+                    del self._entries[key]
+                    self._total_bytes -= entry[1]
+                    entry = None
+                except OSError:
+                    pass
+            if entry is None:
+                if count_stats:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._pins[key] = self._pins.get(key, 0) + 1
+            if count_stats:
+                self.hits += 1
+        return entry[0]
+
+    def release(self, path):
+        """ปลด pin ที่ได้จาก get() หรือ put(pin=True) หนึ่งครั้ง (เรียกจาก thread ของ player ได้)"""
+        key = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            count = self._pins.get(key, 0)
+            if count > 1:
+                self._pins[key] = count - 1
+            elif count == 1:
+                del self._pins[key]
+                self._evict_locked()
+
+    def put(self, text, lang, speed, source_path, file_format='mp3', backend='gtts', pin=False):
+        """
+        ย้ายไฟล์เสียงเข้าแคชแล้วคืน path ใหม่ (pin=True จะ pin ไฟล์ไว้เหมือน get())
+        ถ้าแคชปิดอยู่หรือย้ายไฟล์ไม่สำเร็จ จะคืน source_path เดิม
+        """
+        if not self.enabled:
+            return source_path
+        key = self.make_key(text, lang, speed, file_format, backend)
+        dest = os.path.join(self.directory, f"{key}.{file_format}")
+        try:
+            size = os.path.getsize(source_path)
+            shutil.move(source_path, dest)
+        except OSError as e:
+            logger.error(f"เพิ่มไฟล์เข้าแคช TTS ไม่สำเร็จ: {e}")
+            return source_path
+        self._add(key, dest, size, pin)
+        return dest
+
+    def put_bytes(self, text, lang, speed, data, file_format='mp3', backend='gtts'):
+        """เขียนข้อมูลเสียงจากหน่วยความจำลงแคชโดยตรง คืน path ในแคช หรือ None ถ้าไม่ได้เก็บ"""
+        if not self.enabled:
+            return None
+        key = self.make_key(text, lang, speed, file_format, backend)
+        dest = os.path.join(self.directory, f"{key}.{file_format}")
+        partial = f"{dest}.{uuid.uuid4().hex}.part"
+        try:
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, dest)
+        except OSError as e:
+            logger.error(f"เพิ่มไฟล์เข้าแคช TTS ไม่สำเร็จ: {e}")
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return None
+        self._add(key, dest, len(data))
+        return dest
+
+    def _add(self, key, path, size, pin=False):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._total_bytes -= old[1]
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+            if pin:
+                self._pins[key] = self._pins.get(key, 0) + 1
+            self._evict_locked()
+
+    def owns(self, path):
+        """ตรวจสอบว่าไฟล์นี้อยู่ในโฟลเดอร์แคชหรือไม่"""
+        return os.path.dirname(os.path.abspath(path)) == self.directory
+
+    def stats(self):
+        """คืนตัวเลขสถิติของแคชสำหรับใช้ปรับขนาด"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+startup_timer.mark('module_init')
+tts_cache = TTSAudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_ENTRIES, int(TTS_CACHE_MAX_MB * 1_048_576))
+startup_timer.mark('tts_cache_load')
+
+# --- Pool สำหรับงานสังเคราะห์เสียง (gTTS / pydub) ---
+# งานเหล่านี้เป็นงาน blocking จึงต้องย้ายออกจาก event loop ของ discord.py
+SYNTH_POOL_KIND = os.getenv('SYNTH_POOL_KIND', 'thread')  # 'thread' หรือ 'process'
+SYNTH_POOL_WORKERS = max(1, int(os.getenv('SYNTH_POOL_WORKERS', str(min(8, (os.cpu_count() or 1) * 2)))))
+
+class SynthesisPool:
+    """
+    Pool ที่รันงานสังเคราะห์เสียงบน thread/process pool แยกจาก event loop
+    จำกัดจำนวนงานที่รันพร้อมกันทั้งระบบ และจ่ายงานแบบ round-robin ระหว่าง Guild
+    เพื่อไม่ให้ Guild ที่แชทเยอะแย่งคิวของ Guild อื่นจนหมด
+    """
+
+    def __init__(self, kind, max_workers):
+        self.kind = kind
+        self.max_workers = max_workers
+        self._executor = None  # สร้างเมื่อใช้งานครั้งแรก
+        self._pending = OrderedDict()  # guild_id -> deque ของงานที่รอ
+        self._active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self._recent_waits = deque(maxlen=256)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='tts-synth')
+            logger.info(f"เริ่ม Synthesis pool แบบ {self.kind} จำนวน {self.max_workers} workers")
+        return self._executor
+
+    def submit(self, guild_id, fn, *args, discard=None):
+        """
+        ส่งงานเข้าคิวของ Guild แล้วคืน asyncio.Future ของผลลัพธ์
+        ถ้า Future ถูกยกเลิกระหว่างที่งานกำลังรันอยู่ จะเรียก discard(ผลลัพธ์) เพื่อเก็บกวาดแทน
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(guild_id, deque()).append((future, fn, args, discard, time.perf_counter()))
+        self.submitted += 1
+        self._dispatch(loop)
+        return future
+
+    def _dispatch(self, loop):
+        while self._active < self.max_workers and self._pending:
+            guild_id, jobs = next(iter(self._pending.items()))
+            future, fn, args, discard, enqueued_at = jobs.popleft()
+            # ย้าย Guild นี้ไปท้ายคิว เพื่อให้ Guild ถัดไปได้รันงานก่อน
+            if jobs:
+                self._pending.move_to_end(guild_id)
+            else:
+                del self._pending[guild_id]
+            if future.cancelled():
+                continue
+
+            started_at = time.perf_counter()
+            waited = started_at - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self._recent_waits.append(waited)
+
+            self._active += 1
+            executor_future = loop.run_in_executor(self._get_executor(), fn, *args)
+            executor_future.add_done_callback(
+                functools.partial(self._on_done, loop, future, discard, started_at))
+
+    def _on_done(self, loop, future, discard, started_at, executor_future):
+        self._active -= 1
+        self.run_total += time.perf_counter() - started_at
+        error = executor_future.exception()
+        if error is not None:
+            self.failed += 1
+            if not future.cancelled():
+                future.set_exception(error)
+        else:
+            self.completed += 1
+            if not future.cancelled():
+                future.set_result(executor_future.result())
+            elif discard:
+                discard(executor_future.result())
+        self._dispatch(loop)
+
+    def close(self):
+        """
+        ปิด executor (รองานที่กำลังรันให้จบและยกเลิกงานที่ยังไม่เริ่ม) ใช้ตอนปิดโปรแกรม
+        ถ้าไม่ปิดเอง ProcessPoolExecutor จะพยายามเก็บกวาดตอน interpreter กำลังปิดและเกิด error
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        """คืนตัวเลขความยาวคิวและเวลารอของ pool"""
+        started = self.completed + self.failed + self._active
+        recent = sorted(self._recent_waits)
+        return {
+            'kind': self.kind,
+            'max_workers': self.max_workers,
+            'active': self._active,
+            'queue_depth': sum(len(jobs) for jobs in self._pending.values()),
+            'queue_depth_per_guild': {guild_id: len(jobs) for guild_id, jobs in self._pending.items()},
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'wait_avg': self.wait_total / started if started else 0.0,
+            'wait_p95': recent[int(len(recent) * 0.95)] if recent else 0.0,
+            'wait_max': self.wait_max,
+            'run_avg': self.run_total / (self.completed + self.failed) if self.completed + self.failed else 0.0,
+        }
+
+synthesis_pool = SynthesisPool(SYNTH_POOL_KIND, SYNTH_POOL_WORKERS)
+
+# --- ที่เก็บการตั้งค่าราย Guild ---
+GUILD_SETTINGS_DB = os.getenv('GUILD_SETTINGS_DB', 'guild_settings.db')
+GUILD_SETTINGS_FLUSH_INTERVAL = float(os.getenv('GUILD_SETTINGS_FLUSH_INTERVAL', '5'))
+DEFAULT_TTS_SPEED = 1.2
+DEFAULT_TTS_LANG = 'th'
+
+@dataclass
+class GuildSettings:
+    """การตั้งค่าของแต่ละ Guild"""
+    speed: float = DEFAULT_TTS_SPEED
+    lang: str = DEFAULT_TTS_LANG
+    restricted: bool = True  # True = 'ปิดโหมดสายลับ' (อ่านเฉพาะช่องที่กำหนด)
+    designated_channel_id: Optional[int] = None
+
+class GuildSettingsStore:
+    """
+    ที่เก็บการตั้งค่าราย Guild บน SQLite
+    โหลดจากดิสก์เมื่อ Guild ถูกใช้งานครั้งแรก เก็บไว้ในหน่วยความจำ
+    และเขียนกลับลงดิสก์เป็นรอบๆ (write-behind) เพื่อไม่ให้คำสั่งต้องรอการเขียนไฟล์
+    """
+
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._cache = {}
+        self._dirty = set()
+        self._flush_task = None
+
+    def _connection(self):
+        # เปิดฐานข้อมูลเมื่อใช้งานครั้งแรกเท่านั้น (ต้องถือ _db_lock อยู่)
+        if self._conn is None:
+            # หลายโปรเซส (โหมด Shard) อาจเขียนไฟล์เดียวกัน จึงให้รอ lock ได้นานขึ้น
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS guild_settings ("
+                " guild_id INTEGER PRIMARY KEY,"
+                " speed REAL NOT NULL,"
+                " lang TEXT NOT NULL,"
+                " restricted INTEGER NOT NULL,"
+                " designated_channel_id INTEGER)")
+            self._conn.commit()
+        return self._conn
+
+    def _read(self, guild_id):
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT speed, lang, restricted, designated_channel_id FROM guild_settings WHERE guild_id = ?",
+                (guild_id,)).fetchone()
+        if row:
+            return GuildSettings(speed=row[0], lang=row[1], restricted=bool(row[2]), designated_channel_id=row[3])
+        return GuildSettings()
+
+    def get(self, guild_id):
+        """
+        คืนการตั้งค่าของ Guild (โหลดจากฐานข้อมูลถ้ายังไม่อยู่ในหน่วยความจำ)
+        ถ้ายังไม่อยู่ในหน่วยความจำจะอ่านฐานข้อมูลแบบ blocking บน event loop ควรใช้ load ก่อน
+        """
+        settings = self._cache.get(guild_id)
+        if settings is None:
+            settings = self._cache[guild_id] = self._read(guild_id)
+        return settings
+
+    async def load(self, guild_id):
+        """
+        คืนการตั้งค่าของ Guild โดยอ่านฐานข้อมูลใน thread ถ้ายังไม่อยู่ในหน่วยความจำ
+        การอ่านต้องรอ _db_lock ที่รอบ flush ถืออยู่ และในโหมด Shard อาจต้องรอ lock ของโปรเซสอื่นได้นานถึง 30 วินาที
+        จึงห้ามทำบน event loop
+        """
+        settings = self._cache.get(guild_id)
+        if settings is None:
+            loaded = await asyncio.get_running_loop().run_in_executor(None, self._read, guild_id)
+            # ระหว่างรออาจมีงานอื่นโหลดหรือแก้ไขการตั้งค่าไปแล้ว ให้ใช้ตัวที่อยู่ในหน่วยความจำก่อน
+            settings = self._cache.setdefault(guild_id, loaded)
+        return settings
+
+    def update(self, guild_id, **changes):
+        """แก้ไขการตั้งค่าในหน่วยความจำทันที แล้วรอเขียนลงดิสก์ในรอบ flush ถัดไป"""
+        settings = self.get(guild_id)
+        for name, value in changes.items():
+            setattr(settings, name, value)
+        self._dirty.add(guild_id)
+        return settings
+
+    def _take_dirty_rows(self):
+        rows = []
+        for guild_id in self._dirty:
+            s = self._cache[guild_id]
+            rows.append((guild_id, s.speed, s.lang, int(s.restricted), s.designated_channel_id))
+        self._dirty.clear()
+        return rows
+
+    def _write_rows(self, rows):
+        with self._db_lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO guild_settings"
+                " (guild_id, speed, lang, restricted, designated_channel_id) VALUES (?, ?, ?, ?, ?)",
+                rows)
+            conn.commit()
+
+    def flush(self):
+        """เขียนการตั้งค่าที่เปลี่ยนแปลงทั้งหมดลงดิสก์ทันที (แบบ blocking)"""
+        rows = self._take_dirty_rows()
+        if rows:
+            self._write_rows(rows)
+
+    def start(self):
+        """เริ่ม Task เบื้องหลังที่ flush การตั้งค่าเป็นรอบๆ"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            rows = self._take_dirty_rows()
+            if not rows:
+                continue
+            try:
+                await loop.run_in_executor(None, self._write_rows, rows)
+            except Exception as e:
+                logger.error(f"บันทึกการตั้งค่า Guild ลงฐานข้อมูลไม่สำเร็จ: {e}", exc_info=True)
+                self._dirty.update(row[0] for row in rows)
+
+    def common_voices(self, limit):
+        """
+        คืนชุด (ความเร็ว, ภาษา) ที่ Guild ตั้งไว้บ่อยที่สุด limit ชุด โดยมีค่าเริ่มต้นอยู่ลำดับแรกเสมอ
+        Guild ที่ไม่เคยเปลี่ยนการตั้งค่าจะไม่มีแถวในฐานข้อมูล จึงใช้ค่าเริ่มต้นเป็นชุดหลัก (แบบ blocking)
+        """
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT speed, lang FROM guild_settings GROUP BY speed, lang"
+                " ORDER BY COUNT(*) DESC LIMIT ?", (limit,)).fetchall()
+        voices = [(DEFAULT_TTS_SPEED, DEFAULT_TTS_LANG)]
+        voices += [(speed, lang) for speed, lang in rows if (speed, lang) not in voices]
+        return voices[:max(1, limit)]
+
+    def close(self):
+        """หยุด Task เบื้องหลังและเขียนการตั้งค่าที่ค้างอยู่ลงดิสก์"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+guild_settings = GuildSettingsStore(GUILD_SETTINGS_DB, GUILD_SETTINGS_FLUSH_INTERVAL)
+
+# --- แคชคำตอบและการจำกัดอัตราสำหรับ Gemini ---
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash-latest')
+GEMINI_CACHE_TTL = float(os.getenv('GEMINI_CACHE_TTL', '600'))
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '256'))
+# แต่ละ Guild ถามได้ GEMINI_RATE_PER_MINUTE ครั้งต่อนาที และถามติดกันได้สูงสุด GEMINI_BURST ครั้ง
+GEMINI_RATE_PER_MINUTE = float(os.getenv('GEMINI_RATE_PER_MINUTE', '6'))
+GEMINI_BURST = float(os.getenv('GEMINI_BURST', '3'))
+
+_gemini_model = None
+
+def get_gemini_model():
+    """คืน GenerativeModel ที่ใช้ร่วมกันทั้งบอท (import ไลบรารีและสร้างครั้งแรกที่เรียกใช้)"""
+    global _gemini_model
+    if _gemini_model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _gemini_model
+
+def normalize_question(question):
+    """ทำให้คำถามที่ต่างกันแค่ตัวพิมพ์/ช่องว่าง/เครื่องหมายท้ายประโยค ใช้คีย์แคชเดียวกัน"""
+    normalized = " ".join(unicodedata.normalize('NFC', question).casefold().split())
+    return normalized.rstrip(' ?？!.')
+
+class TTLCache:
+    """แคชขนาดจำกัดที่แต่ละรายการหมดอายุตาม ttl (วินาที)"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (เวลาหมดอายุ, ค่า)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class TokenBucketLimiter:
+    """จำกัดอัตราแบบ token bucket แยกตามคีย์ (เช่น Guild ID)"""
+
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.burst = burst
+        self._buckets = {}  # key -> (จำนวน token, เวลาที่อัปเดตล่าสุด)
+        self.rejected = 0
+
+    def try_acquire(self, key):
+        """ใช้ token หนึ่งอัน คืน (สำเร็จหรือไม่, ต้องรออีกกี่วินาทีถ้าไม่สำเร็จ)"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return True, 0.0
+        self._buckets[key] = (tokens, now)
+        self.rejected += 1
+        return False, (1 - tokens) / self.rate if self.rate > 0 else float('inf')
+
+gemini_answers = TTLCache(GEMINI_CACHE_TTL, GEMINI_CACHE_MAX_ENTRIES)
+gemini_limiter = TokenBucketLimiter(GEMINI_RATE_PER_MINUTE / 60, GEMINI_BURST)
+# คำถามที่กำลังรอคำตอบจาก Gemini อยู่ (คีย์ -> Future) เพื่อรวมคำถามซ้ำให้เป็น request เดียว
+gemini_inflight = {}
+
+# --- ระบบค้นหาคำตอบสำหรับคำสั่ง !ถาม ---
+QA_DATA_PATH = os.getenv('QA_DATA_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qa_data.json'))
+# คะแนนความคล้าย (Dice coefficient ของ trigram, 0-1) ขั้นต่ำที่จะถือว่าตรงกับคำถามในตาราง
+QA_MATCH_THRESHOLD = float(os.getenv('QA_MATCH_THRESHOLD', '0.5'))
+# คำถามสั้นมี trigram น้อย แค่เป็นส่วนหนึ่งของคำถามที่ยาวกว่าก็ได้คะแนนถึง threshold แล้ว
+# (เช่น "อะไรนะ" ได้ 0.5 กับ "เป็นอะไร") ถ้าฝั่งที่สั้นกว่ายาวไม่เกิน QA_SHORT_KEY_LENGTH ตัวอักษร (หลัง normalize)
+# จึงต้องได้คะแนนอย่างน้อย QA_SHORT_MATCH_THRESHOLD
+QA_SHORT_KEY_LENGTH = int(os.getenv('QA_SHORT_KEY_LENGTH', '5'))
+QA_SHORT_MATCH_THRESHOLD = float(os.getenv('QA_SHORT_MATCH_THRESHOLD', '0.7'))
+# ตรวจสอบไฟล์ข้อมูลถามตอบทุกกี่วินาที เพื่อโหลดใหม่อัตโนมัติเมื่อไฟล์ถูกแก้ไข (0 = ปิด)
+QA_RELOAD_INTERVAL = float(os.getenv('QA_RELOAD_INTERVAL', '30'))
+
+_QA_STRIP_RE = re.compile(r'[\s!-/:-@\[-`{-~…“”‘’\u200b-\u200d\ufeff]+')
+_QA_PARTICLE_RE = re.compile(r'(ครับ|คับ|ค่ะ|คะ|จ้ะ|จ้า|จ๊ะ|นะ|หรอ|เหรอ)+$')
+
+def normalize_qa_text(text):
+    """normalize คำถามภาษาไทย: NFC, ตัวพิมพ์เล็ก, ตัดช่องว่าง/เครื่องหมาย และคำลงท้ายสุภาพ"""
+    text = _QA_STRIP_RE.sub('', unicodedata.normalize('NFC', text).casefold())
+    return _QA_PARTICLE_RE.sub('', text) or text
+
+def _qa_trigrams(key):
+    padded = f"\x02{key}\x03"
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+@dataclass
+class QAMatch:
+    question: str
+    answer: str
+    score: float
+
+class _CompiledQA:
+    """ดัชนีที่คอมไพล์แล้วของตารางถามตอบ (ไม่ถูกแก้ไขหลังสร้าง จึงสลับทั้งก้อนตอนโหลดใหม่ได้)"""
+
+    def __init__(self, data):
+        self.questions = []
+        self.answers = []
+        self.lengths = []  # ความยาวของคำถามหลัง normalize
+        self.grams = []
+        self.exact = {}
+        self.postings = {}  # trigram -> รายการ index ของคำถามที่มี trigram นี้
+        for question, answer in data.items():
+            key = normalize_qa_text(question)
+            if not key:
+                continue
+            index = len(self.questions)
+            self.questions.append(question)
+            self.answers.append(answer)
+            self.lengths.append(len(key))
+            grams = _qa_trigrams(key)
+            self.grams.append(grams)
+            self.exact.setdefault(key, index)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+
+class QAIndex:
+    """
+    ตารางถามตอบที่โหลดจากไฟล์ JSON ({คำถาม: คำตอบ}) และคอมไพล์เป็นดัชนี trigram
+    ค้นหาคำถามที่ตรงกันพอดีก่อน แล้วค่อยหาคำถามที่ใกล้เคียงที่สุดด้วยคะแนน Dice
+    โดยใช้ prefix filtering ดึงผู้สมัครจาก trigram ที่พบน้อยที่สุดเท่านั้น เพื่อให้ค้นหาได้เร็วแม้ตารางจะใหญ่
+    """
+
+    def __init__(self, path, threshold, short_key_length=QA_SHORT_KEY_LENGTH,
+                 short_threshold=QA_SHORT_MATCH_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.short_key_length = short_key_length
+        self.short_threshold = max(threshold, short_threshold)
+        self._compiled = _CompiledQA({})
+        self._mtime = None
+
+    def __len__(self):
+        return len(self._compiled.questions)
+
+    def answers(self):
+        return list(self._compiled.answers)
+
+    def reload(self):
+        """โหลดไฟล์และคอมไพล์ดัชนีใหม่ คืน True ถ้าโหลดสำเร็จ (ถ้าไม่สำเร็จจะใช้ดัชนีเดิมต่อ)"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            compiled = _CompiledQA(data)
+        except (OSError, ValueError) as e:
+            logger.error(f"โหลดข้อมูลถามตอบจาก {self.path} ไม่สำเร็จ: {e}")
+            return False
+        self._compiled = compiled
+        self._mtime = mtime
+        logger.info(f"โหลดข้อมูลถามตอบ {len(compiled.questions)} รายการจาก {self.path} เรียบร้อยแล้ว")
+        return True
+
+    def is_stale(self):
+        """ตรวจสอบว่าไฟล์ถูกแก้ไขหลังจากโหลดครั้งล่าสุดหรือไม่"""
+        try:
+            return os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return False
+
+    async def watch(self, interval):
+        """Task เบื้องหลังที่โหลดไฟล์ใหม่เมื่อไฟล์ถูกแก้ไข (ทำงานบน thread แยก)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self.is_stale():
+                await loop.run_in_executor(None, self.reload)
+
+    def required_score(self, length):
+        """คะแนนขั้นต่ำเมื่อฝั่งที่สั้นกว่าระหว่างคำถามที่ถามกับคำถามในตารางยาว length ตัวอักษร"""
+        return self.short_threshold if length <= self.short_key_length else self.threshold
+
+    def lookup(self, question):
+        """คืน QAMatch ของคำถามที่ใกล้เคียงที่สุด หรือ None ถ้าคะแนนต่ำกว่า threshold"""
+        compiled = self._compiled
+        key = normalize_qa_text(question)
+        if not key:
+            return None
+        index = compiled.exact.get(key)
+        if index is not None:
+            return QAMatch(compiled.questions[index], compiled.answers[index], 1.0)
+
+        grams = _qa_trigrams(key)
+        # คำถามที่ได้คะแนน >= threshold ต้องมี trigram ร่วมกันอย่างน้อย min_shared ตัว
+        # จึงต้องมี trigram อย่างน้อยหนึ่งตัวในกลุ่ม trigram ที่พบน้อยที่สุด len(grams) - min_shared + 1 ตัว
+        # (คิดจาก threshold ที่ต่ำที่สุด คำถามสั้นที่ต้องได้คะแนนสูงกว่าจึงยังอยู่ในกลุ่มผู้สมัครเสมอ)
+        min_shared = max(1, math.ceil(self.threshold * len(grams) / 2))
+        known = sorted((g for g in grams if g in compiled.postings), key=lambda g: len(compiled.postings[g]))
+        candidates = set()
+        for gram in known[:len(grams) - min_shared + 1]:
+            candidates.update(compiled.postings[gram])
+
+        best_index, best_score = None, 0.0
+        for index in candidates:
+            other = compiled.grams[index]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score and score >= self.required_score(min(len(key), compiled.lengths[index])):
+                best_index, best_score = index, score
+        if best_index is None:
+            return None
+        return QAMatch(compiled.questions[best_index], compiled.answers[best_index], best_score)
+
+qa_index = QAIndex(QA_DATA_PATH, QA_MATCH_THRESHOLD)
+
+# --- อุ่นแคชเสียง TTS ตอนเริ่มต้น ---
+# TTS_WARMUP=1 จะสังเคราะห์คำตอบใน qa_data.json และวลีที่ใช้บ่อยเก็บลงแคชไว้ล่วงหน้าหลังบอทพร้อมใช้งาน
+# เพื่อให้ !ถาม ครั้งแรกหลังรีสตาร์ทเล่นจากแคชได้ทันที (ไฟล์ที่อยู่ในแคชแล้วจะถูกข้าม)
+TTS_WARMUP = os.getenv('TTS_WARMUP', '0') == '1'
+TTS_WARMUP_PHRASES = [p.strip() for p in os.getenv('TTS_WARMUP_PHRASES', '').split('|') if p.strip()]
+TTS_WARMUP_VOICES = int(os.getenv('TTS_WARMUP_VOICES', '3'))  # จำนวนชุด (ความเร็ว, ภาษา) ที่ใช้บ่อยที่สุดที่จะอุ่น
+TTS_WARMUP_CONCURRENCY = max(1, int(os.getenv('TTS_WARMUP_CONCURRENCY', '2')))
+QA_FALLBACK_ANSWER = "ขออภัยครับ ผมยังไม่เข้าใจคำถามของคุณ"
+# ใช้คิวแยกใน Synthesis pool เพื่อให้ Guild ที่กำลังใช้งานได้คิวสลับกับงานอุ่นแคช ไม่ต้องรอจนอุ่นเสร็จ
+WARMUP_POOL_KEY = 'warmup'
+
+def warmup_texts():
+    """ข้อความที่จะอุ่นแคช: คำตอบทั้งหมดของ !ถาม, คำตอบเมื่อหาไม่เจอ และวลีจาก TTS_WARMUP_PHRASES"""
+    return list(dict.fromkeys([*qa_index.answers(), QA_FALLBACK_ANSWER, *TTS_WARMUP_PHRASES]))
+
+async def warm_tts_cache(texts, voices, concurrency=TTS_WARMUP_CONCURRENCY):
+    """สังเคราะห์ texts ด้วยทุกชุด (ความเร็ว, ภาษา) ใน voices เก็บลงแคช คืนจำนวนคลิปที่สังเคราะห์ใหม่"""
+    semaphore = asyncio.Semaphore(concurrency)
+    synthesized = 0
+
+    async def warm(text, speed, lang):
+        nonlocal synthesized
+        async with semaphore:
+            try:
+                clip = await synthesize_clip(WARMUP_POOL_KEY, 'warmup', text, speed, lang, count_stats=False)
+            except Exception as e:
+                logger.warning(f"อุ่นแคช TTS สำหรับ '{text[:30]}' ไม่สำเร็จ: {e}")
+                return
+        if not clip.cached:
+            synthesized += 1
+        # ไฟล์ที่ไม่ได้เข้าแคช (เช่นมาจาก backend สำรอง) ไม่ได้ถูกเล่น จึงลบทิ้งเลย
+        cleanup_files_after_play(None, *clip.temp_files)
+        if clip.cache_pin:
+            tts_cache.release(clip.cache_pin)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(warm(text, speed, lang) for speed, lang in voices for text in texts))
+    logger.info(f"อุ่นแคช TTS เสร็จแล้ว: สังเคราะห์ใหม่ {synthesized} จาก {len(texts) * len(voices)} คลิป "
+                f"({len(texts)} ข้อความ x {len(voices)} เสียง) ใช้เวลา {time.perf_counter() - started:.1f} s")
+    return synthesized
+
+async def run_tts_warmup():
+    """อุ่นแคชด้วยความเร็ว/ภาษาเริ่มต้นและชุดที่ Guild ตั้งไว้บ่อยที่สุด (ทำงานเบื้องหลังหลัง on_ready)"""
+    if not tts_cache.enabled:
+        logger.info("ข้ามการอุ่นแคช TTS เพราะแคชปิดอยู่ (TTS_CACHE_MAX_ENTRIES=0)")
+        return
+    try:
+        voices = await asyncio.get_running_loop().run_in_executor(
+            None, guild_settings.common_voices, TTS_WARMUP_VOICES)
+        await warm_tts_cache(warmup_texts(), voices)
+    except Exception as e:
+        logger.error(f"อุ่นแคช TTS ไม่สำเร็จ: {e}", exc_info=True)
+
+# --- รายงานสถานะสำหรับโหมดหลายโปรเซส ---
+# ถ้ากำหนด HEALTH_FILE ไว้ (launcher.py จะกำหนดให้เอง) บอทจะเขียนสถานะเป็น JSON ลงไฟล์นี้เป็นรอบๆ
+HEALTH_FILE = os.getenv('HEALTH_FILE')
+HEALTH_INTERVAL = float(os.getenv('HEALTH_INTERVAL', '10'))
+_process_started_at = time.time()
+
+def collect_health():
+    """รวบรวมสถานะและตัวเลขของโปรเซสนี้เป็น dict ที่แปลงเป็น JSON ได้"""
+    sessions = voice_sessions.values()
+    latency = bot.latency
+    return {
+        'pid': os.getpid(),
+        'shard_ids': BOT_SHARD_IDS,
+        'shard_count': bot.shard_count,
+        'ready': bot.is_ready(),
+        'uptime': time.time() - _process_started_at,
+        'gateway_latency': latency if math.isfinite(latency) else None,
+        'guilds': len(bot.guilds),
+        'voice_clients': len(bot.voice_clients),
+        'voice_sessions': len(sessions),
+        'worker_tasks': sum(1 for s in sessions if s.worker and not s.worker.done()),
+        'queued_messages': sum(s.queue.qsize() for s in sessions),
+        'dropped_messages': sum(s.queue.dropped for s in sessions),
+        'tts_cache': tts_cache.stats(),
+        'synthesis_pool': {k: v for k, v in synthesis_pool.stats().items() if k != 'queue_depth_per_guild'},
+        'tts_backends': tts_router.stats(),
+        'startup': dict(startup_timer.phases, total=startup_timer.total),
+        'chat_log_dropped': chat_log.dropped,
+        'updated_at': time.time(),
+    }
+
+def write_health_file(path, health):
+    """เขียนไฟล์สถานะแบบ atomic เพื่อไม่ให้ launcher อ่านไฟล์ที่เขียนไม่ครบ"""
+    partial = f"{path}.tmp"
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump(health, f)
+    os.replace(partial, path)
+
+async def health_report_loop(path, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, write_health_file, path, collect_health())
+        except Exception as e:
+            logger.warning(f"เขียนไฟล์สถานะ {path} ไม่สำเร็จ: {e}")
+        await asyncio.sleep(interval)
+
+# --- Metrics แบบ Prometheus และ trace ของแต่ละข้อความ ---
+# ถ้ากำหนด METRICS_PORT บอทจะเปิด http://METRICS_HOST:METRICS_PORT/metrics ให้ Prometheus มาดึงค่า
+# การบันทึกค่าเป็นแค่การบวกเลขใน dict บน event loop จึงเปิดทิ้งไว้ใน production ได้
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 = ไม่เปิด endpoint
+# TTS_TRACE=1 จะ log เวลาของแต่ละช่วง (span) ของทุกข้อความที่อ่านเป็น JSON หนึ่งบรรทัด
+TTS_TRACE = os.getenv('TTS_TRACE', '0') == '1'
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_metric_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """
+    Histogram แบบ Prometheus แยก series ตาม label หนึ่งตัว (ค่าเริ่มต้นคือ guild)
+    ต้องเรียก observe จาก event loop เท่านั้น (ไม่มี lock)
+    """
+
+    def __init__(self, name, help_text, buckets=METRICS_LATENCY_BUCKETS, label='guild'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        self._series = {}  # ค่า label -> [จำนวนในแต่ละ bucket (ไม่สะสม), ผลรวม]
+
+    def observe(self, value, label_value=''):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in list(self._series.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+class CallbackMetric:
+    """
+    Gauge/counter ที่อ่านค่าตอนถูก scrape เท่านั้น จึงไม่มีค่าใช้จ่ายบน hot path
+    collect คืนตัวเลข หรือ dict ของ {ค่า label: ตัวเลข}
+    """
+
+    def __init__(self, name, help_text, collect, kind='gauge', label='guild'):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.kind = kind
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        value = self.collect()
+        if isinstance(value, dict):
+            for label_value, item in value.items():
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {_format_metric_value(item)}')
+        else:
+            lines.append(f"{self.name} {_format_metric_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    """ที่รวม metric ทั้งหมดของโปรเซส และแปลงเป็นรูปแบบข้อความของ Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help_text, **kwargs):
+        metric = Histogram(name, help_text, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name, help_text, collect, **kwargs):
+        metric = CallbackMetric(name, help_text, collect, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.warning(f"อ่านค่า metric {metric.name} ไม่สำเร็จ: {e}")
+        return "\n".join(lines) + "\n"
+
+def count_temp_audio_files():
+    """นับไฟล์เสียงชั่วคราวที่ยังค้างอยู่ในโฟลเดอร์ทำงาน (ไม่รวมไฟล์ในแคช)"""
+    with os.scandir('.') as entries:
+        return sum(1 for entry in entries if entry.name.startswith('temp_audio_'))
+
+metrics = MetricsRegistry()
+queue_wait_seconds = metrics.histogram(
+    'tts_queue_wait_seconds', 'Time from message received until synthesis starts')
+synthesis_seconds = metrics.histogram(
+    'tts_synthesis_seconds', 'Time spent generating speech with the TTS engine')
+speed_adjust_seconds = metrics.histogram(
+    'tts_speed_adjust_seconds', 'Time spent changing speech speed and encoding')
+audio_start_seconds = metrics.histogram(
+    'tts_audio_start_seconds', 'Time from play() until FFmpeg delivers the first audio frame')
+time_to_first_audio_seconds = metrics.histogram(
+    'tts_time_to_first_audio_seconds', 'Time from message received until the first audio frame is sent')
+playback_seconds = metrics.histogram(
+    'tts_playback_seconds', 'Duration of audio playback',
+    buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60))
+metrics.callback('tts_queue_depth', 'Messages waiting to be spoken',
+                 lambda: {s.guild_id: s.queue.qsize() for s in voice_sessions.values()})
+metrics.callback('tts_queue_dropped_total', 'Messages dropped because the speech queue was full',
+                 lambda: {s.guild_id: s.queue.dropped for s in voice_sessions.values()}, kind='counter')
+metrics.callback('discord_voice_clients', 'Connected voice clients', lambda: len(bot.voice_clients))
+metrics.callback('tts_voice_sessions', 'Voice sessions, including ones waiting out the idle grace period',
+                 lambda: len(voice_sessions))
+metrics.callback('tts_worker_tasks', 'Running audio player tasks',
+                 lambda: sum(1 for s in voice_sessions.values() if s.worker and not s.worker.done()))
+metrics.callback('tts_temp_files', 'Temporary audio files on disk', count_temp_audio_files)
+metrics.callback('tts_cache_hits_total', 'TTS audio cache hits', lambda: tts_cache.hits, kind='counter')
+metrics.callback('tts_cache_misses_total', 'TTS audio cache misses', lambda: tts_cache.misses, kind='counter')
+metrics.callback('tts_synthesis_pool_queue_depth', 'Jobs waiting for a synthesis worker',
+                 lambda: synthesis_pool.stats()['queue_depth'])
+metrics.callback('tts_synthesis_failures_total', 'Failed synthesis jobs',
+                 lambda: synthesis_pool.stats()['failed'], kind='counter')
+metrics.callback('tts_backend_circuit_open', 'Whether the TTS backend is currently skipped by its circuit breaker',
+                 lambda: {name: int(stats['state'] == 'open') for name, stats in tts_router.stats().items()},
+                 label='backend')
+metrics.callback('tts_backend_latency_p95_seconds', 'Recent p95 synthesis time per TTS backend',
+                 lambda: {name: stats['latency_p95'] or 0.0 for name, stats in tts_router.stats().items()},
+                 label='backend')
+metrics.callback('tts_backend_requests_total', 'Successful synthesis requests per TTS backend',
+                 lambda: {name: stats['successes'] for name, stats in tts_router.stats().items()},
+                 kind='counter', label='backend')
+metrics.callback('tts_backend_failures_total', 'Failed synthesis requests per TTS backend',
+                 lambda: {name: stats['failures'] for name, stats in tts_router.stats().items()},
+                 kind='counter', label='backend')
+
+class TimedAudioSource(discord.AudioSource):
+    """ห่อ AudioSource เพื่อบันทึกเวลาที่ FFmpeg ส่งเฟรมเสียงแรกออกมา (read ถูกเรียกจาก thread ของ player)"""
+
+    def __init__(self, source):
+        self.source = source
+        self.first_frame_at = None
+
+    def read(self):
+        # จับเวลาหลัง FFmpeg คืนข้อมูลจริง เพื่อให้รวมเวลาเริ่มโปรเซส FFmpeg ไว้ใน audio_start
+        data = self.source.read()
+        if data and self.first_frame_at is None:
+            self.first_frame_at = time.monotonic()
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+def record_utterance(guild, item, clip, source, play_started_at, finished_at):
+    """บันทึก metric ช่วงการเล่นเสียงของข้อความหนึ่งข้อความ และเขียน trace ถ้าเปิดไว้"""
+    label = guild.id
+    first_frame_at = source.first_frame_at
+    if first_frame_at is not None:
+        audio_start_seconds.observe(first_frame_at - play_started_at, label)
+        time_to_first_audio_seconds.observe(first_frame_at - item.created_at, label)
+    playback_seconds.observe(finished_at - (first_frame_at or play_started_at), label)
+    if TTS_TRACE:
+        spans = {
+            'queue_wait': item.dequeued_at - item.created_at,
+            **clip.timings,
+            'audio_start': first_frame_at - play_started_at if first_frame_at is not None else None,
+            'playback': finished_at - (first_frame_at or play_started_at),
+            'total': finished_at - item.created_at,
+        }
+        logger.info("trace " + json.dumps({'guild': guild.id, 'chars': len(item.text), 'cached': clip.cached,
+                                           'spans': {k: round(v, 4) if v is not None else None for k, v in spans.items()}}))
+
+async def start_metrics_server(host, port):
+    """เปิด HTTP endpoint /metrics ด้วย aiohttp (ไลบรารีที่ discord.py ใช้อยู่แล้ว)"""
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"เปิด metrics endpoint ที่ http://{host}:{port}/metrics")
+    return runner
+
 # --- คำสั่งของบอท (Commands) ---
 
+@bot.before_invoke
+async def load_guild_settings(ctx):
+    """โหลดการตั้งค่าของ Guild ใน thread ก่อนคำสั่งทำงาน เพื่อให้ guild_settings.get/update ในคำสั่งไม่ต้องอ่านดิสก์"""
+    if ctx.guild is not None:
+        await guild_settings.load(ctx.guild.id)
+
 @bot.command(name='setspeed', aliases=['ความเร็ว'])
+@commands.guild_only()
 async def set_speed(ctx, speed: float):
-    """ตั้งค่าความเร็วในการเล่นเสียง TTS"""
+    """ตั้งค่าความเร็วในการเล่นเสียง TTS ของเซิร์ฟเวอร์นี้"""
     if 0.5 <= speed <= 2.0:
-        bot.tts_speed = speed
-        await ctx.send(f"✅ ปรับความเร็วการพูดเป็น `{speed}x` แล้ว")
-        logger.info(f"TTS speed has been set to {speed}x by {ctx.author.display_name}")
+        guild_settings.update(ctx.guild.id, speed=speed)
+        await ctx.send(f"✅ ปรับความเร็วการพูดของเซิร์ฟเวอร์นี้เป็น `{speed}x` แล้ว")
+        logger.info(f"TTS speed for {ctx.guild.name} has been set to {speed}x by {ctx.author.display_name}")
     else:
         await ctx.send("❌ โปรดระบุความเร็วระหว่าง 0.5 ถึง 2.0 ครับ")
 
@@ -275,38 +2323,84 @@ async def set_speed_error(ctx, error):
     if isinstance(error, commands.BadArgument):
         await ctx.send("❌ รูปแบบไม่ถูกต้อง, โปรดใช้ตัวเลข เช่น `!setspeed 1.5`")
 
+@bot.command(name='setlang', aliases=['ภาษา'])
+@commands.guild_only()
+async def set_lang(ctx, lang: str):
+    """ตั้งค่าภาษาของเสียง TTS ของเซิร์ฟเวอร์นี้ (รหัสภาษาของ gTTS เช่น th, en, ja)"""
+    from gtts.lang import tts_langs
+    lang = lang.strip()
+    if lang not in tts_langs():
+        await ctx.send(f"❌ ไม่รู้จักรหัสภาษา `{lang}` (ตัวอย่าง: `th`, `en`, `ja`)")
+        return
+    guild_settings.update(ctx.guild.id, lang=lang)
+    await ctx.send(f"✅ เปลี่ยนภาษาเสียงพูดของเซิร์ฟเวอร์นี้เป็น `{lang}` แล้ว")
+    logger.info(f"TTS language for {ctx.guild.name} has been set to {lang} by {ctx.author.display_name}")
+
+@bot.command(name='ttsstats', aliases=['สถิติเสียง'])
+@commands.guild_only()
+async def tts_stats(ctx):
+    """ดูสถิติของแคชไฟล์เสียงและ Synthesis pool"""
+    lines = []
+    if tts_cache.enabled:
+        stats = tts_cache.stats()
+        lines.append(
+            f"📊 แคชเสียง TTS: {stats['entries']}/{tts_cache.max_entries} ไฟล์, "
+            f"{stats['bytes'] / 1_048_576:.1f}/{tts_cache.max_bytes / 1_048_576:.0f} MB | "
+            f"hit {stats['hits']} | miss {stats['misses']} | evict {stats['evictions']} | "
+            f"hit rate {stats['hit_rate']:.0%}"
+        )
+    else:
+        lines.append("ℹ️ แคชเสียง TTS ถูกปิดใช้งานอยู่")
+
+    session = voice_sessions.get(ctx.guild.id)
+    if session:
+        q = session.queue.stats()
+        lines.append(
+            f"📨 คิวข้อความ: {q['depth']}/{q['maxsize']} ({q['overflow']}) | ทิ้ง {q['dropped']} | "
+            f"รวม {q['merged']} | ซ้ำ {q['deduped']} | ข้อความ→เสียง เฉลี่ย {q['latency_avg']:.1f} s, "
+            f"p95 {q['latency_p95']:.1f} s, สูงสุด {q['latency_max']:.1f} s"
+        )
+
+    pool = synthesis_pool.stats()
+    lines.append(
+        f"⚙️ Synthesis pool ({pool['kind']}): ทำงาน {pool['active']}/{pool['max_workers']} | "
+        f"รอคิว {pool['queue_depth']} (Guild นี้ {pool['queue_depth_per_guild'].get(ctx.guild.id, 0)}) | "
+        f"รอเฉลี่ย {pool['wait_avg'] * 1000:.0f} ms, p95 {pool['wait_p95'] * 1000:.0f} ms, "
+        f"สูงสุด {pool['wait_max'] * 1000:.0f} ms | ใช้เวลาเฉลี่ย {pool['run_avg'] * 1000:.0f} ms"
+    )
+
+    backend_states = {'closed': '🟢', 'half_open': '🟡', 'open': '🔴'}
+    lines.append("🗣️ TTS backend: " + " | ".join(
+        f"{backend_states[stats['state']]} {name} สำเร็จ {stats['successes']} ล้มเหลว {stats['failures']}"
+        + (f" p95 {stats['latency_p95'] * 1000:.0f} ms" if stats['latency_p95'] is not None else "")
+        for name, stats in tts_router.stats().items()))
+    await ctx.send("\n".join(lines))
+
 @bot.command(name='เข้ามา', aliases=['มานี่', 'ตามมา'])
 async def join_command(ctx):
     """คำสั่งให้บอทเข้าช่องเสียง"""
     if not ctx.message.author.voice:
         await ctx.send("คุณต้องอยู่ในช่องเสียงก่อนจึงจะเรียกใช้คำสั่งนี้ได้!")
         return
-    
-    bot.designated_text_channel_id[ctx.guild.id] = ctx.channel.id
+
+    guild_settings.update(ctx.guild.id, designated_channel_id=ctx.channel.id)
     logger.info(f"ตั้งค่าช่องข้อความที่กำหนดสำหรับ Guild {ctx.guild.name}: {ctx.channel.name} ({ctx.channel.id})")
 
     voice_channel = ctx.message.author.voice.channel
-    if ctx.voice_client:
-        if ctx.voice_client.channel == voice_channel:
-            await ctx.send(f"บอทอยู่ในช่องเสียง **{ctx.voice_client.channel.name}** อยู่แล้วครับ")
-        else:
-            await ctx.voice_client.move_to(voice_channel)
+    voice_client = ctx.voice_client
+    already_connected = voice_client is not None and voice_client.is_connected()
+    # move_to แก้ voice_client.channel ในตัว จึงต้องจำช่องเดิมไว้ก่อนเชื่อมต่อ
+    previous_channel = voice_client.channel if already_connected else None
+    try:
+        await voice_sessions.connect(ctx.guild, voice_channel)
+        if already_connected and previous_channel == voice_channel:
+            await ctx.send(f"บอทอยู่ในช่องเสียง **{voice_channel.name}** อยู่แล้วครับ")
+        elif already_connected:
             await ctx.send(f"ย้ายไปช่องเสียง: **{voice_channel.name}** แล้ว")
             logger.info(f"บอทย้ายไปช่องเสียง: {voice_channel.name}")
-        return
-
-    try:
-        await voice_channel.connect()
-        await ctx.send(f"🔊 เข้าร่วม **{voice_channel.name}** แล้ว! จะอ่านข้อความให้อัตโนมัติ (Dev By mzDear)")
-        logger.info(f"บอทเข้าร่วมช่องเสียง: {voice_channel.name}")
-
-        guild_id = ctx.guild.id
-        if guild_id in bot.worker_tasks:
-            bot.worker_tasks[guild_id].cancel()
-        
-        bot.message_queues[guild_id] = asyncio.Queue()
-        bot.worker_tasks[guild_id] = bot.loop.create_task(audio_player_task(guild_id))
-        
+        else:
+            await ctx.send(f"🔊 เข้าร่วม **{voice_channel.name}** แล้ว! จะอ่านข้อความให้อัตโนมัติ (Dev By mzDear)")
+            logger.info(f"บอทเข้าร่วมช่องเสียง: {voice_channel.name}")
     except Exception as e:
         await ctx.send(f"ไม่สามารถเข้าร่วมช่องเสียงได้: {e}")
         logger.error(f"ERROR: ไม่สามารถเข้าร่วมช่องเสียงได้: {e}")
@@ -316,20 +2410,15 @@ async def leave(ctx):
     """คำสั่งให้บอทออกจากช่องเสียง"""
     if ctx.voice_client:
         guild_id = ctx.guild.id
-        if guild_id in bot.worker_tasks:
-            task = bot.worker_tasks.pop(guild_id)
-            task.cancel()
-            logger.info(f"Worker task สำหรับ Guild {ctx.guild.name} ถูกยกเลิกโดยคำสั่ง")
-        
-        if guild_id in bot.message_queues:
-            del bot.message_queues[guild_id]
-            logger.info(f"ล้างคิวข้อความสำหรับ Guild {ctx.guild.name}")
-
-        if guild_id in bot.designated_text_channel_id:
-            del bot.designated_text_channel_id[guild_id]
-            logger.info(f"ล้าง designated_text_channel_id สำหรับ Guild {ctx.guild.name}")
-            
-        await ctx.voice_client.disconnect()
+        if await voice_sessions.close(guild_id):
+            logger.info(f"ปิด session เสียงและล้างคิวข้อความสำหรับ Guild {ctx.guild.name} โดยคำสั่ง")
+        else:
+            await ctx.voice_client.disconnect()
+
+        if guild_settings.get(guild_id).designated_channel_id is not None:
+            guild_settings.update(guild_id, designated_channel_id=None)
+            logger.info(f"ล้างช่องข้อความที่กำหนดสำหรับ Guild {ctx.guild.name}")
+
         await ctx.send("👋 ออกจากช่องเสียงแล้ว.")
         logger.info("บอทออกจากช่องเสียง")
     else:
@@ -339,10 +2428,10 @@ async def leave(ctx):
 @commands.has_role("เจ้าของดิส")
 async def enable_read_all_channels(ctx):
     """เปิดโหมดอ่านทุกช่อง"""
-    if ctx.guild.id not in bot.restricted_mode_guilds:
+    if not guild_settings.get(ctx.guild.id).restricted:
         await ctx.send("✅ บอทกำลังอยู่ในโหมด 'สายลับ' ครับ.")
     else:
-        bot.restricted_mode_guilds.remove(ctx.guild.id)
+        guild_settings.update(ctx.guild.id, restricted=False)
         await ctx.send("✅ เปลี่ยนโหมด: บอทสายลับกำลังทำงาน")
         logger.info(f"Guild {ctx.guild.name} switched to 'read all channels' mode.")
 
@@ -350,12 +2439,13 @@ async def enable_read_all_channels(ctx):
 @commands.has_role("เจ้าของดิส")
 async def disable_read_all_channels(ctx):
     """ปิดโหมดอ่านทุกช่อง (อ่านเฉพาะช่องที่กำหนด)"""
-    if ctx.guild.id in bot.restricted_mode_guilds:
+    settings = guild_settings.get(ctx.guild.id)
+    if settings.restricted:
         await ctx.send("✅ บอทกำลังอยู่ในโหมด 'มุ้งมิ้ง ไม่สนโลก' ครับ.")
     else:
-        bot.restricted_mode_guilds.add(ctx.guild.id)
-        if ctx.guild.id not in bot.designated_text_channel_id:
-            bot.designated_text_channel_id[ctx.guild.id] = ctx.channel.id
+        guild_settings.update(ctx.guild.id, restricted=True)
+        if settings.designated_channel_id is None:
+            guild_settings.update(ctx.guild.id, designated_channel_id=ctx.channel.id)
             logger.info(f"ตั้งค่าช่องข้อความที่กำหนดสำหรับ Guild {ctx.guild.name} เป็น {ctx.channel.name} ({ctx.channel.id})")
         await ctx.send(f"✅ เปลี่ยนโหมด: บอทสายลับ ปิดการใช้งานแล้ว")
         logger.info(f"Guild {ctx.guild.name} switched to 'restricted channels' mode.")
@@ -366,9 +2456,10 @@ async def view_read_mode_status(ctx):
     """ดูสถานะโหมดการอ่านข้อความ"""
     mode_status = "อ่านจากทุกช่องแชทใน Guild"
     designated_channel_info = ""
-    if ctx.guild.id in bot.restricted_mode_guilds:
+    settings = guild_settings.get(ctx.guild.id)
+    if settings.restricted:
         mode_status = "อ่านเฉพาะจากช่องแชทที่กำหนด"
-        designated_channel_id = bot.designated_text_channel_id.get(ctx.guild.id)
+        designated_channel_id = settings.designated_channel_id
         if designated_channel_id:
             designated_channel = bot.get_channel(designated_channel_id)
             designated_channel_info = f" (ช่องที่กำหนด: {designated_channel.mention})" if designated_channel else f" (ช่องที่กำหนด: ID {designated_channel_id} ไม่พบ)"
@@ -383,50 +2474,134 @@ async def ask_ai_question(ctx, *, question: str):
         await ctx.send("❌ ขออภัยครับ ฟังก์ชัน AI ยังไม่พร้อมใช้งาน (ผู้ดูแลยังไม่ได้ตั้งค่า API Key)")
         return
 
-    guild_id = ctx.guild.id
-    if not ctx.guild or not ctx.guild.voice_client or not ctx.guild.voice_client.is_connected() or guild_id not in bot.message_queues:
+    session = voice_sessions.get(ctx.guild.id) if ctx.guild else None
+    if session is None or not session.is_connected():
         await ctx.send("🔊 ผมต้องอยู่ในช่องเสียงและระบบอ่านข้อความต้องพร้อมใช้งานก่อนครับ! กรุณาสั่ง `!เข้ามา` ก่อน")
         return
 
+    guild_id = ctx.guild.id
+    queue = session.queue
+    key = normalize_question(question)
+
+    # คำถามที่เพิ่งถูกถามไปแล้ว ตอบจากแคชได้ทันทีโดยไม่เสียโควต้า
+    answer = gemini_answers.get(key)
+    if answer is not None:
+        await ctx.send(f"**คำถาม:** {question}\n**คำตอบจาก Gemini:**\n{answer}")
+        enqueue_answer(queue, answer)
+        return
+
+    inflight = gemini_inflight.get(key)
+    if inflight is None:
+        allowed, retry_after = gemini_limiter.try_acquire(guild_id)
+        if not allowed:
+            await ctx.send(f"⏳ เซิร์ฟเวอร์นี้ถาม AI ถี่เกินไป กรุณารออีก {retry_after:.0f} วินาทีครับ")
+            return
+
     processing_message = await ctx.send("🧠 กำลังประมวลผลคำถามของคุณด้วย Gemini... กรุณารอสักครู่")
 
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response = await model.generate_content_async(question)
-        answer = response.text
+        inflight = inflight or gemini_inflight.get(key)
+        if inflight is not None:
+            # มีคนถามคำถามเดียวกันอยู่แล้ว รอคำตอบจาก request นั้นแทนการเรียก API ซ้ำ
+            answer = await asyncio.shield(inflight)
+            enqueue_answer(queue, answer)
+        else:
+            answer = await fetch_ai_answer(key, question, queue)
 
         await processing_message.edit(content=f"**คำถาม:** {question}\n**คำตอบจาก Gemini:**\n{answer}")
-        
-        queue = bot.message_queues.get(guild_id)
-        if queue:
-            await queue.put(answer)
 
     except Exception as e:
         await processing_message.edit(content=f"❌ เกิดข้อผิดพลาดในการเรียกใช้ Gemini API: {e}")
         logger.error(f"ERROR: เกิดข้อผิดพลาดจาก Gemini API: {e}", exc_info=True)
 
+def enqueue_answer(queue, answer):
+    """ส่งคำตอบเข้าคิวอ่านออกเสียงเป็นช่วงๆ"""
+    if queue:
+        for chunk in split_for_speech(answer):
+            queue.put_nowait(SpeechItem(chunk))
+
+async def fetch_ai_answer(key, question, queue):
+    """
+    เรียก Gemini หนึ่งครั้งสำหรับคำถามนี้ และแชร์ผลลัพธ์ให้คำถามเดียวกันที่เข้ามาระหว่างรอ
+    คำตอบที่ได้จะถูกเก็บลงแคชตาม GEMINI_CACHE_TTL
+    """
+    future = asyncio.get_running_loop().create_future()
+    gemini_inflight[key] = future
+    try:
+        model = get_gemini_model()
+        if GEMINI_STREAMING:
+            answer = await stream_ai_answer(model, question, queue)
+        else:
+            response = await model.generate_content_async(question)
+            answer = response.text
+            enqueue_answer(queue, answer)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # ป้องกันคำเตือน "exception was never retrieved" เมื่อไม่มีใครรอ future นี้
+        future.exception()
+        raise
+    finally:
+        gemini_inflight.pop(key, None)
+    gemini_answers.put(key, answer)
+    future.set_result(answer)
+    return answer
+
+async def stream_ai_answer(model, question, queue):
+    """
+    รับคำตอบจาก Gemini แบบ stream และส่งเข้าคิวอ่านออกเสียงทีละประโยคทันทีที่ตัดได้
+    เวลาจนถึงเสียงแรกจึงขึ้นกับประโยคแรก ไม่ใช่ทั้งคำตอบ คืนคำตอบเต็มสำหรับแสดงในแชท
+    """
+    chunker = SpeechChunker()
+    parts = []
+    response = await model.generate_content_async(question, stream=True)
+    async for partial in response:
+        text = partial.text
+        parts.append(text)
+        if queue:
+            for chunk in chunker.feed(text):
+                queue.put_nowait(SpeechItem(chunk))
+    if queue:
+        for chunk in chunker.flush():
+            queue.put_nowait(SpeechItem(chunk))
+    return ''.join(parts)
+
 @bot.command(name='ถาม', aliases=['ask', 'query'])
 async def ask_question_custom(ctx, *, question: str):
     """ถามคำถามบอทจากข้อมูลที่กำหนดเอง"""
-    guild_id = ctx.guild.id
-    if not ctx.guild or not ctx.guild.voice_client or not ctx.guild.voice_client.is_connected() or guild_id not in bot.message_queues:
+    session = voice_sessions.get(ctx.guild.id) if ctx.guild else None
+    if session is None or not session.is_connected():
         await ctx.send("🔊 ผมต้องอยู่ในช่องเสียงและระบบอ่านข้อความต้องพร้อมใช้งานก่อนครับ! กรุณาสั่ง `!เข้ามา` ก่อน")
         return
 
-    normalized_question = question.strip()
-    answer = bot.qa_data.get(normalized_question, "ขออภัยครับ ผมยังไม่เข้าใจคำถามของคุณ")
+    match = qa_index.lookup(question)
+    if match:
+        answer = match.answer
+        if match.score < 1.0:
+            logger.info(f"[!ถาม] '{question}' ใกล้เคียงกับ '{match.question}' (คะแนน {match.score:.2f})")
+    else:
+        answer = QA_FALLBACK_ANSWER
 
     await ctx.send(f"คำตอบ: {answer}")
 
     try:
-        queue = bot.message_queues.get(guild_id)
-        if queue:
-            await queue.put(answer)
+        session.queue.put_nowait(SpeechItem(answer))
 
     except Exception as e:
         logger.error(f"ERROR: ไม่สามารถส่งคำตอบเข้าคิวได้: {e}", exc_info=True)
         await ctx.send(f"❌ ขออภัยครับ เกิดข้อผิดพลาดในการส่งคำตอบไปอ่าน: {e}")
 
+@bot.command(name='reloadqa', aliases=['โหลดคำถามใหม่'])
+@commands.has_role("เจ้าของดิส")
+async def reload_qa(ctx):
+    """โหลดข้อมูลถามตอบจากไฟล์ใหม่ทันที"""
+    if await bot.loop.run_in_executor(None, qa_index.reload):
+        await ctx.send(f"✅ โหลดข้อมูลถามตอบใหม่แล้ว ({len(qa_index)} รายการ)")
+    else:
+        await ctx.send("❌ โหลดข้อมูลถามตอบไม่สำเร็จ ยังใช้ข้อมูลชุดเดิมอยู่ (ดูรายละเอียดใน log)")
+
 # --- ส่วนการจัดการข้อผิดพลาดสำหรับคำสั่ง ---
 @bot.event
 async def on_command_error(ctx, error):
@@ -436,6 +2611,8 @@ async def on_command_error(ctx, error):
         await ctx.send(f"🚫 คุณไม่มี Role '{error.missing_role}' ที่จำเป็นในการใช้คำสั่งนี้.")
     elif isinstance(error, commands.CommandNotFound):
         pass 
+    elif isinstance(error, commands.NoPrivateMessage):
+        await ctx.send("🚫 คำสั่งนี้ตั้งค่าแยกตามเซิร์ฟเวอร์ จึงใช้ได้เฉพาะในเซิร์ฟเวอร์ ใช้ในข้อความส่วนตัวไม่ได้ครับ")
     elif isinstance(error, commands.BadArgument):
         await ctx.send(f"❌ มีข้อผิดพลาดในการใส่ข้อมูล: {error}\nโปรดตรวจสอบรูปแบบคำสั่ง.")
     else:
@@ -444,12 +2621,21 @@ async def on_command_error(ctx, error):
 
 
 # --- ส่วนรันบอท ---
-discord_bot_token = os.getenv('DISCORD_BOT_TOKEN')
-if discord_bot_token is None:
-    logger.error("ERROR: ไม่พบ Discord Bot Token ใน Environment Variables.")
-    exit()
+startup_timer.mark('module_init')
 
-try:
-    bot.run(discord_bot_token)
-except Exception as e:
-    logger.error(f"An unexpected error occurred during bot run: {e}", exc_info=True)
+if __name__ == '__main__':
+    discord_bot_token = os.getenv('DISCORD_BOT_TOKEN')
+    if discord_bot_token is None:
+        logger.error("ERROR: ไม่พบ Discord Bot Token ใน Environment Variables.")
+        exit()
+
+    try:
+        bot.run(discord_bot_token)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during bot run: {e}", exc_info=True)
+    finally:
+        # เขียนการตั้งค่าที่ยังค้างใน write-behind และ log แชทที่ค้างในคิวลงดิสก์ก่อนปิดโปรแกรม
+        guild_settings.close()
+        synthesis_pool.close()
+        chat_log.stop()
+        voice_sessions.discard_all_temp_files()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# ไม่ให้การ import mzsiri ในเทสต์เขียนฐานข้อมูลหรือแคชเสียงลงดิสก์
+os.environ.setdefault('GUILD_SETTINGS_DB', ':memory:')
+os.environ.setdefault('TTS_CACHE_MAX_ENTRIES', '0')
+os.environ.setdefault('CHAT_LOG_ENABLED', '0')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
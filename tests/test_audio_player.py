@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import mzsiri
+
+
+class ThreadedVoiceClient:
+    """เรียก after จาก thread อื่นเหมือน AudioPlayer ของ discord.py"""
+
+    channel = None
+
+    def __init__(self):
+        self.played = []
+        self.threads = []
+
+    def is_connected(self):
+        return True
+
+    def play(self, source, *, after):
+        self.played.append(source)
+
+        def run():
+            source.read()
+            after(None)
+
+        thread = threading.Thread(target=run)
+        self.threads.append(thread)
+        thread.start()
+
+
+class OneFrameSource:
+    def __init__(self, clip):
+        self.frames = 1
+
+    def read(self):
+        if self.frames:
+            self.frames -= 1
+            return b'\0' * 3840
+        return b''
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        pass
+
+
+def test_queue_join_wakes_up_when_playback_finishes_on_another_thread(monkeypatch):
+    async def prepare_clip(guild, text):
+        return mzsiri.PreparedClip(text, data=b'x')
+
+    monkeypatch.setattr(mzsiri, 'prepare_clip', prepare_clip)
+    monkeypatch.setattr(mzsiri, 'make_audio_source', OneFrameSource)
+    guild = SimpleNamespace(id=424242, name='g', voice_client=ThreadedVoiceClient())
+
+    async def main():
+        queue = mzsiri.SpeechQueue(maxsize=50, dedupe_window=0)
+        session = mzsiri.VoiceSession(guild, queue=queue)
+        for i in range(20):
+            queue.put_nowait(mzsiri.SpeechItem(f"ข้อความ {i}", i))
+        session.start()
+        try:
+            await asyncio.wait_for(queue.join(), 5)
+        finally:
+            # ให้ thread ของ player เรียก callback จนจบก่อนปิด event loop
+            await asyncio.to_thread(lambda: [t.join() for t in guild.voice_client.threads])
+            await session.close(disconnect=False)
+
+    asyncio.run(main())
+    assert len(guild.voice_client.played) == 20
@@ -0,0 +1,45 @@
+import io
+import logging
+
+import mzsiri
+
+
+def make_writer(name, queue_size=100):
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter('%(levelname)s|%(name)s|%(message)s'))
+    chat_logger = logging.getLogger(name)
+    chat_logger.setLevel(logging.INFO)
+    writer = mzsiri.ChatLogWriter(chat_logger, 8, queue_size)
+    writer.handler.targets = [target]
+    return writer, stream
+
+
+def test_chat_lines_use_the_target_handlers_format():
+    writer, stream = make_writer('test.chat.format')
+    writer.start()
+    for i in range(20):
+        writer.log('guild', 'general', 'alice', f'hello {i}')
+    writer.stop()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 20
+    assert lines[0] == 'INFO|test.chat.format|[guild > #general] alice: hello 0'
+
+
+def test_level_set_on_the_chat_logger_applies():
+    writer, stream = make_writer('test.chat.level')
+    writer.logger.setLevel(logging.WARNING)
+    writer.start()
+    writer.log('guild', 'general', 'alice', 'hello')
+    writer.stop()
+    assert stream.getvalue() == ''
+
+
+def test_full_queue_counts_drops_instead_of_blocking():
+    writer, stream = make_writer('test.chat.full', queue_size=2)
+    for i in range(5):
+        writer.log('guild', 'general', 'alice', f'hello {i}')
+    assert writer.dropped == 3
+    writer.start()
+    writer.stop()
+    assert len(stream.getvalue().splitlines()) == 2
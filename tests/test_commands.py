@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+from discord.ext import commands
+
+import mzsiri
+
+
+class FakeVoiceClient:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def is_connected(self):
+        return True
+
+
+class FakeSessions:
+    """แทน voice_sessions.connect: ย้ายช่องแบบเดียวกับ VoiceClient.move_to ที่แก้ channel ในตัว"""
+
+    async def connect(self, guild, channel):
+        guild.voice_client.channel = channel
+
+
+def make_ctx(current, target):
+    guild = SimpleNamespace(id=1, name='g', voice_client=FakeVoiceClient(current))
+    sent = []
+
+    async def send(content):
+        sent.append(content)
+
+    author = SimpleNamespace(voice=SimpleNamespace(channel=target), display_name='u')
+    ctx = SimpleNamespace(guild=guild, channel=SimpleNamespace(id=10, name='tts'), voice_client=guild.voice_client,
+                          message=SimpleNamespace(author=author), send=send)
+    return ctx, sent
+
+
+def test_join_reports_move_to_another_channel(monkeypatch):
+    monkeypatch.setattr(mzsiri, 'voice_sessions', FakeSessions())
+    old, new = SimpleNamespace(id=1, name='old'), SimpleNamespace(id=2, name='new')
+    ctx, sent = make_ctx(old, new)
+    asyncio.run(mzsiri.join_command.callback(ctx))
+    assert sent == ["ย้ายไปช่องเสียง: **new** แล้ว"]
+
+
+def test_join_reports_already_in_channel(monkeypatch):
+    monkeypatch.setattr(mzsiri, 'voice_sessions', FakeSessions())
+    channel = SimpleNamespace(id=1, name='same')
+    ctx, sent = make_ctx(channel, channel)
+    asyncio.run(mzsiri.join_command.callback(ctx))
+    assert sent == ["บอทอยู่ในช่องเสียง **same** อยู่แล้วครับ"]
+
+
+def test_per_guild_commands_reject_direct_messages():
+    sent = []
+
+    async def send(content):
+        sent.append(content)
+
+    ctx = SimpleNamespace(guild=None, send=send, command=None)
+
+    async def main():
+        for command in (mzsiri.set_speed, mzsiri.set_lang, mzsiri.tts_stats):
+            with pytest.raises(commands.NoPrivateMessage) as raised:
+                for check in command.checks:
+                    await discord.utils.maybe_coroutine(check, ctx)
+            await mzsiri.on_command_error(ctx, raised.value)
+
+    asyncio.run(main())
+    assert len(sent) == 3
+    assert all(message.startswith("🚫") for message in sent)
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import time
+
+import mzsiri
+
+
+def make_store(path, **settings):
+    store = mzsiri.GuildSettingsStore(str(path), 60)
+    if settings:
+        store.update(1, **settings)
+        store.flush()
+        store.close()
+        store = mzsiri.GuildSettingsStore(str(path), 60)
+    return store
+
+
+def test_load_reads_saved_settings(tmp_path):
+    store = make_store(tmp_path / 'settings.db', speed=1.5, lang='en')
+    settings = asyncio.run(store.load(1))
+    assert (settings.speed, settings.lang) == (1.5, 'en')
+    assert store.get(1) is settings
+
+
+def test_load_does_not_block_the_event_loop_while_the_database_is_busy(tmp_path):
+    store = make_store(tmp_path / 'settings.db', speed=1.5)
+    store._db_lock.acquire()
+    threading.Timer(0.3, store._db_lock.release).start()
+
+    async def main():
+        load = asyncio.create_task(store.load(1))
+        started = time.monotonic()
+        await asyncio.sleep(0.01)
+        assert time.monotonic() - started < 0.2
+        assert not load.done()
+        return await load
+
+    assert asyncio.run(main()).speed == 1.5
+
+
+def test_load_keeps_changes_made_while_reading(tmp_path):
+    store = make_store(tmp_path / 'settings.db', speed=1.5)
+    store._db_lock.acquire()
+
+    async def main():
+        load = asyncio.create_task(store.load(1))
+        await asyncio.sleep(0)
+        # คำสั่งอื่นแก้การตั้งค่าระหว่างที่ยังอ่านฐานข้อมูลไม่เสร็จ
+        store._cache[1] = mzsiri.GuildSettings(speed=2.0)
+        store._db_lock.release()
+        return await load
+
+    assert asyncio.run(main()).speed == 2.0
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import mzsiri
+
+STUB_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'tts_stub_server.py')
+
+
+@pytest.fixture
+def stub_server():
+    """รัน benchmarks/tts_stub_server.py เป็นโปรเซสแยก คืนฟังก์ชันที่เปิดเซิร์ฟเวอร์ใหม่และคืน URL"""
+    processes = []
+
+    def start(latency=0.0, error_rate=0.0):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        process = subprocess.Popen(
+            [sys.executable, STUB_SERVER, '--port', str(port), '--latency', str(latency), '--jitter', '0',
+             '--error-rate', str(error_rate), '--ms-per-char', '10'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes.append(process)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                    return f"http://127.0.0.1:{port}/"
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError('stub TTS server did not start')
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def make_backend(name, url):
+    backend = mzsiri.HTTPBackend(url, 'wav')
+    backend.name = name
+    return backend
+
+
+@pytest.fixture
+def router_for(monkeypatch):
+    """สร้าง TTSRouter จาก backend ที่กำหนด โดยใช้ Synthesis pool จริงแบบ thread"""
+    pool = mzsiri.SynthesisPool('thread', 2)
+    monkeypatch.setattr(mzsiri, 'synthesis_pool', pool)
+
+    def make(*backends):
+        backends = {backend.name: backend for backend in backends}
+        monkeypatch.setattr(mzsiri, 'tts_backends', backends)
+        return mzsiri.TTSRouter(list(backends), backends)
+
+    yield make
+    pool.close()
+
+
+def test_synthesize_returns_audio_from_server(stub_server):
+    data = make_backend('http', stub_server()).synthesize('สวัสดีครับ', 'th')
+    assert data[:4] == b'RIFF'
+
+
+def test_synthesize_gives_up_after_timeout(stub_server, monkeypatch):
+    url = stub_server(latency=2.0)
+    monkeypatch.setattr(mzsiri, 'TTS_REQUEST_TIMEOUT', 0.2)
+    started = time.monotonic()
+    with pytest.raises(OSError):
+        make_backend('http', url).synthesize('สวัสดีครับ', 'th')
+    assert time.monotonic() - started < 1.5
+
+
+def test_router_fails_over_on_503_and_opens_breaker(stub_server, router_for):
+    router = router_for(make_backend('down', stub_server(error_rate=1.0)), make_backend('up', stub_server()))
+    down, up = router.health
+
+    async def speak():
+        return await router.run(1, mzsiri.synthesize_bytes, 'สวัสดีครับ', 'th')
+
+    for _ in range(mzsiri.TTS_BREAKER_FAILURES):
+        name, (data, audio_format, _) = asyncio.run(speak())
+        assert (name, audio_format, data[:4]) == ('up', 'wav', b'RIFF')
+    assert down.failures == mzsiri.TTS_BREAKER_FAILURES
+    assert down.state(time.monotonic()) == 'open'
+
+    # วงจรของ backend ที่ล่มถูกตัดแล้ว งานถัดไปต้องไปที่ backend ที่ใช้ได้โดยไม่ลองตัวที่ล่มอีก
+    assert asyncio.run(speak())[0] == 'up'
+    assert down.failures == mzsiri.TTS_BREAKER_FAILURES
+    assert up.successes == mzsiri.TTS_BREAKER_FAILURES + 1
+
+
+def test_router_fails_over_when_backend_times_out(stub_server, router_for, monkeypatch):
+    monkeypatch.setattr(mzsiri, 'TTS_REQUEST_TIMEOUT', 0.2)
+    router = router_for(make_backend('slow', stub_server(latency=2.0)), make_backend('fast', stub_server()))
+    name, _ = asyncio.run(router.run(1, mzsiri.synthesize_bytes, 'สวัสดีครับ', 'th'))
+    assert name == 'fast'
+    assert router.health[0].failures == 1
@@ -0,0 +1,51 @@
+import time
+from types import SimpleNamespace
+
+import launcher
+
+
+class FakeWorker:
+    def __init__(self, index, health, alive=True):
+        self.index = index
+        self.shard_spec = f'{index}-{index}'
+        self.restarts = 0
+        self.health = health
+        self.process = SimpleNamespace(pid=1000 + index, poll=lambda: None if alive else 1)
+
+    def read_health(self):
+        return self.health
+
+
+def make_health(guilds, updated_at=None):
+    return {
+        'ready': True, 'guilds': guilds, 'voice_clients': 1, 'worker_tasks': 1, 'queued_messages': 2,
+        'dropped_messages': 0, 'tts_cache': {'hits': 3, 'misses': 1}, 'synthesis_pool': {'queue_depth': 0},
+        'updated_at': time.time() if updated_at is None else updated_at,
+    }
+
+
+def test_partition_shards_covers_every_shard_once():
+    ranges = launcher.partition_shards(10, 3)
+    assert [list(r) for r in ranges] == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+
+def test_each_worker_gets_its_own_cache_directory_and_share_of_the_budget(monkeypatch):
+    monkeypatch.setattr(launcher, 'TTS_CACHE_MAX_ENTRIES', 500)
+    monkeypatch.setattr(launcher, 'TTS_CACHE_MAX_MB', 200.0)
+    envs = [launcher.worker_cache_env(index, 4) for index in range(4)]
+    assert len({env['TTS_CACHE_DIR'] for env in envs}) == 4
+    assert sum(int(env['TTS_CACHE_MAX_ENTRIES']) for env in envs) <= 500
+    assert sum(float(env['TTS_CACHE_MAX_MB']) for env in envs) == 200.0
+
+
+def test_aggregate_health_skips_dead_and_stale_workers():
+    workers = [
+        FakeWorker(0, make_health(10)),
+        FakeWorker(1, make_health(20), alive=False),
+        FakeWorker(2, make_health(40, updated_at=time.time() - launcher.STALE_AFTER - 1)),
+    ]
+    summary = launcher.aggregate_health(workers)
+    assert summary['guilds'] == 10
+    assert summary['voice_clients'] == 1
+    assert summary['healthy_workers'] == 1
+    assert [w['healthy'] for w in summary['workers']] == [True, False, False]
@@ -0,0 +1,39 @@
+import time
+
+import mzsiri
+
+
+class SlowSource:
+    """source ที่เฟรมแรกออกช้า เหมือน FFmpeg ที่กำลังเริ่มโปรเซส"""
+
+    def __init__(self, delay, frames):
+        self.delay = delay
+        self.frames = frames
+
+    def read(self):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        if not self.frames:
+            return b''
+        self.frames -= 1
+        return b'\0' * 3840
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        pass
+
+
+def test_first_frame_is_timed_after_the_source_delivers_it():
+    source = mzsiri.TimedAudioSource(SlowSource(0.05, 2))
+    started = time.monotonic()
+    assert source.read()
+    assert source.first_frame_at - started >= 0.05
+
+
+def test_empty_read_does_not_count_as_first_frame():
+    source = mzsiri.TimedAudioSource(SlowSource(0, 0))
+    assert source.read() == b''
+    assert source.first_frame_at is None
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import mzsiri
+
+GUILD = SimpleNamespace(
+    get_member={1001: SimpleNamespace(display_name='มาย')}.get,
+    get_role={2001: SimpleNamespace(name='แอดมิน')}.get,
+    get_channel={3001: SimpleNamespace(name='ห้องเกม')}.get,
+)
+
+
+@pytest.mark.parametrize('text, expected', [
+    # โค้ด, สปอยล์, ลิงก์
+    ('นี่ `print(1)` ครับ', 'นี่ โค้ด ครับ'),
+    ('```py\nx = 1\n```', 'โค้ด'),
+    ('```ยังไม่ปิด', 'โค้ด'),
+    ('`https://example.com`', 'โค้ด'),
+    ('เฉลย ||ตัวร้ายคือพ่อ|| ว้าว', 'เฉลย สปอยล์ ว้าว'),
+    ('ดู https://example.com/a?b=1 สิ', 'ดู ลิงก์ สิ'),
+    ('ดู<https://example.com>นะ', 'ดู ลิงก์ นะ'),
+    ('www.google.com', 'ลิงก์'),
+    # อีโมจิ, mention, timestamp
+    ('ดี<:pepe_happy:123456>มาก', 'ดี pepe_happy มาก'),
+    ('<a:dance:99>', 'dance'),
+    ('สวัสดี <@1001>', 'สวัสดี มาย'),
+    ('สวัสดี <@!1001>', 'สวัสดี มาย'),
+    ('hi <@999>', 'hi ใครบางคน'),
+    ('<@&2001> มา', 'แอดมิน มา'),
+    ('<@&5> มา', 'ยศ มา'),
+    ('ไป <#3001>', 'ไป ห้องเกม'),
+    ('ไป <#5>', 'ไป ห้อง'),
+    ('เจอกัน <t:1700000000:R> นะ', 'เจอกัน นะ'),
+    ('เจอกัน<t:1700000000>นะ', 'เจอกัน นะ'),
+    ('เจอกัน <t:1700000000>นะ', 'เจอกัน นะ'),
+    ('<t:1700000000:F>', ''),
+    # 5555 และตัวอักษรซ้ำ
+    ('555555555', '555'),
+    ('ขำ 5555 มาก', 'ขำ 555 มาก'),
+    ('ได้ 1000000 บาท', 'ได้ 1000000 บาท'),
+    ('ราคา 155555 บาท', 'ราคา 155555 บาท'),
+    ('มากกกกกกก', 'มากกก'),
+    ('!!!!!!', '!!!'),
+    # ช่องว่าง
+    ('a   b\t\tc', 'a b c'),
+    ('a \n\n b', 'a\nb'),
+    ('   ', ''),
+    ('', ''),
+])
+def test_normalize_for_speech(text, expected):
+    assert mzsiri.normalize_for_speech(text, GUILD) == expected
+
+
+def test_mention_without_guild_falls_back_to_user_cache():
+    assert mzsiri.normalize_for_speech('สวัสดี <@1001>') == 'สวัสดี ใครบางคน'
+
+
+def test_long_text_is_cut_at_a_word_boundary():
+    text = ' '.join(f'คำ{i}' for i in range(200))
+    spoken = mzsiri.normalize_for_speech(text)
+    assert len(spoken) <= mzsiri.TTS_MAX_SPOKEN_CHARS
+    assert text.startswith(spoken)
+    assert text[len(spoken)] == ' '
+
+
+def test_long_text_without_spaces_is_cut_at_the_limit():
+    text = 'กขค' * 200
+    assert mzsiri.normalize_for_speech(text) == text[:mzsiri.TTS_MAX_SPOKEN_CHARS]
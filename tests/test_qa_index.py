@@ -0,0 +1,105 @@
+import json
+import os
+import random
+
+import pytest
+
+import mzsiri
+
+QA_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'qa_data.json')
+
+
+def make_index(tmp_path, data, threshold=mzsiri.QA_MATCH_THRESHOLD, **kwargs):
+    path = tmp_path / 'qa.json'
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    index = mzsiri.QAIndex(str(path), threshold, **kwargs)
+    assert index.reload()
+    return index
+
+
+def brute_force_score(index, question):
+    """สแกนทุกคำถามในตารางโดยไม่ใช้ prefix filter คืนคะแนนที่ดีที่สุดที่ผ่านเกณฑ์ หรือ None"""
+    compiled = index._compiled
+    key = mzsiri.normalize_qa_text(question)
+    if key in compiled.exact:
+        return 1.0
+    grams = mzsiri._qa_trigrams(key)
+    scores = [2 * len(grams & other) / (len(grams) + len(other))
+              for other in compiled.grams]
+    passing = [score for i, score in enumerate(scores)
+               if score >= index.required_score(min(len(key), compiled.lengths[i]))]
+    return max(passing) if passing else None
+
+
+@pytest.fixture
+def qa_data():
+    with open(QA_DATA, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_exact_match_ignores_particles_spacing_and_punctuation(tmp_path, qa_data):
+    index = make_index(tmp_path, qa_data)
+    for question in ('สวัสดี', 'สวัสดีครับ', '  สวัสดี!! ', 'สวัสดีนะคะ'):
+        match = index.lookup(question)
+        assert match.question == 'สวัสดี'
+        assert match.score == 1.0
+
+
+def test_close_question_matches(tmp_path, qa_data):
+    match = make_index(tmp_path, qa_data).lookup('ใครหล่อสุด')
+    assert match.question == 'ใครหล่อที่สุด'
+
+
+def test_short_question_needs_higher_score(tmp_path, qa_data):
+    index = make_index(tmp_path, qa_data)
+    # "อะไร" อยู่ใน "เป็นอะไร" ทั้งคำ ได้ 0.5 พอดี แต่ไม่ควรได้คำตอบของ "เป็นอะไร"
+    assert index.lookup('อะไรนะ') is None
+    assert index.lookup('ไม่มีคำถามนี้แน่นอน') is None
+
+
+@pytest.mark.parametrize('threshold', [0.3, 0.5, 0.7, 0.9])
+def test_prefix_filter_finds_same_score_as_brute_force(tmp_path, qa_data, threshold):
+    rng = random.Random(threshold)
+    alphabet = 'กขคงจนมยรลวอะาิีเแไ'
+    data = dict(qa_data)
+    for i in range(300):
+        data[''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 12)))] = f'answer {i}'
+    # คำถามจำนวนมากที่มีคำร่วมกัน ทำให้ trigram ของคำนั้นพบบ่อยและถูกจัดไว้ท้ายสุดของ prefix filter
+    for i in range(100):
+        data[''.join(rng.choices(alphabet, k=rng.randint(0, 4))) + 'ใครที่สุด'] = f'common {i}'
+    index = make_index(tmp_path, data, threshold)
+
+    questions = list(data)
+    for _ in range(1000):
+        # แก้คำถามในตารางแบบสุ่ม หรือเติมตัวอักษรที่ไม่มีในตาราง (trigram ที่พบน้อยที่สุด) ไว้หน้าและหลัง
+        # ซึ่งเป็นกรณีที่ prefix filter ต้องดึงผู้สมัครจาก trigram มากพอจึงจะเจอคำถามที่ตรง
+        question = list(rng.choice(questions))
+        if rng.random() < 0.5:
+            question = [*rng.choices('0123456789', k=rng.randint(0, 8)), *question,
+                        *rng.choices('0123456789', k=rng.randint(0, 8))]
+        for _ in range(rng.randint(0, 6)):
+            position = rng.randrange(len(question) + 1)
+            if question and rng.random() < 0.5:
+                del question[min(position, len(question) - 1)]
+            else:
+                question.insert(position, rng.choice(alphabet))
+        question = ''.join(question)
+        match = index.lookup(question)
+        expected = brute_force_score(index, question)
+        assert (match.score if match else None) == expected, question
+
+
+def test_reload_picks_up_edited_file_and_keeps_old_index_on_error(tmp_path):
+    index = make_index(tmp_path, {'สวัสดี': 'เก่า'})
+    assert not index.is_stale()
+
+    path = tmp_path / 'qa.json'
+    path.write_text(json.dumps({'สวัสดี': 'ใหม่'}, ensure_ascii=False), encoding='utf-8')
+    os.utime(path, (0, os.path.getmtime(path) + 10))
+    assert index.is_stale()
+    assert index.reload()
+    assert index.lookup('สวัสดี').answer == 'ใหม่'
+
+    path.write_text('{ไม่ใช่ JSON', encoding='utf-8')
+    assert not index.reload()
+    assert index.lookup('สวัสดี').answer == 'ใหม่'
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+import mzsiri
+
+
+def make_queue(overflow, maxsize=2, **kwargs):
+    return mzsiri.SpeechQueue(maxsize=maxsize, overflow=overflow, dedupe_window=10, **kwargs)
+
+
+def texts(speech_queue):
+    return [item.text for item in speech_queue._items]
+
+
+def put(speech_queue, text, author_id=1):
+    return speech_queue.put_nowait(mzsiri.SpeechItem(text, author_id))
+
+
+def test_drop_oldest_keeps_newest_messages():
+    speech_queue = make_queue('drop_oldest')
+    assert all(put(speech_queue, text) for text in ('a', 'b', 'c'))
+    assert texts(speech_queue) == ['b', 'c']
+    assert speech_queue.dropped == 1
+    assert speech_queue._unfinished == 2
+
+
+def test_drop_newest_rejects_new_message_and_does_not_count_it_for_dedupe():
+    speech_queue = make_queue('drop_newest')
+    put(speech_queue, 'a')
+    put(speech_queue, 'b')
+    assert not put(speech_queue, 'c')
+    assert texts(speech_queue) == ['a', 'b']
+    assert speech_queue.dropped == 1
+
+    # ข้อความ 'c' ที่ถูกทิ้งไปต้องไม่ทำให้ 'c' ที่ส่งมาใหม่หลังคิวว่างถูกมองว่าซ้ำ
+    speech_queue._items.popleft()
+    speech_queue.task_done()
+    assert put(speech_queue, 'c')
+    assert speech_queue.deduped == 0
+    assert texts(speech_queue) == ['b', 'c']
+
+
+def test_merge_joins_messages_from_the_same_author():
+    speech_queue = make_queue('merge')
+    put(speech_queue, 'a', author_id=1)
+    put(speech_queue, 'b', author_id=1)
+    assert put(speech_queue, 'c', author_id=1)
+    assert texts(speech_queue) == ['a', 'b c']
+    assert speech_queue.merged == 1
+    assert speech_queue.dropped == 0
+    assert speech_queue._unfinished == 2
+
+
+def test_merge_drops_oldest_for_another_author():
+    speech_queue = make_queue('merge')
+    put(speech_queue, 'a', author_id=1)
+    put(speech_queue, 'b', author_id=1)
+    put(speech_queue, 'c', author_id=2)
+    assert texts(speech_queue) == ['b', 'c']
+    assert (speech_queue.merged, speech_queue.dropped) == (0, 1)
+
+
+def test_merge_does_not_exceed_chunk_length():
+    speech_queue = make_queue('merge', merge_max_chars=5)
+    put(speech_queue, 'a', author_id=1)
+    put(speech_queue, 'bbb', author_id=1)
+    put(speech_queue, 'c', author_id=1)
+    assert texts(speech_queue) == ['a', 'bbb c']
+    put(speech_queue, 'dd', author_id=1)
+    assert texts(speech_queue) == ['bbb c', 'dd']
+    assert (speech_queue.merged, speech_queue.dropped) == (1, 1)
+
+
+@pytest.mark.parametrize('overflow', ['drop_oldest', 'drop_newest', 'merge'])
+def test_repeated_message_within_window_is_deduped(overflow, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(mzsiri.time, 'monotonic', lambda: now[0])
+    speech_queue = make_queue(overflow, maxsize=5)
+    assert put(speech_queue, 'hello')
+    assert not put(speech_queue, 'hello')
+    assert speech_queue.deduped == 1
+
+    now[0] += 11
+    assert put(speech_queue, 'hello')
+    assert texts(speech_queue) == ['hello', 'hello']
+
+
+def test_join_waits_for_dropped_and_finished_items():
+    async def main():
+        speech_queue = make_queue('drop_oldest')
+        for text in ('a', 'b', 'c'):
+            put(speech_queue, text)
+        join = asyncio.create_task(speech_queue.join())
+        for _ in range(2):
+            await speech_queue.get()
+            await asyncio.sleep(0)
+            assert not join.done()
+            speech_queue.task_done()
+        await asyncio.wait_for(join, 1)
+
+    asyncio.run(main())
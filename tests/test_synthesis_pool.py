@@ -0,0 +1,21 @@
+import asyncio
+import operator
+
+import pytest
+
+import mzsiri
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_close_shuts_down_executor_and_pool_can_start_again(kind):
+    pool = mzsiri.SynthesisPool(kind, 1)
+
+    async def add(a, b):
+        return await pool.submit(1, operator.add, a, b)
+
+    assert asyncio.run(add(1, 2)) == 3
+    pool.close()
+    assert pool._executor is None
+    assert asyncio.run(add(3, 4)) == 7
+    pool.close()
+
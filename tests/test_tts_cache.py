@@ -0,0 +1,61 @@
+import os
+from types import SimpleNamespace
+
+import mzsiri
+
+
+def make_cache(tmp_path):
+    return mzsiri.TTSAudioCache(str(tmp_path / 'cache'), 1, 1 << 30)
+
+
+def put_text(cache, tmp_path, text, **kwargs):
+    source = tmp_path / f'{text}.mp3'
+    source.write_bytes(b'x' * 10)
+    return cache.put(text, 'th', 1.0, str(source), **kwargs)
+
+
+def test_pinned_hit_is_not_evicted_until_released(tmp_path):
+    cache = make_cache(tmp_path)
+    put_text(cache, tmp_path, 'a')
+    path = cache.get('a', 'th', 1.0)
+    assert path is not None
+
+    # Guild อื่นใส่ไฟล์ใหม่จนเกินงบระหว่างที่คลิป 'a' ยังรอเล่นอยู่
+    other = put_text(cache, tmp_path, 'b', pin=True)
+    assert os.path.exists(path)
+    assert cache.stats()['entries'] == 2
+
+    cache.release(path)
+    assert not os.path.exists(path)
+    assert os.path.exists(other)
+    assert cache.stats()['entries'] == 1
+
+
+def test_pin_is_counted_per_clip(tmp_path):
+    cache = make_cache(tmp_path)
+    path = put_text(cache, tmp_path, 'a', pin=True)
+    assert cache.get('a', 'th', 1.0) == path
+
+    put_text(cache, tmp_path, 'b', pin=True)
+    cache.release(path)
+    assert os.path.exists(path)
+    cache.release(path)
+    assert not os.path.exists(path)
+
+
+def test_session_releases_pins_of_clips_that_were_never_played(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path)
+    monkeypatch.setattr(mzsiri, 'tts_cache', cache)
+    path = put_text(cache, tmp_path, 'a')
+    clip = mzsiri.PreparedClip('a', path, cached=True, cache_pin=cache.get('a', 'th', 1.0))
+
+    session = mzsiri.VoiceSession(SimpleNamespace(id=1, name='guild'))
+    session.track_clip(SimpleNamespace(cancelled=lambda: False, exception=lambda: None, result=lambda: clip))
+    put_text(cache, tmp_path, 'b', pin=True)
+    assert os.path.exists(path)
+
+    session.discard_temp_files()
+    assert not os.path.exists(path)
+    # ปลด pin ซ้ำจาก callback after ที่มาช้าต้องไม่ทำให้จำนวน pin ติดลบ
+    session.release_clip(clip)
+    assert list(cache._pins) == [cache.make_key('b', 'th', 1.0)]
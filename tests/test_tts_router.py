@@ -0,0 +1,144 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import mzsiri
+
+
+class FakePool:
+    """แทน synthesis_pool: ผลของแต่ละ backend กำหนดด้วย outcomes ('ok', 'fail' หรือ 'hang')"""
+
+    def __init__(self, outcomes, seconds=0.1):
+        self.outcomes = outcomes
+        self.seconds = seconds
+        self.calls = []
+
+    def submit(self, guild_id, fn, name, *args, discard=None):
+        self.calls.append(name)
+        future = asyncio.get_running_loop().create_future()
+        outcome = self.outcomes[name]
+        if outcome == 'ok':
+            future.set_result((name, {'synthesis': self.seconds}))
+        elif outcome == 'fail':
+            future.set_exception(RuntimeError(f"{name} down"))
+        return future
+
+
+def make_router(monkeypatch, outcomes, seconds=0.1):
+    backends = {name: SimpleNamespace(name=name, available=True) for name in outcomes}
+    router = mzsiri.TTSRouter(list(outcomes), backends)
+    pool = FakePool(outcomes, seconds)
+    monkeypatch.setattr(mzsiri, 'synthesis_pool', pool)
+    return router, pool
+
+
+def health_of(router, name):
+    return next(h for h in router.health if h.backend.name == name)
+
+
+def trip(router, name):
+    health = health_of(router, name)
+    for _ in range(mzsiri.TTS_BREAKER_FAILURES):
+        health.record_failure(time.monotonic())
+    assert health.state(time.monotonic()) == 'open'
+
+
+def end_cooldown(router, name):
+    health_of(router, name).open_until = time.monotonic() - 0.001
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_trial():
+    health = mzsiri.BackendHealth(SimpleNamespace(name='gtts'))
+    now = time.monotonic()
+    for _ in range(mzsiri.TTS_BREAKER_FAILURES - 1):
+        health.record_failure(now)
+    assert health.state(now) == 'closed'
+    health.record_failure(now)
+    assert health.state(now) == 'open'
+    assert health.state(now + mzsiri.TTS_BREAKER_COOLDOWN) == 'half_open'
+
+    health.record_success(0.1, now + mzsiri.TTS_BREAKER_COOLDOWN)
+    assert health.state(now + mzsiri.TTS_BREAKER_COOLDOWN) == 'closed'
+
+
+def test_failed_trial_reopens_immediately():
+    health = mzsiri.BackendHealth(SimpleNamespace(name='gtts'))
+    now = time.monotonic()
+    for _ in range(mzsiri.TTS_BREAKER_FAILURES):
+        health.record_failure(now)
+    later = now + mzsiri.TTS_BREAKER_COOLDOWN
+    health.record_failure(later)
+    assert health.state(later) == 'open'
+    assert health.state(later + mzsiri.TTS_BREAKER_COOLDOWN) == 'half_open'
+
+
+def test_router_fails_over_to_next_backend(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'fail', 'http': 'ok'})
+    name, _ = asyncio.run(router.run(1, None))
+    assert name == 'http'
+    assert pool.calls == ['gtts', 'http']
+
+
+def test_router_skips_open_backend(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'fail', 'http': 'ok'})
+    trip(router, 'gtts')
+    name, _ = asyncio.run(router.run(1, None))
+    assert name == 'http'
+    assert pool.calls == ['http']
+
+
+def test_half_open_backend_is_not_stuck_when_earlier_backend_succeeds(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'ok', 'http': 'ok'})
+    trip(router, 'gtts')
+    trip(router, 'http')
+    end_cooldown(router, 'gtts')
+    end_cooldown(router, 'http')
+
+    name, _ = asyncio.run(router.run(1, None))
+    assert name == 'gtts'
+    assert pool.calls == ['gtts']
+    assert health_of(router, 'http').state(time.monotonic()) == 'half_open'
+
+    # gtts ล่มอีกครั้ง: ข้อความถัดไปต้องย้ายไปทดลองใช้ http แทนที่จะ error
+    pool.outcomes['gtts'] = 'fail'
+    name, _ = asyncio.run(router.run(1, None))
+    assert name == 'http'
+    assert health_of(router, 'http').state(time.monotonic()) == 'closed'
+
+
+def test_cancelled_trial_clears_in_flight_flag(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'hang'})
+    trip(router, 'gtts')
+    end_cooldown(router, 'gtts')
+    health = health_of(router, 'gtts')
+
+    async def cancel_mid_trial():
+        task = asyncio.create_task(router.run(1, None))
+        await asyncio.sleep(0)
+        # ระหว่างทดลองอยู่ งานอื่นต้องไม่ถูกปล่อยผ่านไปทดลองซ้ำ
+        assert health.state(time.monotonic()) == 'open'
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_trial())
+    assert health.state(time.monotonic()) == 'half_open'
+
+
+def test_slow_backend_moves_behind_fast_one(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'ok', 'http': 'ok'})
+    now = time.monotonic()
+    for _ in range(5):
+        health_of(router, 'gtts').record_success(mzsiri.TTS_LATENCY_THRESHOLD + 1, now)
+    assert [h.backend.name for h in router.candidates()] == ['http', 'gtts']
+
+
+def test_all_open_still_tries_every_backend(monkeypatch):
+    router, pool = make_router(monkeypatch, {'gtts': 'fail', 'http': 'fail'})
+    trip(router, 'gtts')
+    trip(router, 'http')
+    with pytest.raises(RuntimeError):
+        asyncio.run(router.run(1, None))
+    assert pool.calls == ['gtts', 'http']